@@ -0,0 +1,13 @@
+'''
+Shared routines for the comparison of TCWret and Cloudnet
+
+The notebooks in compare_TCWret_and_Cloudnet and compare_different_ice_shapes
+import from here, e.g.
+
+    import sys
+    sys.path.append('..')
+    from evaluation import timeaxis
+
+The scripts in get_cloudnet are modules of the get_cloudnet package and are run
+from the top directory (python -m get_cloudnet.merge_data).
+'''
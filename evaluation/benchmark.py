@@ -0,0 +1,353 @@
+'''
+Benchmarks of the processing stages on synthetic data
+
+For every scale (see evaluation.synthetic) the files are generated once and the
+stages are run in order:
+
+    download    fetch the raw files from a local HTTP mirror (download_data.py --mirror)
+    merge       merge_data.main for every day, in this process
+    integrate   evaluation.cloudnet.integrate of the merged days
+    binning     2 minute bins of the Cloudnet profiles and the screened TCWret samples
+    intersect   bins present in both (evaluation.pipeline.collocate)
+    shapes      read, align and compare the habit files (evaluation.shapes)
+
+The time of a stage is the minimum of repeat runs, the peak memory is the
+tracemalloc peak of one further run (Python and NumPy allocations, without
+the netCDF library) and max_rss the high-water mark of the process after it.
+Throughput is given in the unit of the stage (bytes, profiles, samples, bins).
+
+Results are written as JSON and compared with a baseline: a stage regresses if
+its time exceeds the baseline by more than tolerance (and 10 ms) or its peak
+memory by more than memory_tolerance (and 1 MB). Times are only comparable on
+the same hardware, so the baseline records the host (operating system,
+architecture, CPU model, number of CPUs and memory) and a baseline of another
+host is refused; record one with --save-baseline on the host first.
+
+    python -m evaluation.benchmark --scales 1,10 -o results.json
+    python -m evaluation.benchmark --scales 1,10,100 --workdir /tmp/bench --save-baseline
+'''
+import argparse
+import datetime as dt
+import functools
+import http.server
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time as timer
+import tracemalloc
+
+import numpy as np
+
+from . import binning, cloudnet, pipeline, shapes, synthetic
+
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'baseline.json')
+SCALES = [1, 10, 100]
+REPEAT = 3
+TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.2
+SLACK = 0.01
+MEMORY_SLACK = 1.0
+DELTA = 2
+COMPARISON = 'lwp'
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    '''
+    Static files with keep-alive, Last-Modified/If-Modified-Since and single open ranges (bytes=N-)
+    with If-Range on the Last-Modified date
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        ranges = self.headers.get('Range', '')
+        fname = self.translate_path(self.path)
+        if not ranges.startswith('bytes=') or not ranges.endswith('-') or not os.path.isfile(fname):
+            return super().send_head()
+        last_modified = self.date_time_string(os.path.getmtime(fname))
+        if self.headers.get('If-Range', last_modified) != last_modified:
+            ## Changed since the partial file was started: the whole file
+            return super().send_head()
+        start = int(ranges[len('bytes='):-1])
+        size = os.path.getsize(fname)
+        if start >= size:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(size))
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        fobj = open(fname, 'rb')
+        fobj.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(fname))
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, size - 1, size))
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        return fobj
+
+class Mirror:
+    '''
+    Local HTTP server on a directory, used as context manager; url is set while it runs
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.url = None
+        self._server = None
+
+    def __enter__(self):
+        handler = functools.partial(_Handler, directory=self.path)
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}".format(self._server.server_address[1])
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+def _prepare_download(ctx):
+    shutil.rmtree(ctx['downloaded'], ignore_errors=True)
+
+def _download(ctx):
+    download_data = pipeline._script('download_data')
+    dates = ctx['files']['dates']
+    jobs = download_data.list_jobs(dates[0], dates[-1] + dt.timedelta(days=1), mirror=ctx['mirror'].url)
+    summary = download_data.download(jobs, ctx['downloaded'], 4, verbose=False)
+    if summary['failed'] or summary['missing']:
+        raise RuntimeError("Download from the mirror failed: {}".format(summary))
+    return sum(os.path.getsize(os.path.join(ctx['downloaded'], fname)) for fname in summary['downloaded'])
+
+def _merge(ctx):
+    merge_data = pipeline._script('merge_data')
+    os.makedirs(ctx['cnet'], exist_ok=True)
+    ## Not merge_all, its worker processes would be missed by tracemalloc
+    for year, month, day in merge_data.find_days(ctx['files']['raw']):
+        merge_data.main(month, day, year, ctx['files']['raw'], ctx['cnet'])
+    return ctx['files']['profiles']
+
+def _integrate(ctx):
+    ctx['cloudnet'] = cloudnet.integrate(ctx['cnet'])
+    return len(ctx['cloudnet'])
+
+def _prepare_binning(ctx):
+    comparison = pipeline.COMPARISONS[COMPARISON]
+    ctx['columns_a'], ctx['columns_b'] = pipeline.columns(COMPARISON)
+    ctx['tcwret'] = pipeline.screen(pipeline.load_tcwret(ctx['files']['tcwret']))
+    valid = ctx['cloudnet']['valid_' + comparison['quantity']]
+    ctx['profiles'] = ctx['cloudnet'].loc[valid, ['time'] + ctx['columns_b']].reset_index(drop=True)
+
+def _binning(ctx):
+    ctx['bins_a'] = binning.aggregate(ctx['tcwret'], DELTA, ctx['columns_a'])
+    ctx['bins_b'] = binning.aggregate(ctx['profiles'], DELTA, ctx['columns_b'])
+    return len(ctx['tcwret']) + len(ctx['profiles'])
+
+def _intersect(ctx):
+    ctx['matched'] = pipeline.collocate(ctx['bins_a'], ctx['bins_b'], ctx['columns_a'], ctx['columns_b'])
+    return len(ctx['bins_a']) + len(ctx['bins_b'])
+
+def _shapes(ctx):
+    tables = shapes.load(ctx['files']['habits'], workers=1)
+    times, cube, variables = shapes.align(tables, threshold=0.1)
+    shapes.spread(cube)
+    shapes.bias(cube)
+    return sum(len(table) for table in tables)
+
+## name -> (prepare (not timed), run (returns the number of items), unit)
+STAGES = {'download': (_prepare_download, _download, 'bytes'), \
+          'merge': (None, _merge, 'profiles'), \
+          'integrate': (None, _integrate, 'profiles'), \
+          'binning': (_prepare_binning, _binning, 'samples'), \
+          'intersect': (None, _intersect, 'bins'), \
+          'shapes': (None, _shapes, 'samples')}
+## stage -> stages using its results
+PREREQUISITES = {'merge': ['integrate', 'binning', 'intersect'], 'integrate': ['binning', 'intersect'], 'binning': ['intersect']}
+
+def _max_rss():
+    '''
+    High-water mark of the resident memory in bytes (ru_maxrss is in kB on Linux, bytes on macOS)
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def measure(ctx, prepare, run, repeat=REPEAT):
+    '''
+    Minimum time of repeat runs and tracemalloc peak of one more run
+    '''
+    seconds = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare(ctx)
+        start = timer.perf_counter()
+        items = run(ctx)
+        seconds.append(timer.perf_counter() - start)
+    if prepare is not None:
+        prepare(ctx)
+    tracemalloc.start()
+    try:
+        run(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    best = min(seconds)
+    return {'seconds': best, 'items': int(items), 'rate': items / best if best > 0 else float('nan'), \
+            'peak_mb': peak / 2**20, 'max_rss_mb': _max_rss() / 2**20}
+
+def run_scale(workdir, scale, repeat=REPEAT, stages=None, verbose=True):
+    '''
+    Generate (or reuse) the data of one scale in workdir and measure all stages
+    '''
+    path = os.path.join(workdir, 'scale_{:g}'.format(scale))
+    done = os.path.join(path, 'files.json')
+    if os.path.exists(done):
+        with open(done) as fobj:
+            files = json.load(fobj)
+        files['dates'] = [dt.date.fromisoformat(date) for date in files['dates']]
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+        files = synthetic.generate(path, scale)
+        with open(done, 'w') as fobj:
+            json.dump(files, fobj, default=str)
+    mirror = os.path.join(path, 'mirror')
+    synthetic.mirror(files['raw'], mirror, files['dates'])
+
+    ctx = {'files': files, 'downloaded': os.path.join(path, 'downloaded'), 'cnet': os.path.join(path, 'cnet')}
+    out = {}
+    with Mirror(mirror) as server:
+        ctx['mirror'] = server
+        for name, (prepare, run, unit) in STAGES.items():
+            if stages is not None and name not in stages:
+                ## Later stages read the results of these, run them once without measuring
+                if name in PREREQUISITES and any(later in stages for later in PREREQUISITES[name]):
+                    if prepare is not None:
+                        prepare(ctx)
+                    run(ctx)
+                continue
+            out[name] = measure(ctx, prepare, run, repeat)
+            out[name]['unit'] = unit
+            if verbose:
+                print("scale {:<5g} {:<10} {:>9.3f} s {:>12.4g} {}/s {:>9.1f} MB".format(scale, name, out[name]['seconds'], \
+                      out[name]['rate'], unit, out[name]['peak_mb']), file=sys.stderr)
+    return out
+
+## Keys of machine() which must match between the results and the baseline
+HOST = ['system', 'arch', 'cpu', 'cpus', 'memory_gb']
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as fobj:
+            for line in fobj:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+def _memory_gb():
+    try:
+        return int(round(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2**30))
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def machine():
+    return {'system': platform.system(), 'arch': platform.machine(), 'cpu': _cpu_model(), 'cpus': os.cpu_count(), \
+            'memory_gb': _memory_gb(), 'platform': platform.platform(), 'python': platform.python_version(), \
+            'numpy': np.__version__}
+
+def other_host(current, baseline):
+    '''
+    Host keys (see HOST) in which the machines of current and baseline differ
+    '''
+    return [key for key in HOST if current['machine'].get(key) != baseline.get('machine', {}).get(key)]
+
+def run(scales=SCALES, workdir=None, repeat=REPEAT, stages=None, verbose=True):
+    '''
+    Results of all scales as {'machine': ..., 'results': {scale: {stage: {...}}}}
+    '''
+    cleanup = workdir is None
+    workdir = tempfile.mkdtemp(prefix='benchmark_') if cleanup else workdir
+    try:
+        results = {'{:g}'.format(scale): run_scale(workdir, scale, repeat, stages, verbose) for scale in scales}
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {'created': dt.datetime.now().isoformat(timespec='seconds'), 'machine': machine(), 'results': results}
+
+def compare(current, baseline, tolerance=TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    '''
+    Regressions of current against baseline as a list of
+    (scale, stage, metric, value, baseline value); scales and stages missing
+    in the baseline are ignored
+    '''
+    regressions = []
+    for scale, stages in current['results'].items():
+        for name, result in stages.items():
+            reference = baseline['results'].get(scale, {}).get(name)
+            if reference is None:
+                continue
+            if result['seconds'] > reference['seconds']*(1 + tolerance) + SLACK:
+                regressions.append((scale, name, 'seconds', result['seconds'], reference['seconds']))
+            if result['peak_mb'] > reference['peak_mb']*(1 + memory_tolerance) + MEMORY_SLACK:
+                regressions.append((scale, name, 'peak_mb', result['peak_mb'], reference['peak_mb']))
+    return regressions
+
+def print_report(current, baseline=None):
+    print("scale\tstage\tseconds\trate\tunit\tpeak(MB)\tbaseline(s)\tbaseline(MB)")
+    for scale, stages in current['results'].items():
+        for name, result in stages.items():
+            reference = {} if baseline is None else baseline['results'].get(scale, {}).get(name, {})
+            print("{}\t{}\t{:.3f}\t{:.4g}\t{}/s\t{:.1f}\t{}\t{}".format(scale, name, result['seconds'], result['rate'], result['unit'], \
+                  result['peak_mb'], "{:.3f}".format(reference['seconds']) if reference else '-', \
+                  "{:.1f}".format(reference['peak_mb']) if reference else '-'))
+
+def _save(fname, data):
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    with open(fname, 'w') as fobj:
+        json.dump(data, fobj, indent=1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic data")
+    parser.add_argument('--scales', type=lambda text: [float(value) for value in text.split(',')], default=SCALES, \
+                        help="Campaign sizes relative to evaluation.synthetic, e.g. 1,10,100")
+    parser.add_argument('--stages', type=lambda text: text.split(','), default=None, help="Subset of " + ",".join(STAGES))
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--workdir', default=None, help="Keep and reuse the synthetic data here")
+    parser.add_argument('-o', '--output', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store the results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Allowed relative increase of the time")
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE, help="Allowed relative increase of the peak memory")
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args()
+
+    current = run(args.scales, args.workdir, args.repeat, args.stages, not args.quiet)
+    if args.output:
+        _save(args.output, current)
+    if args.save_baseline:
+        _save(args.baseline, current)
+        print_report(current)
+        sys.exit(0)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fobj:
+            baseline = json.load(fobj)
+    print_report(current, baseline)
+    if baseline is not None:
+        differ = other_host(current, baseline)
+        if differ:
+            print("Baseline {} was recorded on another host ({}), record one for this host with --save-baseline".format( \
+                  args.baseline, ", ".join("{}: {} here, {} there".format(key, current['machine'].get(key), \
+                                                                          baseline.get('machine', {}).get(key)) for key in differ)), \
+                  file=sys.stderr)
+            sys.exit(2)
+        regressions = compare(current, baseline, args.tolerance, args.memory_tolerance)
+        for scale, name, metric, value, reference in regressions:
+            print("Regression: scale {} {} {} {:.3f} (baseline {:.3f})".format(scale, name, metric, value, reference), file=sys.stderr)
+        sys.exit(1 if regressions else 0)
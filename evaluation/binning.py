@@ -0,0 +1,128 @@
+'''
+Average time series into fixed time bins
+
+Replaces the while-loops of the notebooks which stepped through the campaign in
+steps of delta minutes and searched the whole table in every step. Here the
+table is sorted once and all bins and all columns are reduced in one pass.
+
+As in the notebooks, a sample belongs to bin [t, t+delta) only if it lies
+strictly inside the bin, samples falling exactly on a bin edge are dropped.
+Bins are labelled by their start and only bins containing data are returned.
+ORIGIN and STOP span the PS106 cruise and are used when origin or stop is None,
+data of other campaigns need their own range.
+'''
+import numpy as np
+import pandas as pd
+
+from . import instrument
+
+ORIGIN = np.datetime64("2017-05-24T20:25:00")
+STOP = np.datetime64("2017-07-18T00:00:00")
+
+def _mean(values, starts, counts, index):
+    return np.add.reduceat(values, starts) / counts
+
+def _count(values, starts, counts, index):
+    return counts.copy()
+
+def _sum(values, starts, counts, index):
+    return np.add.reduceat(values, starts)
+
+def _std(values, starts, counts, index):
+    mean = np.add.reduceat(values, starts) / counts
+    return np.sqrt(np.add.reduceat((values - mean[index])**2, starts) / counts)
+
+def _err_mean(values, starts, counts, index):
+    '''
+    Error of the mean of uncorrelated values with errors values: sqrt(sum(err**2))/n
+    '''
+    return np.sqrt(np.add.reduceat(values**2, starts)) / counts
+
+def _min(values, starts, counts, index):
+    return np.minimum.reduceat(values, starts)
+
+def _max(values, starts, counts, index):
+    return np.maximum.reduceat(values, starts)
+
+REDUCERS = {'mean': _mean, 'count': _count, 'sum': _sum, 'std': _std, \
+            'err_mean': _err_mean, 'min': _min, 'max': _max}
+
+def _columns(table, columns, time):
+    '''
+    Normalise the column specification to a list of (output, input, reducer)
+    '''
+    if columns is None:
+        columns = [key for key in table.columns if key != time]
+    if not isinstance(columns, dict):
+        columns = {key: 'mean' for key in columns}
+    spec = []
+    for out, how in columns.items():
+        column, reducer = (out, how) if isinstance(how, str) else how
+        if reducer not in REDUCERS:
+            raise ValueError("Unknown reducer {}, use one of {}".format(reducer, ", ".join(REDUCERS)))
+        spec.append((out, column, reducer))
+    return spec
+
+class Binner:
+    '''
+    Sorted view of a time indexed table. Sorting is done once, so the table can be
+    aggregated cheaply for several bin widths.
+    '''
+    def __init__(self, table, origin=ORIGIN, stop=STOP, time='time'):
+        self.time = time
+        self.origin = np.datetime64(ORIGIN if origin is None else origin, 's')
+        self.stop = np.datetime64(STOP if stop is None else stop, 's')
+        seconds = (np.asarray(table[time], dtype='datetime64[s]') - self.origin).astype('i8')
+        order = np.argsort(seconds, kind='stable')
+        self.seconds = seconds[order]
+        self.table = table
+        self.order = order
+        self._values = {}
+
+    def values(self, column):
+        if column not in self._values:
+            self._values[column] = np.asarray(self.table[column], dtype='f8')[self.order]
+        return self._values[column]
+
+    def bins(self, delta):
+        '''
+        Return (bin number, position of the selected samples in sorted order) for bins of delta minutes
+        '''
+        width = int(round(delta*60))
+        nbins = int(np.ceil((self.stop - self.origin).astype('i8') / width))
+        number = self.seconds // width
+        valid = (self.seconds > 0) & (self.seconds % width != 0) & (number < nbins)
+        return number[valid], np.flatnonzero(valid)
+
+    def aggregate(self, delta, columns=None):
+        number, select = self.bins(delta)
+        starts = np.flatnonzero(np.concatenate(([True], number[1:] != number[:-1]))) if number.size else np.array([], dtype=int)
+        counts = np.diff(np.concatenate((starts, [number.size])))
+        index = np.repeat(np.arange(starts.size), counts)
+        out = {self.time: self.origin + (number[starts]*int(round(delta*60))).astype('timedelta64[s]')}
+        for name, column, reducer in _columns(self.table, columns, self.time):
+            if starts.size == 0:
+                out[name] = np.array([], dtype=int if reducer == 'count' else 'f8')
+            else:
+                out[name] = REDUCERS[reducer](self.values(column)[select], starts, counts, index)
+        return pd.DataFrame(out)
+
+@instrument.timed('binning.aggregate')
+def aggregate(table, delta, columns=None, origin=ORIGIN, stop=STOP, time='time'):
+    '''
+    Average table into bins of delta minutes between origin and stop.
+
+    columns is a list of columns to average or a dictionary
+    {output: reducer} or {output: (input column, reducer)} with reducer one of
+    mean, count, sum, std (ddof=0), err_mean (error propagating mean), min, max.
+    Default: mean of all columns except time.
+    '''
+    return Binner(table, origin, stop, time).aggregate(delta, columns)
+
+@instrument.timed('binning.sweep')
+def sweep(table, deltas, columns=None, origin=ORIGIN, stop=STOP, time='time'):
+    '''
+    aggregate for several bin widths, the table is sorted only once. Returns {delta: DataFrame}.
+    '''
+    binner = Binner(table, origin, stop, time)
+    return {delta: binner.aggregate(delta, columns) for delta in deltas}
@@ -0,0 +1,114 @@
+'''
+Bootstrap confidence intervals for the comparison statistics
+
+For every pair of matched arrays (TCWret x, Cloudnet y) the Pearson r, the
+mean difference (bias, x - y) and the standard deviation of the difference (SD)
+are computed together with percentile confidence intervals. Replicates are
+drawn as a (replicate, sample) index matrix and evaluated in batches with
+NumPy. With block > 1 a moving block bootstrap is used, which keeps blocks of
+consecutive samples together to respect the autocorrelation in time (samples
+must then be in time order). Large replicate counts are split across a process
+pool.
+
+    rows = split(xax, yax, {'All': None, 'PWV < 1.0': cax < 1.0})
+    print(table(rows, n_replicates=10000, block=5))
+'''
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+BATCH_SIZE = 4000000
+PARALLEL_SIZE = 20000000
+
+def summary(x, y):
+    '''
+    The statistics printed by the notebooks: Pearson r, p-value, mean and SD of x - y, number
+    '''
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    r, p = scipy.stats.pearsonr(x, y) if x.size > 1 else (np.nan, np.nan)
+    diff = x - y
+    return {'r': r, 'p': p, 'bias': np.mean(diff), 'sd': np.std(diff), 'n': x.size}
+
+def indices(rng, n_replicates, n, block=None):
+    '''
+    Index matrix (replicate, sample). With block > 1: moving block bootstrap
+    '''
+    if block is None or block <= 1:
+        return rng.integers(0, n, size=(n_replicates, n))
+    block = min(int(block), n)
+    n_blocks = -(-n // block)
+    starts = rng.integers(0, n - block + 1, size=(n_replicates, n_blocks))
+    return (starts[:, :, None] + np.arange(block)).reshape(n_replicates, -1)[:, :n]
+
+def statistics(x, y):
+    '''
+    Pearson r, bias and SD along the last axis
+    '''
+    mx = x.mean(axis=-1, keepdims=True)
+    my = y.mean(axis=-1, keepdims=True)
+    dx = x - mx
+    dy = y - my
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (dx*dy).sum(axis=-1) / np.sqrt((dx**2).sum(axis=-1) * (dy**2).sum(axis=-1))
+    diff = x - y
+    return r, diff.mean(axis=-1), diff.std(axis=-1)
+
+def _replicates(x, y, n_replicates, block, seed):
+    '''
+    Statistics of n_replicates bootstrap replicates, evaluated in batches
+    '''
+    rng = np.random.default_rng(seed)
+    batch = max(1, BATCH_SIZE // max(x.size, 1))
+    out = []
+    for start in range(0, n_replicates, batch):
+        idx = indices(rng, min(batch, n_replicates - start), x.size, block)
+        out.append(np.stack(statistics(x[idx], y[idx])))
+    return np.concatenate(out, axis=1)
+
+def replicates(x, y, n_replicates=10000, block=None, seed=None, workers=None):
+    '''
+    Array (3, n_replicates) with r, bias and SD of every replicate
+    '''
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    if workers == 1 or n_replicates * x.size < PARALLEL_SIZE:
+        return _replicates(x, y, n_replicates, block, seed)
+    n_workers = workers or os.cpu_count() or 1
+    counts = [len(chunk) for chunk in np.array_split(np.arange(n_replicates), n_workers) if len(chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_replicates, x, y, count, block, seq) for count, seq in zip(counts, seeds)]
+        return np.concatenate([future.result() for future in futures], axis=1)
+
+def split(x, y, masks):
+    '''
+    Dictionary label -> (x[mask], y[mask]) for all masks, None selects everything
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    return {label: (x, y) if mask is None else (x[mask], y[mask]) for label, mask in masks.items()}
+
+def table(pairs, n_replicates=10000, block=None, confidence=0.95, seed=0, workers=None):
+    '''
+    One row per label of pairs (label -> (x, y)) with n, r, p, bias and SD and
+    their confidence intervals (columns *_lo, *_hi).
+    '''
+    alpha = (1.0 - confidence) / 2 * 100
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs))
+    rows = []
+    for (label, (x, y)), seq in zip(pairs.items(), seeds):
+        row = {'data': label}
+        row.update(summary(x, y))
+        if row['n'] > 1:
+            lo, hi = np.nanpercentile(replicates(x, y, n_replicates, block, seq, workers), [alpha, 100 - alpha], axis=1)
+        else:
+            lo = hi = np.full(3, np.nan)
+        for ii, key in enumerate(['r', 'bias', 'sd']):
+            row[key + '_lo'] = lo[ii]
+            row[key + '_hi'] = hi[ii]
+        rows.append(row)
+    columns = ['data', 'n', 'r', 'r_lo', 'r_hi', 'p', 'bias', 'bias_lo', 'bias_hi', 'sd', 'sd_lo', 'sd_hi']
+    return pd.DataFrame(rows, columns=columns)
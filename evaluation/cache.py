@@ -0,0 +1,113 @@
+'''
+Disk cache for the results of the pipeline stages
+
+Every entry is one pickle file named by its key. The modification time of a
+file is its last use: get() touches the file and, when the total size exceeds
+max_size, the least recently used entries are removed.
+
+    cache = Cache('.cache', '2G')
+    table = cache.get(key)
+    if table is None:
+        table = compute()
+        cache.put(key, table)
+'''
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+SUFFIX = '.pkl'
+UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+def parse_size(size):
+    '''
+    Size in bytes from a number or a string like 500M or 2G
+    '''
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().rstrip('B')
+    unit = size[-1] if size and size[-1] in UNITS else ''
+    return int(float(size[:len(size)-len(unit)]) * UNITS[unit])
+
+def make_key(*parts):
+    '''
+    Hash of JSON serialisable parts
+    '''
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class Cache:
+    '''
+    Pickle files in path, at most max_size bytes, evicted least recently used first
+    '''
+    def __init__(self, path, max_size='1G'):
+        self.path = path
+        self.max_size = parse_size(max_size)
+        os.makedirs(path, exist_ok=True)
+
+    def _fname(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.exists(self._fname(key))
+
+    def get(self, key, default=None):
+        fname = self._fname(key)
+        try:
+            with open(fname, 'rb') as fobj:
+                value = pickle.load(fobj)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        os.utime(fname)
+        return value
+
+    def put(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                pickle.dump(value, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._fname(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        '''
+        List of (last use, size, file name), oldest first
+        '''
+        out = []
+        for fname in os.listdir(self.path):
+            if not fname.endswith(SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, fname))
+            except OSError:
+                continue
+            out.append((stat.st_mtime, stat.st_size, fname))
+        return sorted(out)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_size=None):
+        '''
+        Remove the least recently used entries until the cache fits into max_size
+        '''
+        max_size = self.max_size if max_size is None else parse_size(max_size)
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, fname in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, fname))
+            except OSError:
+                pass
+            total -= size
+        return total
+
+    def clear(self):
+        return self.evict(0)
@@ -0,0 +1,235 @@
+'''
+Column quantities of the merged Cloudnet files (cnet_MM_DD.nc)
+
+All profiles of a day are processed at once on the (time, level) arrays. A
+profile is rejected if one of its levels has a retrieval status contained in
+the list of invalid status codes. Missing values are returned as NaN and every
+group of quantities comes with a validity flag, which is False if the profile
+was rejected or one of the quantities is missing.
+
+    liquid: lwp(gm-2), lwp_mwr(gm-2), lwp_err_mwr(gm-2)                valid_liquid
+    ice:    iwp(gm-2), diwp(gm-2), rice(um), drice(um)                 valid_ice
+    rliq:   rliq(um), drliq(um), rliq_max(um), drliq_max(um),
+            rliq_bottom(um), drliq_bottom(um)                          valid_rliq
+
+lwp is the sum of liquid_water_path_per_layer, iwp the sum of
+ice_water_path_per_layer. diwp = sum(iwc*10**iwc_error*1e-2*dz), rice and rliq
+are averaged over the cloudy levels, rliq_bottom over the second and third
+cloudy level. As in the original loops a level is cloudy if its ice or liquid
+water path per layer is > 0 or missing (water detected, but not retrieved).
+
+The cloudy pixels are handled as sparse index (evaluation.sparse), so sums and
+means run over the cloudy pixels only. Files written by merge_data.py contain
+the index (liquid_offset, liquid_level, ice_offset, ice_level) and the status
+flags (*_status_flags), older files are indexed when read.
+
+Files merged with merge_data.py --compact (layout = 'compact') store missing
+values as NaN; they are read as plain arrays without masking.
+'''
+import os
+import numpy as np
+import pandas as pd
+
+from . import errors, instrument, sparse, store, timeaxis
+
+LWC_INVALID = [4, 5, 6]
+IWC_INVALID = [2, 5, 6]
+REFF_INVALID = [2]
+
+QUANTITIES = ('liquid', 'ice', 'rliq')
+
+VARIABLES = {'liquid': ['liquid_water_path_per_layer', 'liquid_water_content_status', 'liquid_water_path_MWR', 'liquid_water_path_error_MWR'], \
+             'ice': ['height', 'ice_water_content', 'ice_water_path_per_layer', 'ice_water_content_status', 'ice_water_content_error', 'reff_ice', 'reff_ice_error'], \
+             'rliq': ['liquid_water_path_per_layer', 'reff_Frisch', 'reff_Frisch_error', 'reff_Frisch_status']}
+STATUS = {'liquid': 'liquid_water_content_status', 'ice': 'ice_water_content_status', 'rliq': 'reff_Frisch_status'}
+PATH = {'liquid': 'liquid_water_path_per_layer', 'ice': 'ice_water_path_per_layer'}
+
+def list_files(path):
+    '''
+    Names of the merged files in path in time order
+    '''
+    return [os.path.basename(fname) for _, fname in store.list_days(path)]
+
+def _split(values):
+    '''
+    Masked array -> (data as float, mask as bool array), NaN counts as missing
+    '''
+    values = np.ma.asarray(values)
+    data = np.ma.getdata(values).astype('f8')
+    return data, np.ma.getmaskarray(values) | np.isnan(data)
+
+def _status_invalid(status, invalid):
+    return np.isin(np.ma.filled(status, 0), np.asarray(invalid)).any(axis=-1)
+
+def _invalid(var, quantity, invalid):
+    '''
+    Profiles with an invalid status, looked up in the status flags if the file has an index
+    '''
+    name = STATUS[quantity]
+    if name + '_flags' in var:
+        return sparse.flags_invalid(var[name + '_flags'], invalid)
+    return _status_invalid(var[name], invalid)
+
+def _pixels(var, phase):
+    '''
+    (offset, level) of the cloudy pixels, from the index of the file or from the water path per layer
+    '''
+    if phase + '_offset' in var:
+        return np.asarray(var[phase + '_offset'], dtype='i8'), np.asarray(var[phase + '_level'], dtype='i8')
+    path, path_mask = _split(var[PATH[phase]])
+    return sparse.index(path_mask | (path > 0.0))
+
+def _path_sum(var, phase, offset, level):
+    '''
+    Column integral of the water path per layer, NaN if all levels are missing
+    '''
+    path, path_mask = sparse.gather(var[PATH[phase]], offset, level)
+    out = sparse.segment_sum(path, offset, path_mask)
+    ## Levels outside the index are clear sky with a finite path, so a profile
+    ## has no finite level if all levels are cloudy and all of them are missing
+    clear = np.shape(var[PATH[phase]])[-1] - np.diff(offset)
+    finite = clear + sparse.segment_count(offset, path_mask)
+    out[finite == 0] = np.nan
+    return out
+
+def liquid(var, invalid=LWC_INVALID):
+    offset, level = _pixels(var, 'liquid')
+    lwp_mwr, lwp_mwr_mask = _split(var['liquid_water_path_MWR'])
+    lwp_err, lwp_err_mask = _split(var['liquid_water_path_error_MWR'])
+    out = {'lwp(gm-2)': _path_sum(var, 'liquid', offset, level), \
+           'lwp_mwr(gm-2)': np.where(lwp_mwr_mask, np.nan, lwp_mwr), \
+           'lwp_err_mwr(gm-2)': np.where(lwp_err_mask, np.nan, lwp_err)}
+    out['valid_liquid'] = ~_invalid(var, 'liquid', invalid) & \
+                          ~np.isnan(out['lwp(gm-2)']) & ~lwp_mwr_mask
+    return out
+
+def ice(var, invalid=IWC_INVALID):
+    height = np.ma.getdata(var['height']).astype('f8')
+    dz = np.concatenate((np.diff(height), [0]))
+    offset, level = _pixels(var, 'ice')
+    iwc, iwc_mask = sparse.gather(var['ice_water_content'], offset, level)
+    iwc_err, iwc_err_mask = sparse.gather(var['ice_water_content_error'], offset, level)
+    rice, rice_mask = sparse.gather(var['reff_ice'], offset, level)
+    rice_err, rice_err_mask = sparse.gather(var['reff_ice_error'], offset, level)
+
+    out = {'iwp(gm-2)': _path_sum(var, 'ice', offset, level), \
+           'diwp(gm-2)': errors.path_error(iwc, iwc_err, dz[level], offset, iwc_mask | iwc_err_mask), \
+           'rice(um)': sparse.segment_mean(rice, offset, rice_mask), \
+           'drice(um)': errors.mean_error(rice_err, offset, rice_err_mask)}
+    valid = ~_invalid(var, 'ice', invalid) & (np.diff(offset) > 0)
+    for key in ['iwp(gm-2)', 'diwp(gm-2)', 'rice(um)', 'drice(um)']:
+        valid &= ~np.isnan(out[key])
+    out['valid_ice'] = valid
+    return out
+
+def rliq(var, invalid=REFF_INVALID):
+    offset, level = _pixels(var, 'liquid')
+    reff, reff_mask = sparse.gather(var['reff_Frisch'], offset, level)
+    reff_err, reff_err_mask = sparse.gather(var['reff_Frisch_error'], offset, level)
+    position = sparse.position(offset)
+    bottom = (position == 1) | (position == 2)
+    out = {'rliq(um)': sparse.segment_mean(reff, offset, reff_mask), \
+           'drliq(um)': errors.mean_error(reff_err, offset, reff_err_mask), \
+           'rliq_max(um)': sparse.segment_max(reff, offset, reff_mask), \
+           'drliq_max(um)': sparse.segment_max(reff_err, offset, reff_err_mask), \
+           'rliq_bottom(um)': sparse.segment_mean(reff, offset, ~bottom | reff_mask), \
+           'drliq_bottom(um)': errors.mean_error(reff_err, offset, ~bottom | reff_err_mask)}
+    ## rliq_bottom needs at least three cloudy levels
+    valid = ~_invalid(var, 'rliq', invalid) & (np.diff(offset) >= 3)
+    for key in out:
+        valid &= ~np.isnan(out[key])
+    out['valid_rliq'] = valid
+    return out
+
+@instrument.timed('cloudnet.compute')
+def compute(var, quantities=QUANTITIES, lwc_invalid=LWC_INVALID, iwc_invalid=IWC_INVALID, reff_invalid=REFF_INVALID):
+    '''
+    Column quantities from a dictionary of (time, level) variables
+    '''
+    out = {}
+    for quantity in quantities:
+        if quantity == 'liquid':
+            out.update(liquid(var, lwc_invalid))
+        elif quantity == 'ice':
+            out.update(ice(var, iwc_invalid))
+        elif quantity == 'rliq':
+            out.update(rliq(var, reff_invalid))
+        else:
+            raise ValueError("Unknown quantity {}, use one of {}".format(quantity, ", ".join(QUANTITIES)))
+    return out
+
+def variables(quantities=QUANTITIES, indexed=False):
+    '''
+    Names of the variables needed for quantities. With indexed=True the pixel
+    index and the status flags are read instead of the status fields.
+    '''
+    names = set(name for quantity in quantities for name in VARIABLES[quantity])
+    if indexed:
+        for quantity in quantities:
+            phase = 'ice' if quantity == 'ice' else 'liquid'
+            names.update([phase + '_offset', phase + '_level', STATUS[quantity] + '_flags'])
+            names.discard(STATUS[quantity])
+    return sorted(names)
+
+def is_indexed(f):
+    return 'liquid_offset' in f.variables
+
+@instrument.timed('cloudnet.read')
+def read(f, names, start=None, stop=None):
+    '''
+    Variables of an open merged file for the profiles [start, stop), compact
+    files are read without masking. The pixel index is cut to the profiles and
+    its offsets start at 0.
+    '''
+    compact = getattr(f, 'layout', None) == 'compact'
+    window = slice(start, stop)
+    offsets = {}
+    out = {}
+    for name in names:
+        var = f.variables[name]
+        var.set_auto_mask(not compact)
+        dimension = var.dimensions[0] if var.dimensions else None
+        if dimension == 'time':
+            out[name] = var[window]
+        elif dimension == 'time_offset':
+            offset = np.asarray(var[slice(start, None if stop is None else stop + 1)], dtype='i8')
+            offsets[name[:-len('_offset')]] = (offset[0], offset[-1])
+            out[name] = offset - offset[0]
+        else:
+            out[name] = var[:]
+    for name in names:
+        phase = name[:-len('_level')]
+        if name.endswith('_level') and phase in offsets:
+            out[name] = f.variables[name][slice(*offsets[phase])]
+    return out
+
+@instrument.timed('cloudnet.integrate_day')
+def integrate_day(fname, quantities=QUANTITIES, lwc_invalid=LWC_INVALID, iwc_invalid=IWC_INVALID, reff_invalid=REFF_INVALID):
+    '''
+    Column quantities of all profiles of one cnet_MM_DD.nc file as dictionary of arrays
+    '''
+    with instrument.dataset(fname) as f:
+        out = {'time': timeaxis.read_time(f.variables['datetime'])}
+        var = read(f, variables(quantities, is_indexed(f)))
+    out.update(compute(var, quantities, lwc_invalid, iwc_invalid, reff_invalid))
+    return out
+
+@instrument.timed('cloudnet.integrate')
+def integrate(path, quantities=QUANTITIES, lwc_invalid=LWC_INVALID, iwc_invalid=IWC_INVALID, reff_invalid=REFF_INVALID):
+    '''
+    Column quantities of all profiles of all cnet_MM_DD.nc files in path as one DataFrame
+    '''
+    days = [integrate_day(os.path.join(path, fname), quantities, lwc_invalid, iwc_invalid, reff_invalid) for fname in list_files(path)]
+    if not days:
+        return pd.DataFrame({'time': np.array([], dtype='datetime64[s]')})
+    return pd.DataFrame({key: np.concatenate([day[key] for day in days]) for key in days[0]})
+
+@instrument.timed('cloudnet.integrate_store')
+def integrate_store(store, start=None, stop=None, quantities=QUANTITIES, lwc_invalid=LWC_INVALID, iwc_invalid=IWC_INVALID, reff_invalid=REFF_INVALID):
+    '''
+    As integrate, but reading the time range [start, stop) of an evaluation.store.Store
+    '''
+    var = store.read([name for name in variables(quantities) if name != 'height'], start, stop)
+    out = {'time': var['time']}
+    out.update(compute(var, quantities, lwc_invalid, iwc_invalid, reff_invalid))
+    return pd.DataFrame(out)
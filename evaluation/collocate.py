@@ -0,0 +1,105 @@
+'''
+Collocation of TCWret retrievals and Cloudnet profiles
+
+Instead of averaging both data sets into the same 2-minute bins and intersecting
+the bin times, every TCWret sample is paired with all Cloudnet profiles within
++-window seconds (and optionally within max_distance km). The Cloudnet times
+are sorted once and the window limits are found by binary search, i.e. the cost
+is O((N+M) log M) plus the number of pairs, no bin grid is materialized.
+
+    pairs = collocate(tcwret['time'], cloudnet['time'], window=60)
+    matched = average(pairs, cloudnet, ['lwp_mwr(gm-2)'], len(tcwret))
+'''
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6371.0
+
+def distance(lat_a, lon_a, lat_b, lon_b):
+    '''
+    Great circle distance in km (haversine)
+    '''
+    lat_a, lon_a, lat_b, lon_b = [np.radians(np.asarray(ii, dtype='f8')) for ii in (lat_a, lon_a, lat_b, lon_b)]
+    hav = np.sin((lat_b - lat_a)/2)**2 + np.cos(lat_a)*np.cos(lat_b)*np.sin((lon_b - lon_a)/2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0)))
+
+def collocate(time_a, time_b, window, lat_a=None, lon_a=None, lat_b=None, lon_b=None, max_distance=None, nearest=False):
+    '''
+    Return a DataFrame of pairs (idx_a, idx_b, dt(s)[, distance(km)]) with
+    |time_b - time_a| <= window seconds, sorted by idx_a and |dt|, the earlier
+    profile first for equal |dt|. Samples and profiles without a time (NaT) have
+    no partner.
+
+    If max_distance is given, the pairs are also filtered by the distance between
+    (lat_a, lon_a) and (lat_b, lon_b) in km. lat_b and lon_b may be scalars, e.g.
+    for a station. With nearest=True only the closest profile in time is kept for
+    each sample of a (an as-of join with tolerance window).
+    '''
+    time_a = np.asarray(time_a, dtype='datetime64[s]')
+    time_b = np.asarray(time_b, dtype='datetime64[s]')
+    ## NaT is the smallest int64, NaT - window would wrap around
+    valid_a = ~np.isnat(time_a)
+    valid_b = np.flatnonzero(~np.isnat(time_b))
+    sec_a = np.where(valid_a, time_a.astype('i8'), 0)
+    sec_b = time_b.astype('i8')
+    order = valid_b[np.argsort(sec_b[valid_b], kind='stable')]
+    sorted_b = sec_b[order]
+    window = int(np.ceil(window))
+    lo = np.searchsorted(sorted_b, sec_a - window, side='left')
+    hi = np.searchsorted(sorted_b, sec_a + window, side='right')
+    counts = np.where(valid_a, hi - lo, 0)
+    idx_a = np.repeat(np.arange(sec_a.size), counts)
+    offset = np.arange(idx_a.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    idx_b = order[np.repeat(lo, counts) + offset]
+    delta = sec_b[idx_b] - sec_a[idx_a]
+    out = {'idx_a': idx_a, 'idx_b': idx_b, 'dt(s)': delta}
+
+    if max_distance is not None:
+        if lat_a is None or lon_a is None or lat_b is None or lon_b is None:
+            raise ValueError("max_distance needs lat_a, lon_a, lat_b and lon_b")
+        lat_b = np.broadcast_to(np.asarray(lat_b, dtype='f8'), sec_b.shape)
+        lon_b = np.broadcast_to(np.asarray(lon_b, dtype='f8'), sec_b.shape)
+        dist = distance(np.asarray(lat_a)[idx_a], np.asarray(lon_a)[idx_a], lat_b[idx_b], lon_b[idx_b])
+        keep = dist <= max_distance
+        out = {key: value[keep] for key, value in out.items()}
+        out['distance(km)'] = dist[keep]
+
+    ## Sort by sample and absolute time difference
+    rank = np.lexsort((np.abs(out['dt(s)']), out['idx_a']))
+    out = {key: value[rank] for key, value in out.items()}
+    if nearest and out['idx_a'].size:
+        first = np.concatenate(([True], out['idx_a'][1:] != out['idx_a'][:-1]))
+        out = {key: value[first] for key, value in out.items()}
+    return pd.DataFrame(out)
+
+def average(pairs, table_b, columns, size_a):
+    '''
+    Average columns of table_b over all partners of each sample of a. Returns a
+    DataFrame with size_a rows, NaN where a sample has no partner, and the number
+    of partners in column dp.
+    '''
+    counts = np.bincount(pairs['idx_a'], minlength=size_a)
+    out = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for key in columns:
+            values = np.asarray(table_b[key], dtype='f8')[np.asarray(pairs['idx_b'])]
+            out[key] = np.bincount(pairs['idx_a'], weights=values, minlength=size_a) / counts
+    out['dp'] = counts
+    return pd.DataFrame(out)
+
+def match(table_a, table_b, window, columns_a, columns_b, time='time', **kwargs):
+    '''
+    Table of all TCWret samples with at least one Cloudnet partner: time and
+    columns_a of table_a next to the averaged columns_b of table_b. Equal column
+    names of table_b get the suffix _cnet.
+    '''
+    pairs = collocate(table_a[time], table_b[time], window, **kwargs)
+    averaged = average(pairs, table_b, columns_b, len(table_a))
+    keep = np.asarray(averaged['dp']) > 0
+    out = {time: np.asarray(table_a[time])[keep]}
+    for key in columns_a:
+        out[key] = np.asarray(table_a[key])[keep]
+    for key in columns_b:
+        out[key + '_cnet' if key in out else key] = np.asarray(averaged[key])[keep]
+    out['dp'] = np.asarray(averaged['dp'])[keep]
+    return pd.DataFrame(out)
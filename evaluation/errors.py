@@ -0,0 +1,336 @@
+'''
+Propagation of the retrieval errors to derived quantities
+
+TCWret retrieves the state (tl, ti, rliq, rice): liquid and ice optical depth
+and effective radii. Its covariance is the stored one, the covariance_matrix
+of a TCWret netCDF file or the cov block of a result table (evaluation.tcwret).
+Only if none is stored it is reconstructed by covariance() from the stored
+errors and the averaging kernel A, assuming an optimal estimation retrieval
+with diagonal prior covariance Sa: the posterior covariance is (I - A) Sa, and
+Sa follows from the stored variances, err**2 = (1 - A_ii) Sa_ii. Without
+averaging kernels the errors are taken as independent.
+
+Derived quantities are functions of the state (vectorised over a trailing
+state axis), e.g. total_optical_depth, ice_fraction, and the water paths,
+which are path factor * optical depth * radius with the factor taken from the
+stored path of each sample. Their errors are computed
+
+    linear       sqrt(J S J^T) with the Jacobian J from central differences
+    monte_carlo  mean and SD of the function of draws from N(x, S), computed
+                 for all (sample, draw) pairs at once in chunks of samples,
+                 optionally in worker processes; the result does not depend
+                 on the number of workers
+
+For Cloudnet, path_error and mean_error give the errors of the column paths
+(e.g. sum(iwc*10**iwc_error*1e-2*dz)) and of the layer averaged radii on the
+sparse cloudy pixels (evaluation.sparse), for fully correlated (as in the
+notebooks) or independent levels.
+
+SCALE holds the ratio of the actual to the reported TCWret error found in the
+test cases (scale_factor), by which the notebooks multiply the TCWret errors.
+
+    state = read('TCWret.nc')
+    cov = state_covariance(state)
+    fi, dfi = linear(ice_fraction, state['x'], cov)
+    iwp, diwp = monte_carlo(ice_water_path, state['x'], cov, state['factors']['iwp(gm-2)'], draws=1000, workers=4)
+'''
+import argparse
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import instrument, sparse
+
+## State vector of TCWret: (file variable, column)
+STATE = [('liquid_water_optical_depth', 'tl(1)'), ('ice_water_optical_depth', 'ti(1)'), \
+         ('liquid_water_effective_droplet_radius', 'rliq(um)'), ('ice_water_effective_droplet_radius', 'rice(um)')]
+TL, TI, RL, RI = range(4)
+
+## Columns of the state in a TCWret result table (evaluation.tcwret.STATE)
+RESULT_COLUMNS = ['tl(1)', 'ti(1)', 'rl(um)', 'ri(um)']
+COVARIANCE = 'covariance_matrix'
+AVERAGING_KERNEL = 'averaging_kernel_matrix'
+
+## Stored paths: column -> (file variable, optical depth, radius)
+PATHS = {'lwp(gm-2)': ('liquid_water_path', TL, RL), 'iwp(gm-2)': ('ice_water_path', TI, RI)}
+
+## Actual / reported TCWret error in the test cases
+SCALE = {'lwp(gm-2)': 2.6, 'iwp(gm-2)': 9.85/5.06, 'rice(um)': 9.68/2.32, 'rliq(um)': 3.35/2.13}
+
+DRAWS = 1000
+## Samples times draws held in memory at once by monte_carlo
+CHUNK_VALUES = 2000000
+STEP = 1e-6
+
+def total_optical_depth(x):
+    return x[..., TL] + x[..., TI]
+
+def ice_fraction(x):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return x[..., TI] / total_optical_depth(x)
+
+def liquid_water_path(x, factor):
+    return factor * x[..., TL] * x[..., RL]
+
+def ice_water_path(x, factor):
+    return factor * x[..., TI] * x[..., RI]
+
+## column -> (function, name of the path factor or None)
+QUANTITIES = {'tcw(1)': (total_optical_depth, None), 'fi(1)': (ice_fraction, None), \
+              'lwp(gm-2)': (liquid_water_path, 'lwp(gm-2)'), 'iwp(gm-2)': (ice_water_path, 'iwp(gm-2)')}
+
+def _factors(x, paths):
+    '''
+    Path factors (path / (optical depth * radius)) of the stored paths, {column: path}
+    '''
+    out = {}
+    for column, (_, tau, radius) in PATHS.items():
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[column] = paths[column] / (x[:, tau] * x[:, radius])
+    return out
+
+def _get(f, name, window):
+    return np.ma.filled(f.variables[name][window].astype('f8'), np.nan)
+
+def _matrix(f, name, window):
+    if name in f.variables and f.variables[name].shape[1:] == (len(STATE), len(STATE)):
+        return _get(f, name, window)
+    return None
+
+def read_state(f, start=None, stop=None):
+    '''
+    State x (sample, 4), its errors and its covariance of the samples [start, stop)
+    of an open TCWret netCDF file. The averaging kernels are only read if the
+    covariance has to be reconstructed.
+    '''
+    window = slice(start, stop)
+    x = np.column_stack([_get(f, name, window) for name, _ in STATE])
+    error = np.column_stack([_get(f, name + '_error', window) for name, _ in STATE])
+    cov = _matrix(f, COVARIANCE, window)
+    if cov is None:
+        cov = covariance(error, _matrix(f, AVERAGING_KERNEL, window))
+    return x, error, cov
+
+def read_dataset(f, start=None, stop=None):
+    '''
+    State x (sample, 4), its errors, the stored covariances and averaging kernels
+    (sample, 4, 4) or None, the time and the path factors of the samples
+    [start, stop) of an open TCWret netCDF file
+    '''
+    from . import timeaxis
+    window = slice(start, stop)
+    time = f.variables['time_of_measurement']
+    out = {'time': timeaxis.decode(time[window], getattr(time, 'units', timeaxis.UNITS_TCWRET), rounding='trunc'), \
+           'x': np.column_stack([_get(f, name, window) for name, _ in STATE]), \
+           'error': np.column_stack([_get(f, name + '_error', window) for name, _ in STATE]), \
+           'cov': _matrix(f, COVARIANCE, window), 'avk': _matrix(f, AVERAGING_KERNEL, window)}
+    out['factors'] = _factors(out['x'], {column: _get(f, name, window) for column, (name, _, _) in PATHS.items()})
+    return out
+
+def read_results(results, start=None, stop=None):
+    '''
+    As read_dataset for a TCWret result table (evaluation.tcwret.Results), with its covariances
+    '''
+    window = slice(start, stop)
+    def get(name):
+        return np.asarray(results[name][window], dtype='f8')
+    matrices = results.meta['matrices']
+    out = {'time': np.asarray(results.time[window]), 'x': np.column_stack([get(name) for name in RESULT_COLUMNS]), \
+           'cov': get('cov') if 'cov' in matrices else None, 'avk': get('avk') if 'avk' in matrices else None}
+    missing = np.full(out['x'].shape[0], np.nan)
+    if out['cov'] is not None:
+        out['error'] = np.sqrt(np.diagonal(out['cov'], axis1=1, axis2=2))
+    else:
+        out['error'] = np.column_stack([get('d' + name) if 'd' + name in results.columns else missing for name in RESULT_COLUMNS])
+    out['factors'] = _factors(out['x'], {column: get(column) if column in results.columns else missing for column in PATHS})
+    return out
+
+def read(fname, start=None, stop=None):
+    '''
+    read_dataset of a TCWret netCDF file or read_results of a result table (CSV or converted)
+    '''
+    from . import tcwret
+    if fname.endswith('.csv') or fname.rstrip('/').endswith(tcwret.SUFFIX):
+        return read_results(tcwret.load(fname.rstrip('/')), start, stop)
+    with instrument.dataset(fname) as f:
+        return read_dataset(f, start, stop)
+
+def state_covariance(state):
+    '''
+    Stored covariance of a state from read(), else the one reconstructed by covariance()
+    '''
+    if state.get('cov') is not None:
+        return state['cov']
+    return covariance(state['error'], state.get('avk'))
+
+def covariance(error, avk=None):
+    '''
+    Covariance (sample, state, state) reconstructed from the errors and the averaging
+    kernels for files without stored covariance, diagonal without kernels
+    '''
+    error = np.asarray(error, dtype='f8')
+    variance = error**2
+    if avk is None:
+        return variance[:, :, None] * np.eye(error.shape[1])
+    diagonal = np.diagonal(avk, axis1=1, axis2=2)
+    ## Prior variances, 1 - A_ii is kept away from 0 for fully resolved elements
+    prior = variance / np.clip(1.0 - diagonal, 1e-6, None)
+    cov = (np.eye(error.shape[1]) - avk) * prior[:, None, :]
+    cov = 0.5 * (cov + np.swapaxes(cov, 1, 2))
+    ## Negative eigenvalues of the correlation matrix are set to 0 and its diagonal is
+    ## scaled back to 1, so that the covariance is positive semi-definite and keeps
+    ## the stored variances (eigenvalue clipping, not the nearest correlation matrix)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = 1.0 / np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+        corr = np.nan_to_num(cov * scale[:, :, None] * scale[:, None, :])
+    w, v = np.linalg.eigh(corr)
+    corr = np.einsum('nij,nj,nkj->nik', v, np.clip(w, 0.0, None), v)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        norm = 1.0 / np.sqrt(np.diagonal(corr, axis1=1, axis2=2))
+        corr = np.nan_to_num(corr * norm[:, :, None] * norm[:, None, :])
+    idx = np.arange(error.shape[1])
+    corr[:, idx, idx] = 1.0
+    return corr * error[:, :, None] * error[:, None, :]
+
+def _broadcast(args, ndim):
+    return [np.asarray(arg, dtype='f8').reshape(np.shape(arg) + (1,)*ndim) for arg in args]
+
+def jacobian(function, x, *args, step=STEP):
+    '''
+    Derivatives (sample, state) of function by central differences, args are per sample
+    '''
+    x = np.asarray(x, dtype='f8')
+    h = step * np.maximum(np.abs(x), 1.0)
+    k = x.shape[1]
+    ## All 2*state perturbed states at once: (sample, 2*state, state)
+    shift = np.concatenate([np.eye(k), -np.eye(k)])[None, :, :] * np.concatenate([h, h], axis=1)[:, :, None]
+    values = function(x[:, None, :] + shift, *_broadcast(args, 1))
+    return (values[:, :k] - values[:, k:]) / (2*h)
+
+@instrument.timed('errors.linear')
+def linear(function, x, cov, *args):
+    '''
+    Value and linearly propagated SD of function at x with covariance cov
+    '''
+    x = np.asarray(x, dtype='f8')
+    jac = jacobian(function, x, *args)
+    variance = np.einsum('nk,nkl,nl->n', jac, cov, jac)
+    return function(x, *_broadcast(args, 0)), np.sqrt(np.clip(variance, 0.0, None))
+
+def _square_root(cov):
+    '''
+    L with L L^T = cov, negative eigenvalues of non positive definite matrices are set to 0
+    '''
+    w, v = np.linalg.eigh(cov)
+    return v * np.sqrt(np.clip(w, 0.0, None))[:, None, :]
+
+def _monte_carlo_chunk(function, x, cov, args, draws, seed):
+    rng = np.random.default_rng(seed)
+    z = rng.standard_normal((x.shape[0], draws, x.shape[1]))
+    samples = x[:, None, :] + np.matmul(z, np.swapaxes(_square_root(cov), 1, 2))
+    values = function(samples, *_broadcast(args, 1))
+    with np.errstate(invalid='ignore'):
+        return np.nanmean(values, axis=1), np.nanstd(values, axis=1)
+
+@instrument.timed('errors.monte_carlo')
+def monte_carlo(function, x, cov, *args, draws=DRAWS, seed=0, chunk_size=None, workers=1):
+    '''
+    Mean and SD of function over draws from N(x, cov) for every sample.
+    chunk_size samples (default: CHUNK_VALUES / draws) are drawn at once, with
+    workers > 1 the chunks are computed in worker processes (function must be
+    defined at module level).
+    '''
+    x = np.asarray(x, dtype='f8')
+    cov = np.asarray(cov, dtype='f8')
+    args = [np.asarray(arg, dtype='f8') for arg in args]
+    chunk_size = max(1, CHUNK_VALUES // draws) if chunk_size is None else chunk_size
+    starts = list(range(0, x.shape[0], chunk_size))
+    ## One seed per chunk, the draws do not depend on the number of workers
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    chunks = [(function, x[start:start+chunk_size], cov[start:start+chunk_size], \
+               [arg[start:start+chunk_size] for arg in args], draws, chunk_seed) for start, chunk_seed in zip(starts, seeds)]
+    if workers == 1 or len(chunks) < 2:
+        results = [_monte_carlo_chunk(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_monte_carlo_chunk, *zip(*chunks)))
+    if not results:
+        return np.array([]), np.array([])
+    return np.concatenate([mean for mean, _ in results]), np.concatenate([sd for _, sd in results])
+
+def propagate(state, columns=None, method='linear', **kwargs):
+    '''
+    Values and errors (column and 'd' + column) of QUANTITIES for a state from read()
+    '''
+    columns = list(QUANTITIES) if columns is None else columns
+    cov = state_covariance(state)
+    out = {'time': state['time']}
+    for column in columns:
+        function, factor = QUANTITIES[column]
+        args = [] if factor is None else [state['factors'][factor]]
+        if method == 'linear':
+            value, error = linear(function, state['x'], cov, *args)
+        else:
+            _, error = monte_carlo(function, state['x'], cov, *args, **kwargs)
+            value = function(state['x'], *args)
+        out[column] = value
+        out['d' + column] = error
+    return out
+
+def path_error(content, error, dz, offset, mask=None, correlated=True):
+    '''
+    Error of the column path of every profile from the relative content error
+    in percent on a logarithmic scale (content*10**error*1e-2*dz per pixel, as
+    the Cloudnet IWC error), summed (correlated levels) or added in quadrature.
+    NaN for profiles without unmasked pixel.
+    '''
+    masked = np.zeros(np.shape(content), dtype=bool) if mask is None else mask
+    with np.errstate(over='ignore', invalid='ignore'):
+        pixel = np.where(masked, 0.0, content * 10**np.where(masked, 0.0, error) * 1e-2 * dz)
+    if correlated:
+        out = sparse.segment_sum(pixel, offset, masked)
+    else:
+        out = np.sqrt(sparse.segment_sum(pixel**2, offset, masked))
+    out[sparse.segment_count(offset, masked) == 0] = np.nan
+    return out
+
+def mean_error(error, offset, mask=None, correlated=True):
+    '''
+    Error of the average over the unmasked pixels of every profile: mean of the
+    errors (correlated levels) or sqrt(sum(error**2)) / n
+    '''
+    if correlated:
+        return sparse.segment_mean(error, offset, mask)
+    count = sparse.segment_count(offset, mask)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, np.sqrt(sparse.segment_sum(np.asarray(error)**2, offset, mask)) / count, np.nan)
+
+def scale_factor(retrieved, truth, error):
+    '''
+    Ratio of the RMS deviation from the truth to the mean reported error (see SCALE)
+    '''
+    retrieved, truth, error = [np.asarray(values, dtype='f8') for values in (retrieved, truth, error)]
+    valid = ~(np.isnan(retrieved) | np.isnan(truth) | np.isnan(error))
+    return float(np.sqrt(np.mean((retrieved[valid] - truth[valid])**2)) / np.mean(error[valid]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Errors of quantities derived from the TCWret state")
+    parser.add_argument('tcwret')
+    parser.add_argument('--columns', type=lambda text: text.split(','), default=None, help="Subset of " + ",".join(QUANTITIES))
+    parser.add_argument('--method', choices=['linear', 'mc'], default='linear')
+    parser.add_argument('--draws', type=int, default=DRAWS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--workers', type=int, default=1)
+    parser.add_argument('-o', '--output', default=None, help="Write the table as CSV")
+    args = parser.parse_args()
+
+    import pandas as pd
+    start = timer.perf_counter()
+    state = read(args.tcwret)
+    kwargs = {} if args.method == 'linear' else {'draws': args.draws, 'seed': args.seed, 'workers': args.workers}
+    table = pd.DataFrame(propagate(state, args.columns, args.method, **kwargs))
+    if args.output:
+        table.to_csv(args.output, index=False)
+    print(table.drop(columns='time').describe().loc[['count', 'mean', '50%']].round(3).to_string())
+    print("{} samples in {:.2f} s".format(len(table), timer.perf_counter() - start))
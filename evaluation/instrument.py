@@ -0,0 +1,360 @@
+'''
+Timers, byte counters and memory snapshots of the processing stages
+
+Switched off by default, importing the module changes nothing. The command
+line entry points (the pipeline, online updates and the get_cloudnet scripts)
+switch it on with setup() if given --profile or the environment variable
+EVALUATION_PROFILE (a report file name, a directory or 1). While it is on,
+
+    stage(name)     (context manager) and timed(name) (decorator) record wall
+                    and CPU time, the high-water mark of the resident memory
+                    and, with EVALUATION_PROFILE_MEMORY=1 or --profile-memory,
+                    the tracemalloc peak of every stage
+    count(name, n)  adds n to a counter of all open stages, e.g. http_bytes
+    dataset(fname)  opens a netCDF4.Dataset and counts the size of the files
+                    read (netcdf_read_bytes) and written (netcdf_write_bytes,
+                    when the stage ends); the loaders and merge_data.py open
+                    their files with it
+
+Stages nest, a stage is identified by the names of all open stages joined by
+';' (folded stack). Stages opened in worker threads are placed below the open
+stages of the thread which switched the recorder on, stages of worker
+processes are returned with export() and added with absorb().
+
+At exit a JSON report is written. It is a Chrome trace file (traceEvents,
+load it in chrome://tracing, Perfetto or speedscope) with the totals per stage
+and the counters added. `python -m evaluation.instrument REPORT` prints the
+totals, with --folded the self times in the folded stack format of
+flamegraph.pl.
+
+When switched off, a decorated function costs one global lookup per call and
+stage() returns a shared null context.
+
+    EVALUATION_PROFILE=run.json python -m evaluation.pipeline lwp --tcwret TCWret.nc
+    python -m evaluation.instrument run.json --folded | flamegraph.pl > run.svg
+'''
+import argparse
+import atexit
+import contextlib
+import datetime as dt
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time as timer
+import tracemalloc
+
+ENV = 'EVALUATION_PROFILE'
+ENV_MEMORY = 'EVALUATION_PROFILE_MEMORY'
+SEPARATOR = ';'
+
+_recorder = None
+_null = contextlib.nullcontext()
+
+def _max_rss():
+    '''
+    High-water mark of the resident memory in MB (ru_maxrss is in kB on Linux, bytes on macOS)
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+class _Frame:
+    def __init__(self, name, path, owner):
+        self.name = name
+        self.path = path
+        self.owner = owner
+        self.start = timer.perf_counter()
+        self.cpu = timer.thread_time()
+        self.children = 0.0
+        self.outer = []
+        self.counters = {}
+        self.written = []
+        self.memory_start = 0
+        self.memory_peak = 0
+
+class Recorder:
+    '''
+    Collects the stages and counters of one process
+    '''
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.started = dt.datetime.now().isoformat(timespec='seconds')
+        self.origin = timer.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.stages = {}
+        self.counters = {}
+        self.written = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main = self._stack()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _open(self):
+        '''
+        Open stages of this thread and the stages of the main thread they are placed below
+        '''
+        stack = self._stack()
+        return stack + stack[0].outer if stack else list(self._main)
+
+    def push(self, name):
+        stack = self._stack()
+        parent = stack[-1].path if stack else (self._main[-1].path if self._main else None)
+        frame = _Frame(name, name if parent is None else parent + SEPARATOR + name, stack)
+        if not stack and stack is not self._main:
+            frame.outer = list(self._main)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            for item in stack:
+                item.memory_peak = max(item.memory_peak, peak)
+            tracemalloc.reset_peak()
+            frame.memory_start = frame.memory_peak = current
+        stack.append(frame)
+        return frame
+
+    def pop(self, frame):
+        for fname in frame.written:
+            self.count('netcdf_write_bytes', _size(fname))
+        stack = frame.owner
+        stack.remove(frame)
+        seconds = timer.perf_counter() - frame.start
+        cpu = timer.thread_time() - frame.cpu
+        if stack:
+            stack[-1].children += seconds
+        out = {'seconds': seconds, 'self_seconds': max(seconds - frame.children, 0.0), 'cpu_seconds': cpu, \
+               'max_rss_mb': _max_rss(), 'counters': frame.counters}
+        if self.memory:
+            frame.memory_peak = max(frame.memory_peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].memory_peak = max(stack[-1].memory_peak, frame.memory_peak)
+            out['tracemalloc_peak_mb'] = (frame.memory_peak - frame.memory_start) / 2**20
+        event = {'name': frame.name, 'ph': 'X', 'pid': self.pid, 'tid': threading.get_ident(), \
+                 'ts': frame.start * 1e6, 'dur': seconds * 1e6, 'args': dict(out, stack=frame.path)}
+        with self._lock:
+            self.events.append(event)
+            self._add(frame.path, out)
+
+    def _add(self, path, result):
+        total = self.stages.setdefault(path, {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0, 'cpu_seconds': 0.0, \
+                                              'max_rss_mb': 0.0, 'counters': {}})
+        total['calls'] += result.get('calls', 1)
+        for key in ['seconds', 'self_seconds', 'cpu_seconds']:
+            total[key] += result[key]
+        for key in ['max_rss_mb', 'tracemalloc_peak_mb']:
+            if key in result:
+                total[key] = max(total.get(key, 0.0), result[key])
+        for key, value in result['counters'].items():
+            total['counters'][key] = total['counters'].get(key, 0) + value
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            for frame in self._open():
+                frame.counters[name] = frame.counters.get(name, 0) + value
+
+    def opened(self, fname, mode):
+        if mode == 'r':
+            self.count('netcdf_read_bytes', _size(fname))
+            return
+        stack = self._stack() or self._main
+        (stack[-1].written if stack else self.written).append(fname)
+
+    def export(self):
+        '''
+        Stages, counters and trace events as plain (picklable) data
+        '''
+        for fname in self.written:
+            self.count('netcdf_write_bytes', _size(fname))
+        self.written = []
+        with self._lock:
+            return {'events': list(self.events), 'stages': json.loads(json.dumps(self.stages)), 'counters': dict(self.counters)}
+
+    def absorb(self, exported):
+        '''
+        Add the exported stages of another recorder (e.g. of a worker process) below the open stages
+        '''
+        stack = self._stack() or self._main
+        prefix = stack[-1].path + SEPARATOR if stack else ''
+        with self._lock:
+            for event in exported['events']:
+                event = dict(event, args=dict(event['args'], stack=prefix + event['args']['stack']))
+                self.events.append(event)
+            for path, result in exported['stages'].items():
+                self._add(prefix + path, result)
+        for name, value in exported['counters'].items():
+            self.count(name, value)
+
+    def report(self):
+        exported = self.export()
+        events = [dict(event, ts=event['ts'] - self.origin*1e6) for event in exported['events']]
+        return {'traceEvents': sorted(events, key=lambda event: event['ts']), 'displayTimeUnit': 'ms', \
+                'command': sys.argv, 'pid': self.pid, 'started': self.started, \
+                'seconds': timer.perf_counter() - self.origin, 'max_rss_mb': _max_rss(), \
+                'counters': exported['counters'], 'stages': exported['stages']}
+
+def _size(fname):
+    try:
+        return os.path.getsize(fname)
+    except (OSError, TypeError):
+        return 0
+
+def dataset(filename, mode='r', **kwargs):
+    '''
+    netCDF4.Dataset(filename, mode, **kwargs), reported to the recorder if switched on
+    '''
+    import netCDF4
+    out = netCDF4.Dataset(filename, mode, **kwargs)
+    recorder = _recorder
+    if recorder is not None and not kwargs.get('memory'):
+        recorder.opened(filename, mode)
+    return out
+
+def enabled():
+    return _recorder is not None
+
+def stage(name):
+    '''
+    Context manager recording the stage name, a shared null context if switched off
+    '''
+    if _recorder is None:
+        return _null
+    return _stage(_recorder, name)
+
+@contextlib.contextmanager
+def _stage(recorder, name):
+    frame = recorder.push(name)
+    try:
+        yield frame
+    finally:
+        recorder.pop(frame)
+
+def timed(name):
+    '''
+    Decorator recording every call of the function as stage name
+    '''
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return function(*args, **kwargs)
+            with _stage(_recorder, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, value):
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+def default_name(path='.'):
+    return os.path.join(path, "profile_{:%Y%m%d_%H%M%S}_{}.json".format(dt.datetime.now(), os.getpid()))
+
+def setup(fname=None, memory=False):
+    '''
+    Switch the recorder on for a command line run if fname (--profile) or
+    EVALUATION_PROFILE is given, memory also by EVALUATION_PROFILE_MEMORY
+    '''
+    fname = fname or os.environ.get(ENV)
+    if not fname:
+        return None
+    return enable(fname, memory or os.environ.get(ENV_MEMORY, '').lower() in ('1', 'true', 'yes', 'on'))
+
+def enable(fname=None, memory=False):
+    '''
+    Switch the recorder on, the report is written to fname (default profile_<time>_<pid>.json) at exit
+    '''
+    global _recorder
+    if _recorder is not None:
+        return _recorder
+    if fname is None or fname.lower() in ('1', 'true', 'yes', 'on'):
+        fname = default_name()
+    elif os.path.isdir(fname):
+        fname = default_name(fname)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _recorder = Recorder(memory)
+    atexit.register(disable, fname)
+    return _recorder
+
+def disable(fname=None):
+    '''
+    Switch the recorder off, write the report to fname (if given) and return it
+    '''
+    global _recorder
+    recorder = _recorder
+    if recorder is None:
+        return None
+    report = recorder.report()
+    _recorder = None
+    if recorder.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if fname is not None:
+        tmp = fname + '.part'
+        with open(tmp, 'w') as fobj:
+            json.dump(report, fobj)
+        os.replace(tmp, fname)
+    return report
+
+@contextlib.contextmanager
+def isolated(active=None, memory=None):
+    '''
+    Fresh recorder for the work of a worker process. active defaults to
+    enabled() (a forked worker inherits the state of its parent); yields
+    None if switched off. Return recorder.export() to the parent, which
+    adds it with absorb().
+    '''
+    global _recorder
+    active = enabled() if active is None else active
+    if not active:
+        yield None
+        return
+    memory = (_recorder.memory if _recorder is not None else False) if memory is None else memory
+    previous = _recorder
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _recorder = Recorder(memory)
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous
+        if started:
+            tracemalloc.stop()
+
+def absorb(exported):
+    if _recorder is not None and exported is not None:
+        _recorder.absorb(exported)
+
+def folded(report):
+    '''
+    Lines "stack self_microseconds" for flamegraph.pl
+    '''
+    return ["{} {}".format(path, int(round(result['self_seconds']*1e6))) for path, result in sorted(report['stages'].items())]
+
+def print_report(report):
+    print("stage\tcalls\tseconds\tself(s)\tcpu(s)\tmax_rss(MB)\tpeak(MB)\tcounters")
+    for path, result in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+        counters = ", ".join("{}={}".format(key, value) for key, value in sorted(result['counters'].items()))
+        peak = result.get('tracemalloc_peak_mb')
+        print("{}\t{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.1f}\t{}\t{}".format(path, result['calls'], result['seconds'], result['self_seconds'], \
+              result['cpu_seconds'], result['max_rss_mb'], '-' if peak is None else "{:.1f}".format(peak), counters))
+    print("total {:.3f} s, {}".format(report['seconds'], ", ".join("{}={}".format(key, value) for key, value in sorted(report['counters'].items()))))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print a report written with EVALUATION_PROFILE or --profile")
+    parser.add_argument('report')
+    parser.add_argument('--folded', action='store_true', help="Folded stacks for flamegraph.pl")
+    args = parser.parse_args()
+    with open(args.report) as fobj:
+        report = json.load(fobj)
+    if args.folded:
+        print("\n".join(folded(report)))
+    else:
+        print_report(report)
@@ -0,0 +1,141 @@
+'''
+Running, mergeable statistics of pairs (x, y)
+
+Moments keeps the number of pairs, the means of x and y and the centred
+second moments (co-moments) of x and y. Batches are added with update() and
+partial results of different chunks or days are combined with merge() using
+the pairwise formulas of Chan et al. (1979), which stay accurate for long
+series; subtract() removes a partial result again. From the moments follow the statistics printed by the notebooks:
+Pearson r and its p-value, the mean difference (bias, x - y) and the standard
+deviation of the difference (SD, ddof=0).
+
+    total = Moments()
+    for x, y in chunks:
+        total.update(x, y)
+    total.summary()
+'''
+import numpy as np
+
+FIELDS = ['n', 'mean_x', 'mean_y', 'm2_x', 'm2_y', 'c_xy']
+
+class Moments:
+    '''
+    Count, means and co-moments of pairs (x, y)
+    '''
+    def __init__(self, n=0, mean_x=0.0, mean_y=0.0, m2_x=0.0, m2_y=0.0, c_xy=0.0):
+        self.n = int(n)
+        self.mean_x = float(mean_x)
+        self.mean_y = float(mean_y)
+        self.m2_x = float(m2_x)
+        self.m2_y = float(m2_y)
+        self.c_xy = float(c_xy)
+
+    @classmethod
+    def from_data(cls, x, y):
+        x = np.asarray(x, dtype='f8')
+        y = np.asarray(y, dtype='f8')
+        if x.size == 0:
+            return cls()
+        mean_x = x.mean()
+        mean_y = y.mean()
+        dx = x - mean_x
+        dy = y - mean_y
+        return cls(x.size, mean_x, mean_y, np.dot(dx, dx), np.dot(dy, dy), np.dot(dx, dy))
+
+    def merge(self, other):
+        '''
+        Add the pairs summarised by other (in place), returns self
+        '''
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean_x, self.mean_y, self.m2_x, self.m2_y, self.c_xy = \
+                other.n, other.mean_x, other.mean_y, other.m2_x, other.m2_y, other.c_xy
+            return self
+        n = self.n + other.n
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        weight = self.n * other.n / n
+        self.mean_x += dx * other.n / n
+        self.mean_y += dy * other.n / n
+        self.m2_x += other.m2_x + dx*dx*weight
+        self.m2_y += other.m2_y + dy*dy*weight
+        self.c_xy += other.c_xy + dx*dy*weight
+        self.n = n
+        return self
+
+    def subtract(self, other):
+        '''
+        Remove the pairs summarised by other (in place), the inverse of merge
+        '''
+        if other.n == 0:
+            return self
+        n = self.n - other.n
+        if n < 0:
+            raise ValueError("Cannot remove {} pairs from {}".format(other.n, self.n))
+        if n == 0:
+            self.n, self.mean_x, self.mean_y, self.m2_x, self.m2_y, self.c_xy = 0, 0.0, 0.0, 0.0, 0.0, 0.0
+            return self
+        mean_x = (self.n*self.mean_x - other.n*other.mean_x) / n
+        mean_y = (self.n*self.mean_y - other.n*other.mean_y) / n
+        dx = other.mean_x - mean_x
+        dy = other.mean_y - mean_y
+        weight = n * other.n / self.n
+        self.m2_x = max(self.m2_x - other.m2_x - dx*dx*weight, 0.0)
+        self.m2_y = max(self.m2_y - other.m2_y - dy*dy*weight, 0.0)
+        self.c_xy -= other.c_xy + dx*dy*weight
+        self.mean_x, self.mean_y, self.n = mean_x, mean_y, n
+        return self
+
+    def update(self, x, y):
+        return self.merge(Moments.from_data(x, y))
+
+    def __add__(self, other):
+        return Moments(**self.to_dict()).merge(other)
+
+    def __eq__(self, other):
+        return isinstance(other, Moments) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "Moments({})".format(", ".join("{}={!r}".format(key, value) for key, value in self.to_dict().items()))
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in FIELDS}
+
+    @property
+    def r(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return float(np.clip(np.float64(self.c_xy) / np.sqrt(np.float64(self.m2_x) * self.m2_y), -1.0, 1.0))
+
+    @property
+    def bias(self):
+        return self.mean_x - self.mean_y if self.n else np.nan
+
+    @property
+    def sd(self):
+        if self.n == 0:
+            return np.nan
+        return float(np.sqrt(max(self.m2_x + self.m2_y - 2*self.c_xy, 0.0) / self.n))
+
+    @property
+    def p(self):
+        '''
+        Two-sided p-value of r (t-test with n - 2 degrees of freedom, as scipy.stats.pearsonr)
+        '''
+        import scipy.stats
+        r = self.r
+        if self.n < 2 or np.isnan(r):
+            return np.nan
+        if self.n == 2:
+            ## Two points are always perfectly correlated, scipy returns 1
+            return 1.0
+        if abs(r) == 1.0:
+            return 0.0
+        t = r * np.sqrt((self.n - 2) / (1 - r**2))
+        return float(2 * scipy.stats.t.sf(abs(t), self.n - 2))
+
+    def summary(self):
+        '''
+        Same keys as evaluation.bootstrap.summary
+        '''
+        return {'r': self.r, 'p': self.p, 'bias': self.bias, 'sd': self.sd, 'n': self.n}
@@ -0,0 +1,322 @@
+'''
+Incrementally updatable comparison statistics
+
+For every day and every subset (All, PWV <= 1.0, LWP <= 20, ...) the matched
+bins are summarised by mergeable sufficient statistics: the moments of the
+pairs (evaluation.moments) and histograms of x, y and x - y. The campaign
+totals are kept next to the per-day partials. Adding, replacing or removing a
+day changes the totals by merging or subtracting the partials of that day
+only, and the statistics of any date range are obtained by merging the
+partials of its days, without going back to the raw data. The statistics are
+saved as JSON.
+
+    stats = Statistics('lwp', pwv_max=[1.0], y_max=[20.0])
+    stats.ingest(stream.matched_bins(fname_tcwret, path_cnet, 'lwp'))
+    stats.save('stats_lwp.json')
+    stats.query('2017-06-01', '2017-06-30')
+
+    python -m evaluation.online update lwp stats_lwp.json --tcwret TCWret.nc --cloudnet get_cloudnet --days 2017-06-01
+    python -m evaluation.online query stats_lwp.json --start 2017-06-01 --stop 2017-06-30
+'''
+import argparse
+import datetime as dt
+import json
+import os
+import numpy as np
+
+from . import instrument
+from .moments import Moments
+
+## Histogram range (lower, upper, number of bins) of x and y, x - y uses (-upper, upper)
+HISTOGRAMS = {'lwp': (0.0, 200.0, 100), 'iwp': (0.0, 100.0, 100), 'rice': (0.0, 100.0, 100), 'rliq': (0.0, 30.0, 60)}
+
+def _edges(lower, upper, nbins):
+    '''
+    Bin edges with an underflow and an overflow bin
+    '''
+    return np.concatenate(([-np.inf], np.linspace(lower, upper, nbins + 1), [np.inf]))
+
+class Partial:
+    '''
+    Moments and histograms of x, y and x - y of a set of pairs
+    '''
+    def __init__(self, nbins, moments=None, hist_x=None, hist_y=None, hist_diff=None):
+        self.moments = Moments() if moments is None else moments
+        self.hist_x = np.zeros(nbins + 2, dtype='i8') if hist_x is None else np.asarray(hist_x, dtype='i8')
+        self.hist_y = np.zeros(nbins + 2, dtype='i8') if hist_y is None else np.asarray(hist_y, dtype='i8')
+        self.hist_diff = np.zeros(nbins + 2, dtype='i8') if hist_diff is None else np.asarray(hist_diff, dtype='i8')
+
+    @classmethod
+    def from_data(cls, x, y, edges, edges_diff):
+        x = np.asarray(x, dtype='f8')
+        y = np.asarray(y, dtype='f8')
+        return cls(edges.size - 3, Moments.from_data(x, y), np.histogram(x, edges)[0], np.histogram(y, edges)[0], \
+                   np.histogram(x - y, edges_diff)[0])
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.hist_x += other.hist_x
+        self.hist_y += other.hist_y
+        self.hist_diff += other.hist_diff
+        return self
+
+    def subtract(self, other):
+        self.moments.subtract(other.moments)
+        self.hist_x -= other.hist_x
+        self.hist_y -= other.hist_y
+        self.hist_diff -= other.hist_diff
+        return self
+
+    def copy(self):
+        return Partial(self.hist_x.size - 2, Moments(**self.moments.to_dict()), self.hist_x.copy(), self.hist_y.copy(), self.hist_diff.copy())
+
+    def to_dict(self):
+        return {'moments': self.moments.to_dict(), 'hist_x': self.hist_x.tolist(), 'hist_y': self.hist_y.tolist(), \
+                'hist_diff': self.hist_diff.tolist()}
+
+    @classmethod
+    def from_dict(cls, value):
+        return cls(len(value['hist_x']) - 2, Moments(**value['moments']), value['hist_x'], value['hist_y'], value['hist_diff'])
+
+class Statistics:
+    '''
+    Per-day partials and campaign totals of all subsets of one comparison
+    (see evaluation.pipeline.COMPARISONS and evaluation.pipeline.subsets)
+    '''
+    def __init__(self, name, pwv_max=(1.0, ), y_max=(), histogram=None, delta=2, invalid=None, origin=None, stop=None):
+        from . import pipeline
+        self.name = name
+        self.delta = delta
+        ## Range of the bins, None for evaluation.binning.ORIGIN and STOP
+        self.origin = None if origin is None else str(np.datetime64(origin, 's'))
+        self.stop = None if stop is None else str(np.datetime64(stop, 's'))
+        self.invalid = None if invalid is None else [int(code) for code in invalid]
+        self.comparison = pipeline.COMPARISONS[name]
+        self.pwv_max = [float(value) for value in pwv_max]
+        self.y_max = [float(value) for value in y_max]
+        self.histogram = tuple(HISTOGRAMS[name] if histogram is None else histogram)
+        lower, upper, nbins = self.histogram
+        self.edges = _edges(lower, upper, nbins)
+        self.edges_diff = _edges(-upper, upper, nbins)
+        self.days = {}
+        self.total = {}
+
+    @property
+    def labels(self):
+        from . import pipeline
+        y = self.comparison['y'] + '_cnet'
+        return list(pipeline.subsets({'pwv(cm)': [], y: []}, y, self.pwv_max, self.y_max, self.comparison['y'], self.comparison['pwv']))
+
+    def _empty(self):
+        return {label: Partial(self.histogram[2]) for label in self.labels}
+
+    def partials(self, matched):
+        '''
+        {day: {label: Partial}} of a table of matched bins (see evaluation.pipeline.collocate)
+        '''
+        from . import pipeline
+        x = self.comparison['x']
+        y = self.comparison['y'] + '_cnet'
+        days = np.asarray(matched['time'], dtype='datetime64[D]')
+        out = {}
+        for day in np.unique(days):
+            rows = days == day
+            positive = self.comparison['positive']
+            keys = [x, y, 'pwv(cm)'] + positive + [column + '_cnet' for column in positive]
+            table = {key: np.asarray(matched[key])[rows] for key in keys}
+            masks = pipeline.subsets(table, y, self.pwv_max, self.y_max, self.comparison['y'], self.comparison['pwv'], positive)
+            out[str(day)] = {label: Partial.from_data(table[x] if mask is None else table[x][mask], \
+                                                      table[y] if mask is None else table[y][mask], self.edges, self.edges_diff) \
+                             for label, mask in masks.items()}
+        return out
+
+    def set_day(self, day, partials):
+        '''
+        Add or replace the partials of one day, the totals change by this day only
+        '''
+        day = str(np.datetime64(day, 'D'))
+        self.remove_day(day)
+        self.days[day] = partials
+        for label, partial in partials.items():
+            if label in self.total:
+                self.total[label].merge(partial)
+            else:
+                self.total[label] = partial.copy()
+
+    def remove_day(self, day):
+        day = str(np.datetime64(day, 'D'))
+        partials = self.days.pop(day, None)
+        if partials is None:
+            return False
+        for label, partial in partials.items():
+            self.total[label].subtract(partial)
+        return True
+
+    def ingest(self, chunks, days=None):
+        '''
+        Replace the days found in the chunks of matched bins (e.g. evaluation.stream.matched_bins).
+        A day may be spread over several chunks. With days, only these days are
+        replaced and days without matched bins are removed.
+        '''
+        collected = {}
+        for chunk in chunks:
+            for day, partials in self.partials(chunk).items():
+                if day in collected:
+                    for label, partial in partials.items():
+                        collected[day][label].merge(partial)
+                else:
+                    collected[day] = partials
+        if days is not None:
+            days = set(str(np.datetime64(day, 'D')) for day in days)
+            collected = {day: partials for day, partials in collected.items() if day in days}
+            for day in days - set(collected):
+                self.remove_day(day)
+        for day, partials in collected.items():
+            self.set_day(day, partials)
+        return sorted(collected)
+
+    def rebuild(self):
+        '''
+        Recompute the totals from the per-day partials (removes rounding accumulated by subtract)
+        '''
+        self.total = self._empty()
+        for partials in self.days.values():
+            for label, partial in partials.items():
+                self.total[label].merge(partial)
+
+    def query(self, start=None, stop=None):
+        '''
+        {label: Partial} of the days in [start, stop], the totals if no range is given
+        '''
+        if start is None and stop is None:
+            return self.total
+        start = '0000-01-01' if start is None else str(np.datetime64(start, 'D'))
+        stop = '9999-12-31' if stop is None else str(np.datetime64(stop, 'D'))
+        out = self._empty()
+        for day, partials in self.days.items():
+            if start <= day <= stop:
+                for label, partial in partials.items():
+                    out[label].merge(partial)
+        return out
+
+    def table(self, start=None, stop=None):
+        '''
+        Rows like evaluation.pipeline.statistics for the days in [start, stop]
+        '''
+        partials = self.query(start, stop)
+        rows = []
+        for label in self.labels:
+            summary = partials.get(label, Partial(self.histogram[2])).moments.summary()
+            if summary['n'] < 2:
+                summary.update({'r': np.nan, 'p': np.nan, 'bias': np.nan, 'sd': np.nan})
+            rows.append({'data': label, 'n': float(summary['n']), 'r': summary['r'], 'p': summary['p'], \
+                         'bias': summary['bias'], 'sd': summary['sd']})
+        return rows
+
+    def to_dict(self):
+        return {'name': self.name, 'delta': self.delta, 'invalid': self.invalid, 'origin': self.origin, 'stop': self.stop, \
+                'pwv_max': self.pwv_max, 'y_max': self.y_max, 'histogram': list(self.histogram), \
+                'total': {label: partial.to_dict() for label, partial in self.total.items()}, \
+                'days': {day: {label: partial.to_dict() for label, partial in partials.items()} for day, partials in sorted(self.days.items())}}
+
+    @classmethod
+    def from_dict(cls, value):
+        out = cls(value['name'], value['pwv_max'], value['y_max'], value['histogram'], value['delta'], value['invalid'], \
+                  value.get('origin'), value.get('stop'))
+        out.total = {label: Partial.from_dict(partial) for label, partial in value['total'].items()}
+        out.days = {day: {label: Partial.from_dict(partial) for label, partial in partials.items()} for day, partials in value['days'].items()}
+        return out
+
+    def save(self, fname):
+        tmp = fname + '.part'
+        with open(tmp, 'w') as fobj:
+            json.dump(self.to_dict(), fobj)
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname) as fobj:
+            return cls.from_dict(json.load(fobj))
+
+def open_statistics(fname, name, pwv_max=(1.0, ), y_max=(), delta=2, invalid=None, origin=None, stop=None):
+    '''
+    Statistics stored in fname, new ones with the given settings if it does not
+    exist. Raises ValueError if the stored comparison is not name or the stored
+    invalid status codes differ from invalid (None keeps the stored ones).
+    '''
+    if not os.path.exists(fname):
+        return Statistics(name, pwv_max, y_max, delta=delta, invalid=invalid, origin=origin, stop=stop)
+    stats = Statistics.load(fname)
+    if stats.name != name:
+        raise ValueError("{} holds the statistics of {}, not {}".format(fname, stats.name, name))
+    if invalid is not None and stats.invalid != [int(code) for code in invalid]:
+        raise ValueError("{} was built with the invalid status codes {}, not {}".format(fname, stats.invalid, list(invalid)))
+    return stats
+
+@instrument.timed('online.update')
+def update(stats, fname_tcwret, path_cnet, days=None, year=2017, chunk_size=None):
+    '''
+    Re-process days (all days if None) with the bin width, bin range and the invalid
+    status codes of stats. Only the Cloudnet files and the TCWret samples of these
+    days and their neighbours are read, the neighbours because a bin may cross
+    midnight, so the cost is proportional to the number of days.
+    '''
+    from . import store, stream
+    fnames = None
+    ranges = None
+    if days is not None:
+        days = [np.datetime64(day, 'D') for day in days]
+        wanted = set(day + offset for day in days for offset in (-1, 0, 1))
+        fnames = [fname for date, fname in store.list_days(path_cnet, year) if np.datetime64(date, 'D') in wanted]
+        ranges = [(day - 1, day + 2) for day in days]
+    chunks = stream.matched_bins(fname_tcwret, path_cnet, stats.name, stats.delta, stats.invalid, chunk_size or stream.CHUNK_SIZE, fnames, \
+                                 stats.origin, stats.stop, ranges)
+    return stats.ingest(chunks, days)
+
+if __name__ == '__main__':
+    from .pipeline import COMPARISONS, print_table
+    parser = argparse.ArgumentParser(description="Per-day comparison statistics which can be updated day by day")
+    sub = parser.add_subparsers(dest='command', required=True)
+    upd = sub.add_parser('update', help="Add or re-process days")
+    upd.add_argument('name', choices=list(COMPARISONS))
+    upd.add_argument('fname', help="JSON file of the statistics, created if missing")
+    upd.add_argument('--tcwret', default='TCWret.nc')
+    upd.add_argument('--cloudnet', default='get_cloudnet')
+    upd.add_argument('--days', default=None, help="Comma separated days, default all")
+    upd.add_argument('--year', type=int, default=2017)
+    upd.add_argument('--pwv-max', dest='pwv_max', default='1.0', help="Only used for a new file")
+    upd.add_argument('--y-max', dest='y_max', default='', help="Only used for a new file")
+    upd.add_argument('--delta', type=int, default=2, help="Bin width in minutes, only used for a new file")
+    upd.add_argument('--invalid', type=lambda text: [int(value) for value in text.split(',')], default=None, \
+                     help="Invalid Cloudnet status codes, e.g. 4,5,6, must match an existing file")
+    upd.add_argument('--origin', default=None, help="Start of the first bin, only used for a new file, default PS106")
+    upd.add_argument('--stop', default=None, help="End of the last bin, only used for a new file, default PS106")
+    rem = sub.add_parser('remove', help="Remove days")
+    rem.add_argument('fname')
+    rem.add_argument('days')
+    que = sub.add_parser('query', help="Statistics of a date range")
+    que.add_argument('fname')
+    que.add_argument('--start', default=None)
+    que.add_argument('--stop', default=None)
+    args = parser.parse_args()
+    instrument.setup()
+
+    if args.command == 'update':
+        try:
+            stats = open_statistics(args.fname, args.name, [float(value) for value in args.pwv_max.split(',') if value], \
+                                    [float(value) for value in args.y_max.split(',') if value], delta=args.delta, \
+                                    invalid=args.invalid, origin=args.origin, stop=args.stop)
+        except ValueError as err:
+            parser.error(str(err))
+        days = None if args.days is None else [dt.date.fromisoformat(day) for day in args.days.split(',')]
+        changed = update(stats, args.tcwret, args.cloudnet, days, args.year)
+        stats.save(args.fname)
+        print("Updated {} days".format(len(changed)))
+    elif args.command == 'remove':
+        stats = Statistics.load(args.fname)
+        removed = [day for day in args.days.split(',') if stats.remove_day(day)]
+        stats.save(args.fname)
+        print("Removed {} days".format(len(removed)))
+    else:
+        stats = Statistics.load(args.fname)
+        print_table(stats.name, stats.table(args.start, args.stop))
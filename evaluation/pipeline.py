@@ -0,0 +1,377 @@
+'''
+Comparison of TCWret and Cloudnet as a pipeline of cached stages
+
+    fetch       download TCWret.nc (and the raw Cloudnet files with --raw)
+    merge       merge the raw Cloudnet files into cnet_MM_DD.nc (with --raw)
+    cloudnet    column quantities of the valid Cloudnet profiles
+    tcwret      read TCWret.nc
+    screen      screening of the TCWret samples (tau_max, red_chi_2_max, ...)
+    aggregate   averages over delta-minute bins
+    collocate   bins present in both data sets (or pairs within +-window seconds)
+    stats       r, p, bias and SD for all subsets, optionally with bootstrap intervals
+
+fetch and merge only touch missing or outdated files. The results of the other
+stages are stored in a disk cache (evaluation.cache) under a key derived from
+the stage parameters, the keys of its inputs and the size and modification
+time of the input files. Changing delta re-runs aggregate, collocate and stats,
+changing a PWV threshold only stats. Bins lie between --origin and --stop, by
+default the PS106 cruise (evaluation.binning.ORIGIN and STOP). Modules importing SciPy, netCDF4 or
+pandas are imported by the stages themselves, so a fully cached run does not
+load them.
+
+    python -m evaluation.pipeline lwp iwp --tcwret compare_TCWret_and_Cloudnet/TCWret.nc \\
+        --cloudnet get_cloudnet --delta 2 --pwv-max 1.0 --y-max 20
+'''
+import argparse
+import glob
+import importlib
+import operator
+import os
+import sys
+import time as timer
+
+from . import instrument
+from .cache import Cache, make_key
+
+## Bump to invalidate all cached results after changing a stage
+VERSION = 1
+TCWRET_URL = "https://download.pangaea.de/dataset/933829/files/TCWret_PS106_PS107.nc"
+
+## netCDF variable -> column of the TCWret table
+TCWRET_VARIABLES = {'latitude': 'latitude', 'longitude': 'longitude', 'precipitable_water_vapour': 'pwv(cm)', \
+                    'liquid_water_path': 'lwp(gm-2)', 'liquid_water_path_error': 'dlwp(gm-2)', \
+                    'ice_water_path': 'iwp(gm-2)', 'ice_water_path_error': 'diwp(gm-2)', \
+                    'liquid_water_effective_droplet_radius': 'rliq(um)', 'liquid_water_effective_droplet_radius_error': 'drliq(um)', \
+                    'ice_water_effective_droplet_radius': 'rice(um)', 'ice_water_effective_droplet_radius_error': 'drice(um)', \
+                    'liquid_water_optical_depth': 'tl(1)', 'ice_water_optical_depth': 'ti(1)', \
+                    'reduced_chi_2': 'red_chi_2(1)', 'degrees_of_freedom_of_signal': 'dof(1)'}
+
+## x: TCWret, y: Cloudnet, dx and dy their errors. Screening overrides evaluation.sweep.SCREENING.
+## pwv compares PWV and the thresholds of the PWV subsets and positive lists the columns
+## which must be > 0 in both data sets, both as in the notebooks of each comparison
+COMPARISONS = {'lwp': {'quantity': 'liquid', 'x': 'lwp(gm-2)', 'dx': 'dlwp(gm-2)', 'y': 'lwp_mwr(gm-2)', 'dy': 'lwp_err_mwr(gm-2)', 'screening': {}, \
+                       'pwv': '<=', 'positive': []}, \
+               'iwp': {'quantity': 'ice', 'x': 'iwp(gm-2)', 'dx': 'diwp(gm-2)', 'y': 'iwp(gm-2)', 'dy': 'diwp(gm-2)', 'screening': {}, \
+                       'pwv': '<', 'positive': []}, \
+               'rice': {'quantity': 'ice', 'x': 'rice(um)', 'dx': 'drice(um)', 'y': 'rice(um)', 'dy': 'drice(um)', 'screening': {}, \
+                        'pwv': '<', 'positive': ['iwp(gm-2)']}, \
+               'rliq': {'quantity': 'rliq', 'x': 'rliq(um)', 'dx': 'drliq(um)', 'y': 'rliq(um)', 'dy': 'drliq(um)', 'screening': {'fi_max': 0.9}, \
+                        'pwv': '<', 'positive': []}}
+OPERATORS = {'<=': operator.le, '<': operator.lt}
+
+COLUMNS = ['data', 'n', 'r', 'p', 'bias', 'sd']
+COLUMNS_BOOTSTRAP = ['data', 'n', 'r', 'r_lo', 'r_hi', 'p', 'bias', 'bias_lo', 'bias_hi', 'sd', 'sd_lo', 'sd_hi']
+
+def fingerprint(fnames):
+    '''
+    Name, size and modification time of files, part of the keys of the stages reading them
+    '''
+    out = []
+    for fname in sorted(fnames):
+        stat = os.stat(fname)
+        out.append((os.path.basename(fname), stat.st_size, stat.st_mtime_ns))
+    return out
+
+def _script(name):
+    '''
+    Import a script of get_cloudnet
+    '''
+    return importlib.import_module('get_cloudnet.' + name)
+
+class Stage:
+    '''
+    One step of the pipeline: function(*inputs, **params). The key is known before
+    anything is computed; depends holds further values the result depends on
+    (e.g. fingerprints of input files) without being passed to function.
+    '''
+    def __init__(self, name, function, params=None, inputs=(), depends=None):
+        self.name = name
+        self.function = function
+        self.params = params or {}
+        self.inputs = list(inputs)
+        self.key = make_key(VERSION, name, function.__name__, self.params, depends, [stage.key for stage in self.inputs])
+
+class Pipeline:
+    '''
+    Evaluates stages, each stage is computed at most once per run and only if it is not in the cache
+    '''
+    def __init__(self, cache=None, verbose=True):
+        self.cache = cache
+        self.verbose = verbose
+        self.results = {}
+        self.log = []
+
+    def _report(self, stage, status, seconds):
+        self.log.append({'stage': stage.name, 'key': stage.key[:12], 'status': status, 'seconds': seconds})
+        if self.verbose:
+            print("{:<10} {:<8} {:>8.3f} s  {}".format(stage.name, status, seconds, stage.key[:12]), file=sys.stderr)
+
+    def evaluate(self, stage):
+        if stage.key in self.results:
+            return self.results[stage.key]
+        start = timer.perf_counter()
+        missing = object()
+        value = missing if self.cache is None else self.cache.get(stage.key, missing)
+        if value is missing:
+            inputs = [self.evaluate(item) for item in stage.inputs]
+            start = timer.perf_counter()
+            with instrument.stage('pipeline.' + stage.name):
+                value = stage.function(*inputs, **stage.params)
+            if self.cache is not None:
+                self.cache.put(stage.key, value)
+            self._report(stage, 'computed', timer.perf_counter() - start)
+        else:
+            self._report(stage, 'cached', timer.perf_counter() - start)
+        self.results[stage.key] = value
+        return value
+
+def fetch_tcwret(fname, url=TCWRET_URL, verbose=True):
+    '''
+    Download TCWret if fname does not exist
+    '''
+    if not os.path.exists(fname):
+        download_data = _script('download_data')
+        summary = download_data.download([(url, os.path.basename(fname))], os.path.dirname(fname) or '.', 1, verbose)
+        if not os.path.exists(fname):
+            raise OSError("Could not download {} from {} ({})".format(fname, url, summary))
+    return fname
+
+def fetch_cloudnet(raw, workers=8, mirror=None, verbose=True):
+    '''
+    Download missing raw Cloudnet files
+    '''
+    download_data = _script('download_data')
+    return download_data.download(download_data.list_jobs(mirror=mirror), raw, workers, verbose)
+
+def merge(raw, path, workers=None, verbose=True):
+    '''
+    Merge new or outdated days of raw into path
+    '''
+    merge_data = _script('merge_data')
+    summary = merge_data.merge_all(raw, path, workers, verbose=verbose)
+    if summary['failed']:
+        raise RuntimeError("Merging failed for {}".format(", ".join(str(day) for day, _ in summary['failed'])))
+    return summary
+
+def tcwret_table(f, start=None, stop=None):
+    '''
+    TCWret table of the samples [start, stop) of an open TCWret file
+    '''
+    import numpy as np
+    import pandas as pd
+    from . import timeaxis
+    window = slice(start, stop)
+    time = f.variables['time_of_measurement']
+    out = {'time': timeaxis.decode(time[window], getattr(time, 'units', timeaxis.UNITS_TCWRET), rounding='trunc')}
+    for name, column in TCWRET_VARIABLES.items():
+        if name in f.variables:
+            out[column] = np.ma.filled(f.variables[name][window].astype('f8'), np.nan)
+    out['tcw(1)'] = out['tl(1)'] + out['ti(1)']
+    return pd.DataFrame(out)
+
+def load_tcwret(fname):
+    with instrument.dataset(fname) as f:
+        return tcwret_table(f)
+
+def load_cloudnet(path, quantity, invalid=None):
+    '''
+    Valid profiles, invalid defaults to the status lists of evaluation.cloudnet
+    '''
+    from . import cloudnet
+    keyword = {'liquid': 'lwc_invalid', 'ice': 'iwc_invalid', 'rliq': 'reff_invalid'}[quantity]
+    kwargs = {} if invalid is None else {keyword: invalid}
+    profiles = cloudnet.integrate(path, [quantity], **kwargs)
+    return profiles.loc[profiles['valid_' + quantity]].drop(columns='valid_' + quantity).reset_index(drop=True)
+
+def screen(tcwret, **overrides):
+    '''
+    Samples passing evaluation.sweep.SCREENING updated by overrides
+    '''
+    from . import sweep
+    screening = dict(sweep.SCREENING)
+    screening.update(overrides)
+    return tcwret.loc[sweep.screening_masks(tcwret, [screening])[0]].reset_index(drop=True)
+
+def aggregate(table, delta, columns, origin=None, stop=None):
+    from . import binning
+    return binning.aggregate(table, delta, columns, origin, stop)
+
+def collocate(tcwret, cloudnet, columns_a, columns_b, window=0):
+    '''
+    TCWret columns next to the Cloudnet columns (suffix _cnet) of the same bin,
+    or averaged over all profiles within +-window seconds
+    '''
+    from . import collocate
+    cloudnet = cloudnet.rename(columns={key: key + '_cnet' for key in columns_b})
+    return collocate.match(tcwret, cloudnet, window, columns_a, [key + '_cnet' for key in columns_b])
+
+def columns(name):
+    '''
+    Columns of the TCWret and of the Cloudnet bins of comparison name
+    '''
+    comparison = COMPARISONS[name]
+    columns_a = [comparison['x'], comparison['dx'], 'pwv(cm)']
+    columns_b = [comparison['y'], comparison['dy']]
+    for key in comparison['positive']:
+        columns_a += [key] if key not in columns_a else []
+        columns_b += [key] if key not in columns_b else []
+    return columns_a, columns_b
+
+def subsets(matched, y, pwv_max=(), y_max=(), label=None, pwv='<=', positive=()):
+    '''
+    Label -> mask of the matched samples: all, PWV below pwv_max (compared by pwv,
+    '<=' or '<'), y <= y_max and both. With positive only the samples with
+    column > 0 and column_cnet > 0 for all these columns are used.
+    '''
+    import numpy as np
+    label = y if label is None else label
+    below = OPERATORS[pwv]
+    cax = np.asarray(matched['pwv(cm)'])
+    yax = np.asarray(matched[y])
+    keep = None
+    for key in positive:
+        mask = (np.asarray(matched[key]) > 0.0) & (np.asarray(matched[key + '_cnet']) > 0.0)
+        keep = mask if keep is None else keep & mask
+    out = {'All': keep}
+    for value in pwv_max:
+        out['PWV {} {}'.format(pwv, value)] = below(cax, value)
+    for value in y_max:
+        out['{} <= {}'.format(label, value)] = yax <= value
+    for value_pwv in pwv_max:
+        for value_y in y_max:
+            out['{} <= {} PWV {} {}'.format(label, value_y, pwv, value_pwv)] = (yax <= value_y) & below(cax, value_pwv)
+    if keep is not None:
+        out.update({key: mask & keep for key, mask in out.items() if key != 'All'})
+    return out
+
+def statistics(matched, x, y, pwv_max=(), y_max=(), n_replicates=0, block=None, seed=0, label=None, pwv='<=', positive=()):
+    '''
+    Rows of statistics of the subsets (see subsets) as plain dictionaries, so reading
+    them from the cache needs no pandas
+    '''
+    from . import bootstrap
+    pairs = bootstrap.split(matched[x], matched[y], subsets(matched, y, pwv_max, y_max, label, pwv, positive))
+    if n_replicates > 0:
+        table = bootstrap.table(pairs, n_replicates, block, seed=seed)
+    else:
+        import pandas as pd
+        table = pd.DataFrame([dict(data=label, **bootstrap.summary(*pair)) if len(pair[0]) > 1 else {'data': label, 'n': len(pair[0])} \
+                              for label, pair in pairs.items()], columns=COLUMNS)
+    return [{key: (value if isinstance(value, str) else float(value)) for key, value in row.items()} for row in table.to_dict('records')]
+
+def stages(name, tcwret_stage, cloudnet_path, args):
+    '''
+    Stages of one comparison up to stats
+    '''
+    comparison = COMPARISONS[name]
+    quantity = comparison['quantity']
+    fnames = glob.glob(os.path.join(cloudnet_path, 'cnet_*.nc'))
+    profiles = Stage('cloudnet', load_cloudnet, {'path': cloudnet_path, 'quantity': quantity, 'invalid': args.invalid}, depends=fingerprint(fnames))
+
+    ## Only the changes of the screening defaults are passed, the defaults are covered by VERSION
+    screening = dict(comparison['screening'])
+    for key in ['tau_max', 'red_chi_2_max', 'fi_min', 'fi_max']:
+        if getattr(args, key, None) is not None:
+            screening[key] = getattr(args, key)
+    screened = Stage('screen', screen, screening, [tcwret_stage])
+
+    columns_a, columns_b = columns(name)
+    if args.window is None:
+        ## The default range is left out of the key
+        bins = {key: getattr(args, key) for key in ['origin', 'stop'] if getattr(args, key, None) is not None}
+        inputs = [Stage('aggregate', aggregate, dict(delta=args.delta, columns=columns_a, **bins), [screened]), \
+                  Stage('aggregate', aggregate, dict(delta=args.delta, columns=columns_b, **bins), [profiles])]
+        window = 0
+    else:
+        inputs = [screened, profiles]
+        window = args.window
+    matched = Stage('collocate', collocate, {'columns_a': columns_a, 'columns_b': columns_b, 'window': window}, inputs)
+    return Stage('stats', statistics, {'x': comparison['x'], 'y': comparison['y'] + '_cnet', 'pwv_max': args.pwv_max, \
+                                       'y_max': args.y_max, 'n_replicates': args.bootstrap, 'block': args.block, \
+                                       'label': comparison['y'], 'pwv': comparison['pwv'], 'positive': comparison['positive']}, [matched])
+
+def print_table(name, rows):
+    columns = COLUMNS_BOOTSTRAP if rows and 'r_lo' in rows[0] else COLUMNS
+    print(name)
+    print("\t".join(["{:<36}".format(columns[0])] + columns[1:]))
+    for row in rows:
+        values = ["{:<36}".format(row['data'])] + ["{:.0f}".format(row['n'])] + \
+                 ["{:.2f}".format(row.get(key, float('nan'))) for key in columns[2:]]
+        print("\t".join(values))
+
+def main(args):
+    verbose = not args.quiet
+    instrument.setup(args.profile, args.profile_memory)
+    start = timer.perf_counter()
+    if args.raw is not None:
+        fetch_cloudnet(args.raw, args.workers or 8, args.mirror, verbose)
+        merge(args.raw, args.cloudnet, args.workers, verbose)
+    fetch_tcwret(args.tcwret, args.url, verbose)
+    if args.stream:
+        return _main_stream(args, verbose, start)
+    cache = None if args.no_cache else Cache(args.cache, args.cache_size)
+    pipeline = Pipeline(cache, verbose)
+    tcwret_stage = Stage('tcwret', load_tcwret, {'fname': os.path.abspath(args.tcwret)}, depends=fingerprint([args.tcwret]))
+    results = {}
+    for name in args.comparisons:
+        results[name] = pipeline.evaluate(stages(name, tcwret_stage, os.path.abspath(args.cloudnet), args))
+        print_table(name, results[name])
+    if verbose:
+        print("total      {:>17.3f} s".format(timer.perf_counter() - start), file=sys.stderr)
+    return results
+
+def _main_stream(args, verbose, start):
+    '''
+    Bounded memory mode, see evaluation.stream. No cache, no bootstrap, bins only.
+    '''
+    from . import stream
+    if args.window is not None or args.bootstrap:
+        raise SystemExit("--stream supports neither --window nor --bootstrap")
+    screening = {key: getattr(args, key) for key in ['tau_max', 'red_chi_2_max', 'fi_min', 'fi_max'] if getattr(args, key) is not None}
+    results = {}
+    for name in args.comparisons:
+        results[name] = stream.compare(args.tcwret, args.cloudnet, name, args.delta, args.invalid, args.pwv_max, args.y_max, \
+                                       args.chunk_size, args.origin, args.stop, **screening)
+        print_table(name, results[name])
+    if verbose:
+        print("total      {:>17.3f} s".format(timer.perf_counter() - start), file=sys.stderr)
+    return results
+
+def _floats(text):
+    return [float(value) for value in text.split(',')] if text else []
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare TCWret and Cloudnet using cached pipeline stages")
+    parser.add_argument('comparisons', nargs='+', choices=list(COMPARISONS))
+    parser.add_argument('--tcwret', default='TCWret.nc', help="TCWret file, downloaded if it does not exist")
+    parser.add_argument('--url', default=TCWRET_URL)
+    parser.add_argument('--cloudnet', default='get_cloudnet', help="Directory of the merged cnet_MM_DD.nc files")
+    parser.add_argument('--raw', default=None, help="Download and merge raw Cloudnet files in this directory first")
+    parser.add_argument('--mirror', default=None)
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--delta', type=int, default=2, help="Bin width in minutes")
+    parser.add_argument('--origin', default=None, help="Start of the first bin, e.g. 2018-06-01T00:00, default PS106")
+    parser.add_argument('--stop', default=None, help="End of the last bin, default PS106")
+    parser.add_argument('--window', type=float, default=None, help="Collocate profiles within +-window seconds instead of bins")
+    parser.add_argument('--invalid', type=lambda text: [int(value) for value in text.split(',')], default=None, \
+                        help="Invalid Cloudnet status codes, e.g. 4,5,6")
+    parser.add_argument('--tau-max', dest='tau_max', type=float, default=None)
+    parser.add_argument('--red-chi-2-max', dest='red_chi_2_max', type=float, default=None)
+    parser.add_argument('--fi-min', dest='fi_min', type=float, default=None)
+    parser.add_argument('--fi-max', dest='fi_max', type=float, default=None)
+    parser.add_argument('--pwv-max', dest='pwv_max', type=_floats, default=[1.0], help="PWV thresholds in cm, e.g. 1.0,0.5")
+    parser.add_argument('--y-max', dest='y_max', type=_floats, default=[], help="Thresholds of the Cloudnet quantity")
+    parser.add_argument('--bootstrap', type=int, default=0, help="Number of bootstrap replicates for confidence intervals")
+    parser.add_argument('--block', type=int, default=None, help="Block length of the moving block bootstrap")
+    parser.add_argument('--cache', default='.cache', help="Cache directory")
+    parser.add_argument('--cache-size', default='2G', help="Maximum size of the cache, e.g. 500M")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--stream', action='store_true', help="Read the data in chunks with bounded memory, without cache")
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=100000, help="Samples per chunk with --stream")
+    parser.add_argument('--profile', default=None, help="Write a timing report (evaluation.instrument) to this file")
+    parser.add_argument('--profile-memory', dest='profile_memory', action='store_true', help="Add tracemalloc peaks to the report")
+    parser.add_argument('-q', '--quiet', action='store_true')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    main(parse_args())
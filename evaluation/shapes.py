@@ -0,0 +1,120 @@
+'''
+Comparison of TCWret results for different ice crystal shapes (habits)
+
+The result files of all habits are read once (in parallel), aligned on the
+common time_of_measurement in one pass into an array of shape
+(habit, sample, variable), and the standard deviation of the differences of
+every pair of habits is computed for all variables at once.
+
+    tables = load([path + habit + '.nc' for habit in HABITS])
+    times, cube, variables = align(tables, threshold=0.1)
+    sd = spread(cube)                       # (variable, habit, habit)
+    print_latex(sd[variables.index('ri(um)')], LABELS, 9.68)
+'''
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from . import errors, instrument
+
+HABITS = ['spheres', 'aggregates', 'bulletrosettes', 'droxtals', 'hollowcols', 'plates', 'solidcols', 'spheroids']
+LABELS = ["Spheres", "Aggregates", "Bullet Rosettes", "Droxtals", "Hollow Column", "Plates", "Solid Columns", "Spheroids"]
+LABELS_SHORT = ["SPH", "A", "BR", "D", "HC", "P", "SC", "SPO"]
+
+def read_tcwret(fname_tcwret):
+    '''
+    Converged results (reduced chi2 <= 1, total optical depth <= 6) of one habit.
+    fi and its error are propagated from the TCWret covariance by evaluation.errors.
+    '''
+    with instrument.dataset(fname_tcwret) as f:
+        seconds = f.variables['time_of_measurement'][:]
+        red_chi_2 = f.variables['reduced_chi_2'][:]
+        iwp = f.variables['ice_water_path'][:]
+        iwp_err = f.variables['ice_water_path_error'][:]
+        x, error, cov = errors.read_state(f)
+
+    idx_valid = np.where((red_chi_2 <= 1.0) & (errors.total_optical_depth(x) <= 6.0))[0]
+    fi, dfi = errors.linear(errors.ice_fraction, x[idx_valid], cov[idx_valid])
+
+    return pd.DataFrame({'time': seconds[idx_valid], \
+                         'ti(1)': x[idx_valid, errors.TI], \
+                         'dti(1)': error[idx_valid, errors.TI], \
+                         'iwp(gm-2)': iwp[idx_valid], \
+                         'diwp(gm-2)': iwp_err[idx_valid], \
+                         'fi(1)': fi, \
+                         'dfi(1)': dfi, \
+                         'rl(um)': x[idx_valid, errors.RL], \
+                         'drl(um)': error[idx_valid, errors.RL], \
+                         'ri(um)': x[idx_valid, errors.RI], \
+                         'dri(um)': error[idx_valid, errors.RI]})
+
+@instrument.timed('shapes.load')
+def load(fnames, workers=None, reader=read_tcwret):
+    '''
+    Read all files in parallel, returns the list of tables in the order of fnames
+    '''
+    if workers == 1 or len(fnames) == 1:
+        return [reader(fname) for fname in fnames]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(reader, fnames))
+
+@instrument.timed('shapes.align')
+def align(tables, threshold=None, key='fi(1)', variables=None, time='time'):
+    '''
+    Keep the samples with key > threshold (if threshold is not None) which are
+    present in all tables. Returns (times, cube, variables) with the sorted common
+    times and cube[habit, sample, variable]. If a time occurs more than once in a
+    table, the first occurrence is used.
+    '''
+    if variables is None:
+        variables = [name for name in tables[0].columns if name != time]
+    selected = []
+    for table in tables:
+        keep = np.ones(len(table), dtype=bool) if threshold is None else np.asarray(table[key] > threshold)
+        times, first = np.unique(np.asarray(table[time])[keep], return_index=True)
+        selected.append((times, np.flatnonzero(keep)[first]))
+    ## A time is common to all habits if it occurs once in each of the unique time arrays
+    values, counts = np.unique(np.concatenate([times for times, _ in selected]), return_counts=True)
+    common = values[counts == len(tables)]
+
+    cube = np.empty((len(tables), common.size, len(variables)))
+    for ii, (table, (times, rows)) in enumerate(zip(tables, selected)):
+        rows = rows[np.searchsorted(times, common)]
+        cube[ii] = np.column_stack([np.asarray(table[name], dtype='f8')[rows] for name in variables])
+    return common, cube, list(variables)
+
+@instrument.timed('shapes.spread')
+def spread(cube):
+    '''
+    Standard deviation (ddof=0) of the differences between all pairs of habits
+    for every variable, shape (variable, habit, habit).
+    Uses var(a-b) = var(a) + var(b) - 2cov(a, b) on the centred data.
+    '''
+    centred = cube - cube.mean(axis=1, keepdims=True)
+    cov = np.einsum('isv,jsv->vij', centred, centred) / cube.shape[1]
+    var = np.diagonal(cov, axis1=1, axis2=2)
+    return np.sqrt(np.clip(var[:, :, None] + var[:, None, :] - 2*cov, 0.0, None))
+
+def bias(cube):
+    '''
+    Mean difference between all pairs of habits, shape (variable, habit, habit)
+    '''
+    mean = cube.mean(axis=1).T
+    return mean[:, :, None] - mean[:, None, :]
+
+def print_latex(matrix, labels, threshold):
+    '''
+    Print matrix as LaTeX table, values above threshold are marked with **
+    '''
+    print(r"\begin{tabular}{|" + "c|"*(len(labels)+1) + "}")
+    print(r"\hline")
+    print(r"& " + " & ".join(labels) + r"\\")
+    print(r"\hline")
+    for ii in range(len(labels)):
+        std = labels[ii] + " &"
+        for jj in range(len(labels)):
+            if matrix[ii, jj] > threshold:
+                std += r' $\SI{%.2f}{}**$ &' % (matrix[ii, jj])
+            else:
+                std += r' $\SI{%.2f}{}$ &' % (matrix[ii, jj])
+        print(std + "\n" + r"\hline")
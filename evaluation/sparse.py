@@ -0,0 +1,118 @@
+'''
+Sparse index of the cloudy pixels of a day of Cloudnet profiles
+
+Most of the (time, level) grid is clear sky. The cloudy pixels are stored in
+CSR layout: the levels of the cloudy pixels of profile t are
+level[offset[t]:offset[t+1]], in ascending order. A pixel is cloudy if its
+water path per layer is > 0 or missing (see evaluation.cloudnet). Reductions
+(sums, means, maxima per profile) are computed on the values gathered at the
+cloudy pixels only.
+
+The retrieval status of a profile is summarised as bit flags, bit k is set if
+status k occurs on any level, so screening with any list of invalid codes is a
+lookup instead of a scan over all levels.
+
+    offset, level = index(cloudy)
+    row = rows(offset)
+    lwp = segment_sum(lwp_lay[row, level], offset)
+'''
+import numpy as np
+
+MAX_STATUS = 15
+
+def index(cloudy):
+    '''
+    Boolean (time, level) array -> (offset, level) of the True pixels
+    '''
+    cloudy = np.asarray(cloudy, dtype=bool)
+    offset = np.zeros(cloudy.shape[0] + 1, dtype='i8')
+    np.cumsum(cloudy.sum(axis=-1), out=offset[1:])
+    return offset, np.nonzero(cloudy)[1]
+
+def rows(offset):
+    '''
+    Profile number of every pixel
+    '''
+    return np.repeat(np.arange(offset.size - 1), np.diff(offset))
+
+def position(offset):
+    '''
+    Rank of every pixel within its profile, counting from 0 at the lowest cloudy level
+    '''
+    return np.arange(offset[-1]) - np.repeat(offset[:-1], np.diff(offset))
+
+def gather(values, offset, level):
+    '''
+    Values of a (time, level) masked array at the pixels -> (data as float, mask), NaN counts as missing
+    '''
+    row = rows(offset)
+    data = np.ma.getdata(values)[row, level].astype('f8')
+    mask = np.ma.getmask(values)
+    mask = np.zeros(data.shape, dtype=bool) if mask is np.ma.nomask else mask[row, level]
+    return data, mask | np.isnan(data)
+
+def segment_sum(data, offset, mask=None):
+    '''
+    Sum over the unmasked pixels of each profile, 0 for profiles without pixels
+    '''
+    weights = data if mask is None else np.where(mask, 0.0, data)
+    ## bincount returns integers if there are no pixels at all
+    return np.bincount(rows(offset), weights, minlength=offset.size - 1).astype('f8', copy=False)
+
+def segment_count(offset, mask=None):
+    '''
+    Number of unmasked pixels of each profile
+    '''
+    if mask is None:
+        return np.diff(offset)
+    return np.bincount(rows(offset)[~mask], minlength=offset.size - 1)
+
+def segment_mean(data, offset, mask=None):
+    count = segment_count(offset, mask)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, segment_sum(data, offset, mask) / count, np.nan)
+
+def segment_max(data, offset, mask=None):
+    out = np.full(offset.size - 1, -np.inf)
+    keep = slice(None) if mask is None else ~mask
+    np.maximum.at(out, rows(offset)[keep], data[keep])
+    out[np.isneginf(out)] = np.nan
+    return out
+
+def summary(offset, level, height):
+    '''
+    Per profile: cloud base and top (height of the lowest and highest cloudy
+    level, NaN without cloud) and number of layers of consecutive cloudy levels
+    '''
+    height = np.asarray(height, dtype='f8')
+    count = np.diff(offset)
+    cloudy = count > 0
+    base = np.full(count.size, np.nan)
+    top = np.full(count.size, np.nan)
+    base[cloudy] = height[level[offset[:-1][cloudy]]]
+    top[cloudy] = height[level[offset[1:][cloudy] - 1]]
+    ## A pixel starts a layer if it is the lowest of its profile or the level below is clear
+    start = np.ones(level.size, dtype=bool)
+    start[1:] = level[1:] != level[:-1] + 1
+    start[offset[:-1][cloudy]] = True
+    layers = np.bincount(rows(offset)[start], minlength=count.size)
+    return base, top, layers
+
+def status_flags(status):
+    '''
+    Bit flags of the status codes occurring in each profile, missing status counts as 0
+    '''
+    status = np.ma.filled(status, 0).astype('i8')
+    if status.size and (status.min() < 0 or status.max() > MAX_STATUS):
+        raise ValueError("Status codes must be between 0 and {}".format(MAX_STATUS))
+    flags = np.zeros(status.shape[0], dtype='u2')
+    for code in np.unique(status):
+        flags |= (status == code).any(axis=-1).astype('u2') << np.uint16(code)
+    return flags
+
+def flags_invalid(flags, invalid):
+    '''
+    True for profiles with one of the invalid status codes on any level
+    '''
+    bits = np.uint16(sum(1 << int(code) for code in set(invalid)))
+    return (np.asarray(flags, dtype='u2') & bits) != 0
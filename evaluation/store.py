@@ -0,0 +1,178 @@
+'''
+Campaign store: all merged Cloudnet days (cnet_MM_DD.nc) in one netCDF file
+
+Each cruise is a group of the file (e.g. PS106) with an unlimited time dimension.
+Variables are chunked along time and zlib compressed, time is stored as seconds
+since 1970-01-01, so the global time index is a plain datetime64 array. The
+loader reads the time index, finds the requested time range by binary search
+and reads only the requested variables and rows, i.e. only the chunks touched.
+
+    python -m evaluation.store build get_cloudnet campaign.nc --cruise PS106
+    store = Store('campaign.nc', 'PS106')
+    data = store.read(['liquid_water_path_MWR'], '2017-06-01', '2017-06-08')
+'''
+import argparse
+import datetime as dt
+import os
+import re
+import numpy as np
+
+from . import instrument, timeaxis
+
+UNITS = "seconds since 1970-01-01"
+CHUNK_TIME = 2880
+COMPLEVEL = 4
+## cnet_MM_DD.nc (days of 2017) or cnet_YYYY_MM_DD.nc, see get_cloudnet/merge_data.py
+FNAME = re.compile(r'^cnet_(?:(\d{4})_)?(\d{2})_(\d{2})\.nc$')
+
+def list_days(path, year=2017):
+    '''
+    Return (date, file name) of all merged files in path in time order,
+    year is the year of the files named cnet_MM_DD.nc
+    '''
+    days = []
+    for fname in os.listdir(path):
+        match = FNAME.match(fname)
+        if match is not None:
+            year_ = year if match.group(1) is None else int(match.group(1))
+            days.append((dt.date(year_, int(match.group(2)), int(match.group(3))), os.path.join(path, fname)))
+    return sorted(days)
+
+def _create(grp, src, chunk_time=CHUNK_TIME, complevel=COMPLEVEL):
+    '''
+    Create dimensions and variables of a cruise group following the layout of a merged file
+    '''
+    grp.createDimension('time', None)
+    grp.createDimension('level', len(src.dimensions['level']))
+    grp.createDimension('day', None)
+    time = grp.createVariable('time', 'i8', ('time', ), zlib=True, complevel=complevel, chunksizes=(chunk_time, ))
+    time.units = UNITS
+    day = grp.createVariable('day', 'i8', ('day', ))
+    day.units = "days since 1970-01-01"
+    day_start = grp.createVariable('day_start', 'i8', ('day', ))
+    day_start.comment = 'Index of the first profile of each day'
+    height = grp.createVariable('height', src.variables['height'].dtype, ('level', ))
+    height.setncatts(src.variables['height'].__dict__)
+    height[:] = src.variables['height'][:]
+    for name, var in src.variables.items():
+        if name in ('datetime', 'height'):
+            continue
+        attrs = {key: value for key, value in var.__dict__.items() if key != '_FillValue'}
+        fill = var.__dict__.get('_FillValue', None)
+        if var.dimensions == ('time', 'level'):
+            out = grp.createVariable(name, var.dtype, ('time', 'level'), zlib=True, shuffle=True, complevel=complevel, \
+                                     chunksizes=(chunk_time, len(src.dimensions['level'])), fill_value=fill)
+        elif var.dimensions == ('time', ):
+            out = grp.createVariable(name, var.dtype, ('time', ), zlib=True, shuffle=True, complevel=complevel, \
+                                     chunksizes=(chunk_time, ), fill_value=fill)
+        elif var.dimensions == ('const', ):
+            ## Per-day constants, e.g. ice_water_content_bias
+            out = grp.createVariable(name, var.dtype, ('day', ), fill_value=fill)
+        else:
+            ## The sparse pixel index is relative to the day, it is not collected
+            continue
+        out.setncatts(attrs)
+
+def build(path, fname, cruise='PS106', year=2017, chunk_time=CHUNK_TIME, complevel=COMPLEVEL, verbose=True):
+    '''
+    Append all days in path which are not yet in group cruise of fname. Days must
+    be newer than the last day of the group, the time index stays sorted.
+    Returns the number of days appended.
+    '''
+    days = list_days(path, year)
+    mode = 'a' if os.path.exists(fname) else 'w'
+    appended = 0
+    with instrument.dataset(fname, mode) as f:
+        grp = f.groups.get(cruise)
+        for date, fname_day in days:
+            number = (np.datetime64(date, 'D') - np.datetime64('1970-01-01', 'D')).astype('i8')
+            if grp is not None and len(grp.dimensions['day']) > 0:
+                if number in grp.variables['day'][:]:
+                    continue
+                if number < grp.variables['day'][-1]:
+                    raise ValueError("{} is older than the last day in {}/{}, rebuild the store".format(date, fname, cruise))
+            with instrument.dataset(fname_day) as src:
+                if grp is None:
+                    grp = f.createGroup(cruise)
+                    _create(grp, src, chunk_time, complevel)
+                if not np.array_equal(grp.variables['height'][:], src.variables['height'][:]):
+                    raise ValueError("{}: height grid differs from {}/{}".format(fname_day, fname, cruise))
+                start = len(grp.dimensions['time'])
+                iday = len(grp.dimensions['day'])
+                time = timeaxis.read_time(src.variables['datetime'])
+                stop = start + time.size
+                grp.variables['time'][start:stop] = time.astype('i8')
+                grp.variables['day'][iday] = number
+                grp.variables['day_start'][iday] = start
+                for name, var in src.variables.items():
+                    if name in ('datetime', 'height') or name not in grp.variables:
+                        continue
+                    if var.dimensions[0] == 'time':
+                        grp.variables[name][start:stop] = var[:]
+                    else:
+                        grp.variables[name][iday] = var[:].reshape(-1)[0]
+            appended += 1
+            if verbose:
+                print("Added {} to {}/{}".format(date, fname, cruise))
+    return appended
+
+class Store:
+    '''
+    Lazy access to one cruise of a campaign store. Only the time index is read on
+    opening, variables are read on demand for the requested time range.
+    '''
+    def __init__(self, fname, cruise='PS106'):
+        self.dataset = instrument.dataset(fname)
+        self.group = self.dataset.groups[cruise]
+        self.time = np.ma.getdata(self.group.variables['time'][:]).astype('datetime64[s]')
+        self.height = self.group.variables['height'][:]
+
+    def close(self):
+        self.dataset.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def variables(self):
+        return [name for name, var in self.group.variables.items() if var.dimensions[0] == 'time' and name != 'time']
+
+    def index(self, start=None, stop=None):
+        '''
+        Slice of the profiles within [start, stop)
+        '''
+        i0 = 0 if start is None else np.searchsorted(self.time, np.datetime64(start, 's'), side='left')
+        i1 = self.time.size if stop is None else np.searchsorted(self.time, np.datetime64(stop, 's'), side='left')
+        return slice(int(i0), int(i1))
+
+    def read(self, variables, start=None, stop=None):
+        '''
+        Dictionary with time, height and the requested variables within [start, stop)
+        '''
+        sel = self.index(start, stop)
+        out = {'time': self.time[sel], 'height': self.height}
+        for name in variables:
+            out[name] = self.group.variables[name][sel]
+        return out
+
+def cruises(fname):
+    with instrument.dataset(fname) as f:
+        return list(f.groups)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or extend a campaign store from merged Cloudnet files")
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('path', help="Directory with cnet_MM_DD.nc (build) or the store (info)")
+    parser.add_argument('fname', nargs='?', default='campaign.nc')
+    parser.add_argument('--cruise', default='PS106')
+    parser.add_argument('--year', type=int, default=2017)
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args.path, args.fname, args.cruise, args.year)
+    else:
+        for cruise in cruises(args.path):
+            with Store(args.path, cruise) as store:
+                print("{}: {} profiles, {} to {}".format(cruise, store.time.size, store.time[0], store.time[-1]))
@@ -0,0 +1,220 @@
+'''
+Streaming comparison of TCWret and Cloudnet in bounded memory
+
+The TCWret file and the merged Cloudnet files are read in time ordered chunks
+of chunk_size samples (profiles) and passed through a chain of generators:
+
+    read_tcwret -> screen -> aggregate --\\
+                                          intersect -> Moments per subset
+    read_cloudnet ---------> aggregate --/
+
+aggregate carries the samples of the last, possibly incomplete bin over to the
+next chunk and intersect holds back the bins later than the last bin of the
+other stream, so the binned and matched values, and with them the counts of
+all subsets, are exactly those of the in-memory path (evaluation.pipeline).
+The statistics are accumulated as running moments (evaluation.moments), which
+add up the chunks in another order than the one-pass statistics of the
+in-memory path, so r, p, bias and SD can differ in the last digits (relative
+1e-9 in tests/test_stream.py). Memory is bounded by the chunk size and the
+number of samples of one bin, not by the length of the archive. The averaging kernels are not read.
+
+    rows = compare('TCWret_PS106_PS107.nc', 'get_cloudnet', 'lwp', delta=2, pwv_max=[1.0])
+
+Bins lie between origin and stop, None stands for evaluation.binning.ORIGIN and
+STOP (PS106); set both for data of another campaign.
+'''
+import os
+import numpy as np
+import pandas as pd
+
+from . import binning, cloudnet, instrument, pipeline, sweep, timeaxis
+from .moments import Moments
+
+CHUNK_SIZE = 100000
+
+def _check_order(time, last):
+    '''
+    Raise if time is not sorted or starts before last, returns the new last time
+    '''
+    seconds = np.asarray(time, dtype='datetime64[s]')
+    if seconds.size == 0:
+        return last
+    if np.any(seconds[1:] < seconds[:-1]) or (last is not None and seconds[0] < last):
+        raise ValueError("Streaming needs data in time order")
+    return seconds[-1]
+
+def _bisect(variable, value):
+    '''
+    First index of a sorted 1-d netCDF variable with variable[index] >= value, reads log2(n) values
+    '''
+    lo, hi = 0, len(variable)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if variable[mid] < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _union(ranges):
+    '''
+    Sorted, non-overlapping (start, stop) ranges covering ranges
+    '''
+    out = []
+    for start, stop in sorted((np.datetime64(start, 's'), np.datetime64(stop, 's')) for start, stop in ranges):
+        if out and start <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], stop))
+        else:
+            out.append((start, stop))
+    return out
+
+def read_tcwret(fname, chunk_size=CHUNK_SIZE, ranges=None):
+    '''
+    TCWret tables of chunk_size samples, only of the samples within the time
+    ranges [start, stop) if given. The file is in time order, the ranges are
+    found by binary search without reading the time axis.
+    '''
+    with instrument.dataset(fname) as f:
+        time = f.variables['time_of_measurement']
+        if ranges is None:
+            bounds = [(0, len(time))]
+        else:
+            units = getattr(time, 'units', timeaxis.UNITS_TCWRET)
+            bounds = [(_bisect(time, timeaxis.encode(start, units)), _bisect(time, timeaxis.encode(stop, units))) \
+                      for start, stop in _union(ranges)]
+        for lo, hi in bounds:
+            for start in range(lo, hi, chunk_size):
+                yield pipeline.tcwret_table(f, start, min(start + chunk_size, hi))
+
+def read_cloudnet(path, quantity, invalid=None, chunk_size=CHUNK_SIZE, fnames=None):
+    '''
+    Valid Cloudnet profiles of all merged files in path (or of fnames in path),
+    read chunk_size profiles at a time
+    '''
+    keyword = {'liquid': 'lwc_invalid', 'ice': 'iwc_invalid', 'rliq': 'reff_invalid'}[quantity]
+    kwargs = {} if invalid is None else {keyword: invalid}
+    fnames = cloudnet.list_files(path) if fnames is None else sorted(os.path.basename(fname) for fname in fnames)
+    for fname in fnames:
+        with instrument.dataset(os.path.join(path, fname)) as f:
+            names = cloudnet.variables([quantity], cloudnet.is_indexed(f))
+            size = len(f.dimensions['time'])
+            for start in range(0, size, chunk_size):
+                stop = min(start + chunk_size, size)
+                var = cloudnet.read(f, names, start, stop)
+                out = {'time': timeaxis.decode(f.variables['datetime'][start:stop], f.variables['datetime'].units)}
+                out.update(cloudnet.compute(var, [quantity], **kwargs))
+                valid = out.pop('valid_' + quantity)
+                yield pd.DataFrame(out).loc[valid].reset_index(drop=True)
+
+def screen(chunks, **overrides):
+    '''
+    Samples of each chunk passing evaluation.sweep.SCREENING updated by overrides
+    '''
+    screening = dict(sweep.SCREENING)
+    screening.update(overrides)
+    for chunk in chunks:
+        yield chunk.loc[sweep.screening_masks(chunk, [screening])[0]].reset_index(drop=True)
+
+def aggregate(chunks, delta, columns, origin=None, stop=None, time='time'):
+    '''
+    Bins of delta minutes as evaluation.binning.aggregate, for time ordered chunks
+    '''
+    origin = np.datetime64(binning.ORIGIN if origin is None else origin, 's')
+    width = int(round(delta*60))
+    carry = None
+    last = None
+    for chunk in chunks:
+        last = _check_order(chunk[time], last)
+        table = chunk if carry is None else pd.concat([carry, chunk], ignore_index=True)
+        if len(table) == 0:
+            continue
+        number = (np.asarray(table[time], dtype='datetime64[s]') - origin).astype('i8') // width
+        ## The bin of the last sample may continue in the next chunk
+        open_bin = number == number[-1]
+        carry = table.loc[open_bin]
+        closed = table.loc[~open_bin]
+        if len(closed):
+            out = binning.aggregate(closed, delta, columns, origin, stop, time)
+            if len(out):
+                yield out
+    if carry is not None and len(carry):
+        out = binning.aggregate(carry, delta, columns, origin, stop, time)
+        if len(out):
+            yield out
+
+def intersect(bins_a, bins_b, columns_a, columns_b, time='time'):
+    '''
+    Bins present in both time ordered streams, as evaluation.pipeline.collocate
+    '''
+    streams = [iter(bins_a), iter(bins_b)]
+    pending = [None, None]
+    done = [False, False]
+    while True:
+        for ii in range(2):
+            while not done[ii] and (pending[ii] is None or len(pending[ii]) == 0):
+                chunk = next(streams[ii], None)
+                if chunk is None:
+                    done[ii] = True
+                else:
+                    pending[ii] = chunk
+        if any(done[ii] and (pending[ii] is None or len(pending[ii]) == 0) for ii in range(2)):
+            return
+        ## Bins up to the smaller of the two last times are complete in both streams
+        bound = min(np.asarray(pending[ii][time])[-1] for ii in range(2))
+        ready = [np.asarray(pending[ii][time]) <= bound for ii in range(2)]
+        matched = pipeline.collocate(pending[0].loc[ready[0]], pending[1].loc[ready[1]], columns_a, columns_b)
+        pending = [pending[ii].loc[~ready[ii]].reset_index(drop=True) for ii in range(2)]
+        if len(matched):
+            yield matched
+
+def statistics(matched_chunks, x, y, pwv_max=(), y_max=(), label=None, pwv='<=', positive=()):
+    '''
+    Running moments of all subsets (see evaluation.pipeline.subsets), {label: Moments}
+    '''
+    out = {}
+    for matched in matched_chunks:
+        xax = np.asarray(matched[x], dtype='f8')
+        yax = np.asarray(matched[y], dtype='f8')
+        for name, mask in pipeline.subsets(matched, y, pwv_max, y_max, label, pwv, positive).items():
+            moments = out.setdefault(name, Moments())
+            if mask is None:
+                moments.update(xax, yax)
+            else:
+                moments.update(xax[mask], yax[mask])
+    return out
+
+def matched_bins(fname_tcwret, path_cnet, name, delta=2, invalid=None, chunk_size=CHUNK_SIZE, fnames=None, \
+                 origin=None, stop=None, ranges=None, **screening):
+    '''
+    Generator of the matched bins of comparison name (see evaluation.pipeline.COMPARISONS),
+    fnames restricts the Cloudnet files and ranges (see read_tcwret) the TCWret samples
+    '''
+    comparison = pipeline.COMPARISONS[name]
+    overrides = dict(comparison['screening'])
+    overrides.update(screening)
+    columns_a, columns_b = pipeline.columns(name)
+    tcwret = aggregate(screen(read_tcwret(fname_tcwret, chunk_size, ranges), **overrides), delta, columns_a, origin, stop)
+    profiles = aggregate(read_cloudnet(path_cnet, comparison['quantity'], invalid, chunk_size, fnames), delta, columns_b, origin, stop)
+    return intersect(tcwret, profiles, columns_a, columns_b)
+
+@instrument.timed('stream.compare')
+def compare(fname_tcwret, path_cnet, name, delta=2, invalid=None, pwv_max=(), y_max=(), chunk_size=CHUNK_SIZE, \
+            origin=None, stop=None, **screening):
+    '''
+    Statistics of comparison name as rows like evaluation.pipeline.statistics
+    '''
+    comparison = pipeline.COMPARISONS[name]
+    chunks = matched_bins(fname_tcwret, path_cnet, name, delta, invalid, chunk_size, origin=origin, stop=stop, **screening)
+    moments = statistics(chunks, comparison['x'], comparison['y'] + '_cnet', pwv_max, y_max, comparison['y'], \
+                         comparison['pwv'], comparison['positive'])
+    ## Subsets without any matched bin are reported with n = 0
+    labels = pipeline.subsets(pd.DataFrame({'pwv(cm)': [], comparison['y'] + '_cnet': []}), comparison['y'] + '_cnet', \
+                              pwv_max, y_max, comparison['y'], comparison['pwv'])
+    rows = []
+    for label in labels:
+        summary = moments.get(label, Moments()).summary()
+        if summary['n'] < 2:
+            summary.update({'r': np.nan, 'p': np.nan, 'bias': np.nan, 'sd': np.nan})
+        rows.append({'data': label, 'n': float(summary['n']), 'r': summary['r'], 'p': summary['p'], \
+                     'bias': summary['bias'], 'sd': summary['sd']})
+    return rows
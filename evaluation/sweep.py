@@ -0,0 +1,161 @@
+'''
+Sensitivity of the comparison statistics to the screening thresholds
+
+The screening constants of the notebooks (tau_max = 6.0, red_chi_2 <= 1.0,
+rliq < rice, the ice fraction limits, PWV <= 1.0 cm, LWP <= 20 g/m2, delta = 2
+and the invalid status lists) are swept over a grid. TCWret and Cloudnet are
+loaded once; for every bin width delta and every invalid status list the
+samples are assigned to bins once and all TCWret screening combinations are
+reduced together as a (combination, bin) array. The subsets (pwv_max, y_max)
+are applied to the matched bins as masks. Groups of (delta, invalid) are spread
+across a process pool.
+
+    profiles = cloudnet_profiles(path_cnet, 'liquid', [[4,5,6], [5,6], [6]])
+    grid = {'tau_max': [4.0, 6.0, 8.0], 'red_chi_2_max': [0.5, 1.0, 2.0], 'pwv_max': [1.0, np.inf], \\
+            'y_max': [20.0, np.inf], 'delta': [1, 2, 5], 'invalid': [[4,5,6], [5,6], [6]]}
+    result = sweep(tcwret_raw, profiles, 'lwp(gm-2)', 'lwp_mwr(gm-2)', grid)
+'''
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from . import binning, cloudnet, instrument, timeaxis
+
+## Screening of the TCWret samples, applied before binning
+SCREENING = {'tau_max': 6.0, 'red_chi_2_max': 1.0, 'rliq_lt_rice': True, 'fi_min': None, 'fi_max': None}
+## Subsets of the matched bins
+SUBSETS = {'pwv_max': np.inf, 'y_max': np.inf}
+GROUPS = {'delta': 2, 'invalid': None}
+
+CHUNK_SIZE = 5000000
+
+def cloudnet_profiles(path, quantity, invalid_lists):
+    '''
+    Valid Cloudnet profiles for every invalid status list: {tuple(invalid): DataFrame}.
+    The files are read only once.
+    '''
+    keyword = {'liquid': 'lwc_invalid', 'ice': 'iwc_invalid', 'rliq': 'reff_invalid'}[quantity]
+    days = []
+    for fname in cloudnet.list_files(path):
+        with instrument.dataset(os.path.join(path, fname)) as f:
+            var = cloudnet.read(f, cloudnet.variables([quantity], cloudnet.is_indexed(f)))
+            var['time'] = timeaxis.read_time(f.variables['datetime'])
+        days.append(var)
+    out = {}
+    for invalid in invalid_lists:
+        tables = []
+        for var in days:
+            columns = cloudnet.compute(var, [quantity], **{keyword: invalid})
+            columns['time'] = var['time']
+            tables.append(pd.DataFrame(columns))
+        table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame({'time': []})
+        out[tuple(invalid)] = table[table['valid_' + quantity]].reset_index(drop=True)
+    return out
+
+def _combinations(grid, defaults):
+    keys = list(defaults)
+    values = [grid.get(key, [defaults[key]]) for key in keys]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+def screening_masks(tcwret, combos):
+    '''
+    Boolean array (combination, sample) of the TCWret samples passing each screening combination
+    '''
+    tcw = np.asarray(tcwret['tcw(1)'], dtype='f8')
+    chi = np.asarray(tcwret['red_chi_2(1)'], dtype='f8')
+    masks = np.empty((len(combos), len(tcwret)), dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fi = np.asarray(tcwret['ti(1)'], dtype='f8') / tcw if 'ti(1)' in tcwret else None
+        rr = np.asarray(tcwret['rliq(um)'], dtype='f8') < np.asarray(tcwret['rice(um)'], dtype='f8') if 'rice(um)' in tcwret else None
+        for ii, combo in enumerate(combos):
+            mask = (chi <= combo['red_chi_2_max']) & (chi >= 0.0) & (tcw <= combo['tau_max']) & (tcw >= 0.0)
+            if combo['rliq_lt_rice']:
+                mask &= rr
+            if combo['fi_min'] is not None:
+                mask &= fi > combo['fi_min']
+            if combo['fi_max'] is not None:
+                mask &= fi < combo['fi_max']
+            masks[ii] = mask
+    return masks
+
+def _statistics(w, x, y):
+    '''
+    Pearson r, p, bias, SD and n of x - y over the weights w along the last axis.
+    Centred sums as in evaluation.bootstrap.statistics, E[x**2] - E[x]**2
+    cancels for values far from 0.
+    '''
+    n = w.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mx = np.where(w, x, 0.0).sum(axis=-1) / n
+        my = np.where(w, y, 0.0).sum(axis=-1) / n
+        dx = np.where(w, x - mx[..., None], 0.0)
+        dy = np.where(w, y - my[..., None], 0.0)
+        r = np.clip((dx*dy).sum(axis=-1) / np.sqrt((dx**2).sum(axis=-1) * (dy**2).sum(axis=-1)), -1.0, 1.0)
+        t = r * np.sqrt((n - 2) / (1 - r**2))
+        p = 2 * scipy.stats.t.sf(np.abs(t), n - 2)
+        bias = mx - my
+        sd = np.sqrt(((dx - dy)**2).sum(axis=-1) / n)
+    return r, p, bias, sd, n
+
+def _evaluate(tcwret, profiles, x, y, delta, invalid, screening, subsets, origin, stop):
+    binner_t = binning.Binner(tcwret, origin, stop)
+    binner_c = binning.Binner(profiles, origin, stop)
+    number_t, select_t = binner_t.bins(delta)
+    number_c, select_c = binner_c.bins(delta)
+    nbins = int(max(number_t.max(initial=-1), number_c.max(initial=-1))) + 1
+
+    count_c = np.bincount(number_c, minlength=nbins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y_bin = np.bincount(number_c, binner_c.values(y)[select_c], minlength=nbins) / count_c
+
+    masks = screening_masks(tcwret, screening)[:, binner_t.order][:, select_t]
+    x_values = binner_t.values(x)[select_t]
+    pwv_values = binner_t.values('pwv(cm)')[select_t]
+    rows = []
+    chunk = max(1, CHUNK_SIZE // max(nbins, number_t.size, 1))
+    for start in range(0, len(screening), chunk):
+        sub = masks[start:start+chunk]
+        m = sub.shape[0]
+        flat = (np.arange(m)[:, None] * nbins + number_t[None, :])[sub]
+        count_t = np.bincount(flat, minlength=m*nbins).reshape(m, nbins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_bin = np.bincount(flat, np.broadcast_to(x_values, sub.shape)[sub], minlength=m*nbins).reshape(m, nbins) / count_t
+            pwv_bin = np.bincount(flat, np.broadcast_to(pwv_values, sub.shape)[sub], minlength=m*nbins).reshape(m, nbins) / count_t
+        matched = (count_t > 0) & (count_c > 0)
+        for subset in subsets:
+            with np.errstate(invalid='ignore'):
+                w = matched & (pwv_bin <= subset['pwv_max']) & (y_bin <= subset['y_max'])
+            r, p, bias, sd, n = _statistics(w, x_bin, y_bin)
+            for ii in range(m):
+                row = dict(screening[start+ii])
+                row.update(subset)
+                row.update({'delta': delta, 'invalid': invalid, 'n': int(n[ii]), 'r': r[ii], 'p': p[ii], 'bias': bias[ii], 'sd': sd[ii]})
+                rows.append(row)
+    return rows
+
+def sweep(tcwret, profiles, x, y, grid, workers=None, origin=binning.ORIGIN, stop=binning.STOP):
+    '''
+    Statistics of the matched bins of x (TCWret) and y (Cloudnet) for every
+    combination of the grid. profiles are the valid Cloudnet profiles, a
+    DataFrame or a dictionary {tuple(invalid): DataFrame} if the grid contains
+    invalid. Returns one row per combination.
+    '''
+    screening = _combinations(grid, SCREENING)
+    subsets = _combinations(grid, SUBSETS)
+    if isinstance(profiles, dict):
+        invalids = [tuple(invalid) for invalid in grid.get('invalid', list(profiles))]
+    else:
+        invalids = [None]
+        profiles = {None: profiles}
+    groups = [(delta, invalid) for delta in grid.get('delta', [GROUPS['delta']]) for invalid in invalids]
+    args = [(tcwret, profiles[invalid], x, y, delta, invalid, screening, subsets, origin, stop) for delta, invalid in groups]
+    if workers == 1 or len(groups) == 1:
+        results = [_evaluate(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_evaluate, *zip(*args)))
+    columns = list(SCREENING) + list(SUBSETS) + list(GROUPS) + ['n', 'r', 'p', 'bias', 'sd']
+    return pd.DataFrame([row for rows in results for row in rows], columns=columns)
@@ -0,0 +1,231 @@
+'''
+Synthetic Cloudnet and TCWret files for tests and benchmarks
+
+Writes files with the names, variables, units and status codes read by
+get_cloudnet/merge_data.py, evaluation.pipeline and evaluation.shapes:
+
+    raw/lwc_MM_DD_YYYY.nc, iwc_..., reff_Frisch_..., reff_ice_...   one set per day
+    TCWret.nc                                                        incl. averaging_kernel_matrix, covariance_matrix
+    habits/<habit>.nc                                                one file per evaluation.shapes.HABITS
+
+Clouds are contiguous layers between a random base and top, a tenth of the
+cloudy profiles carries invalid status codes and a few liquid pixels are
+missing. The values are random and only have plausible magnitudes.
+
+The size is set by scale: profiles and samples are the numbers per day at
+scale 1 and are multiplied by scale, the number of days stays the same (all
+days lie between evaluation.binning.ORIGIN and STOP unless start is moved). At scale 10 the
+Cloudnet profiles have the 30 s resolution of the real products.
+
+    files = generate('/tmp/synthetic', scale=10)
+    python -m evaluation.synthetic /tmp/synthetic --scale 10
+'''
+import argparse
+import datetime as dt
+import os
+import urllib.parse
+import netCDF4 as nc
+import numpy as np
+
+from . import timeaxis
+from .shapes import HABITS
+
+START = dt.date(2017, 5, 25)
+DAYS = 4
+PROFILES = 288
+LEVELS = 60
+SAMPLES = 144
+HEIGHT_STEP = 30.0
+
+## TCWret variable -> (low, high) of the uniform random values
+TCWRET_RANGES = {'latitude': (78.0, 82.0), 'longitude': (0.0, 20.0), 'precipitable_water_vapour': (0.3, 2.0), \
+                 'liquid_water_path': (0.0, 80.0), 'liquid_water_path_error': (1.0, 10.0), \
+                 'ice_water_path': (0.0, 60.0), 'ice_water_path_error': (1.0, 10.0), \
+                 'liquid_water_effective_droplet_radius': (3.0, 15.0), 'liquid_water_effective_droplet_radius_error': (0.5, 3.0), \
+                 'ice_water_effective_droplet_radius': (10.0, 60.0), 'ice_water_effective_droplet_radius_error': (1.0, 10.0), \
+                 'liquid_water_optical_depth': (0.0, 5.0), 'liquid_water_optical_depth_error': (0.0, 0.5), \
+                 'ice_water_optical_depth': (0.0, 3.0), 'ice_water_optical_depth_error': (0.0, 0.5), \
+                 'reduced_chi_2': (0.0, 2.0), 'degrees_of_freedom_of_signal': (1.0, 4.0)}
+## Retrieved state, in the order of the averaging kernel
+STATE_VARIABLES = ['liquid_water_optical_depth', 'ice_water_optical_depth', \
+                   'liquid_water_effective_droplet_radius', 'ice_water_effective_droplet_radius']
+STATE = len(STATE_VARIABLES)
+
+def days(start=START, ndays=DAYS):
+    return [start + dt.timedelta(days=ii) for ii in range(ndays)]
+
+def _layers(rng, ntime, nlevel, fraction):
+    '''
+    Mask (time, level) of one cloud layer in a fraction of the profiles
+    '''
+    base = rng.integers(0, nlevel - 1, ntime)
+    top = np.minimum(base + rng.integers(1, max(nlevel // 4, 2), ntime), nlevel - 1)
+    level = np.arange(nlevel)
+    cloudy = rng.random(ntime) < fraction
+    return cloudy[:, None] & (level[None, :] >= base[:, None]) & (level[None, :] <= top[:, None])
+
+def _status(rng, mask, bad_codes):
+    '''
+    Status 0 outside the cloud, 1 inside, a random code of bad_codes in a tenth of the cloudy profiles
+    '''
+    ntime, nlevel = mask.shape
+    bad = rng.random((ntime, 1)) < 0.1
+    code = np.where(bad, rng.choice(bad_codes, (ntime, nlevel)), 1)
+    return np.where(mask, code, 0).astype('i1')
+
+def _create(fname, date, hours, height):
+    f = nc.Dataset(fname, 'w')
+    f.createDimension('time', hours.size)
+    f.createDimension('height', height.size)
+    var = f.createVariable('time', 'f4', ('time',))
+    var.units = "hours since {:%Y-%m-%d} 00:00:00 +00:00".format(date)
+    var[:] = hours
+    var = f.createVariable('height', 'f4', ('height',))
+    var.units = 'm'
+    var[:] = height
+    return f
+
+def _field(f, name, values, dtype='f4', fill_value=None):
+    f.createVariable(name, dtype, ('time', 'height'), fill_value=fill_value)[:] = values
+
+def write_day(path, date, profiles=PROFILES, levels=LEVELS, rng=None):
+    '''
+    Write the four raw Cloudnet files of one day, returns their names
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    hours = np.sort(rng.uniform(0.0, 24.0, profiles))
+    height = 100.0 + HEIGHT_STEP*np.arange(levels)
+    liquid = _layers(rng, profiles, levels, 0.4)
+    ice = _layers(rng, profiles, levels, 0.3)
+    shape = (profiles, levels)
+    fnames = {prefix: os.path.join(path, "{}_{:%m_%d_%Y}.nc".format(prefix, date)) for prefix in ['lwc', 'iwc', 'reff_Frisch', 'reff_ice']}
+
+    with _create(fnames['lwc'], date, hours, height) as f:
+        for name, value in [('latitude', 80.0), ('longitude', 10.0)]:
+            f.createVariable(name, 'f4', ())[...] = value
+        lwc = np.ma.masked_array(np.where(liquid, rng.uniform(1e-5, 1e-3, shape), 0.0), liquid & (rng.random(shape) < 0.01))
+        _field(f, 'lwc', lwc, fill_value=-999.0)
+        _field(f, 'lwc_error', rng.uniform(0.0, 1.0, shape))
+        _field(f, 'lwc_retrieval_status', _status(rng, liquid, [2, 3, 4, 5, 6]), 'i1')
+        f.createVariable('lwp', 'f4', ('time',))[:] = rng.uniform(0.0, 0.1, profiles)
+        f.createVariable('lwp_error', 'f4', ('time',))[:] = rng.uniform(0.0, 0.02, profiles)
+    with _create(fnames['iwc'], date, hours, height) as f:
+        _field(f, 'iwc', np.where(ice, rng.uniform(1e-6, 1e-4, shape), 0.0))
+        _field(f, 'iwc_error', rng.uniform(1.0, 3.0, shape))
+        f.createVariable('iwc_bias', 'f4', ())[...] = 1.7
+        _field(f, 'iwc_retrieval_status', _status(rng, ice, [2, 3, 4, 5, 6, 7]), 'i1')
+    with _create(fnames['reff_Frisch'], date, hours, height) as f:
+        _field(f, 'r_eff_Frisch', np.where(liquid, rng.uniform(2e-6, 2e-5, shape), 0.0))
+        _field(f, 'r_eff_Frisch_error', rng.uniform(0.0, 2e-6, shape))
+        _field(f, 'retrieval_status', _status(rng, liquid, [2, 3, 4]), 'i1')
+    with _create(fnames['reff_ice'], date, hours, height) as f:
+        _field(f, 'reff_ice', np.where(ice, rng.uniform(10.0, 60.0, shape), 0.0))
+        _field(f, 'reff_ice_error', rng.uniform(0.0, 5.0, shape))
+        _field(f, 'reff_ice_retrieval_status', _status(rng, ice, [2, 3, 4, 5, 6, 7]), 'i1')
+    return sorted(fnames.values())
+
+def sample_times(dates, samples=SAMPLES, rng=None):
+    '''
+    Sorted, distinct measurement times (seconds since 2017-05-01 with a fraction) of samples per day
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    offset = (np.datetime64(dates[0]) - np.datetime64('2017-05-01')).astype('timedelta64[s]').astype('f8')
+    seconds = np.sort(rng.choice(len(dates)*86400, min(samples*len(dates), len(dates)*86400), replace=False))
+    return offset + seconds + rng.uniform(0.0, 1.0, seconds.size)
+
+def tcwret_values(n, rng=None):
+    '''
+    Random values of the TCWret variables of n samples, including averaging_kernel_matrix
+    and covariance_matrix (n, STATE, STATE)
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    values = {name: rng.uniform(low, high, n) for name, (low, high) in TCWRET_RANGES.items()}
+    ## Optimal estimation with a random Jacobian K and unit prior in normalised
+    ## units, A = (K^T K + I)^-1 K^T K. The scaling D to physical units is chosen
+    ## so that the posterior covariance D (I - A) D has the stored errors.
+    jac = rng.normal(0.0, 1.0, (n, 2*STATE, STATE))
+    ktk = np.matmul(np.swapaxes(jac, 1, 2), jac)
+    avk = np.linalg.solve(ktk + np.eye(STATE), ktk)
+    error = np.column_stack([values[name + '_error'] for name in STATE_VARIABLES])
+    scale = error / np.sqrt(1.0 - np.diagonal(avk, axis1=1, axis2=2))
+    values['averaging_kernel_matrix'] = avk * scale[:, :, None] / scale[:, None, :]
+    values['covariance_matrix'] = (np.eye(STATE) - avk) * scale[:, :, None] * scale[:, None, :]
+    return values
+
+def perturb(values, sd=0.1, rng=None):
+    '''
+    Copy of values with radii and optical depths multiplied by random factors around 1 (another habit)
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    out = dict(values)
+    for name in values:
+        if 'radius' in name or 'optical_depth' in name:
+            out[name] = values[name] * rng.normal(1.0, sd, values[name].size).clip(0.0, None)
+    return out
+
+def write_tcwret(fname, seconds, values):
+    '''
+    Write a TCWret result file of the samples at seconds (see tcwret_values)
+    '''
+    with nc.Dataset(fname, 'w') as f:
+        f.createDimension('time', seconds.size)
+        f.createDimension('state_a', STATE)
+        f.createDimension('state_b', STATE)
+        var = f.createVariable('time_of_measurement', 'f8', ('time',))
+        var.units = timeaxis.UNITS_TCWRET
+        var[:] = seconds
+        for name, value in values.items():
+            dims = ('time', 'state_a', 'state_b') if value.ndim == 3 else ('time',)
+            f.createVariable(name, 'f8', dims)[:] = value
+    return fname
+
+def mirror(raw, path, dates):
+    '''
+    Link the raw files of dates into path under the URL paths of
+    get_cloudnet/download_data.py, so that a local HTTP server on path can be
+    used with download_data.py --mirror
+    '''
+    from .pipeline import _script
+    download_data = _script('download_data')
+    for date in dates:
+        jobs = download_data.list_jobs(date, date + dt.timedelta(days=1))
+        for url, fname in jobs:
+            target = os.path.join(path, urllib.parse.urlsplit(url).path.lstrip('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not os.path.exists(target):
+                os.symlink(os.path.abspath(os.path.join(raw, fname)), target)
+    return path
+
+def generate(path, scale=1, ndays=DAYS, profiles=PROFILES, levels=LEVELS, samples=SAMPLES, seed=0, habits=True, start=START):
+    '''
+    Write raw Cloudnet files, TCWret.nc and the habit files into path.
+    Returns a dictionary of the directories and files.
+    '''
+    rng = np.random.default_rng(seed)
+    dates = days(start, ndays)
+    out = {'path': path, 'dates': dates, 'raw': os.path.join(path, 'raw'), 'tcwret': os.path.join(path, 'TCWret.nc'), \
+           'habits': [], 'profiles': int(profiles*scale)*ndays, 'samples': 0}
+    os.makedirs(out['raw'], exist_ok=True)
+    for date in dates:
+        write_day(out['raw'], date, int(profiles*scale), levels, rng)
+    seconds = sample_times(dates, int(samples*scale), rng)
+    out['samples'] = int(seconds.size)
+    values = tcwret_values(seconds.size, rng)
+    write_tcwret(out['tcwret'], seconds, values)
+    if habits:
+        os.makedirs(os.path.join(path, 'habits'), exist_ok=True)
+        for habit in HABITS:
+            out['habits'].append(write_tcwret(os.path.join(path, 'habits', habit + '.nc'), seconds, perturb(values, 0.1, rng)))
+    return out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic Cloudnet and TCWret files")
+    parser.add_argument('path')
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--days', type=int, default=DAYS)
+    parser.add_argument('--levels', type=int, default=LEVELS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-habits', action='store_true')
+    args = parser.parse_args()
+    files = generate(args.path, args.scale, args.days, levels=args.levels, seed=args.seed, habits=not args.no_habits)
+    print("{} days, {} profiles, {} TCWret samples in {}".format(len(files['dates']), files['profiles'], files['samples'], args.path))
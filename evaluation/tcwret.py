@@ -0,0 +1,178 @@
+'''
+Compact binary format for TCWret result tables
+
+TCWret writes its results as CSV (e.g. data_TCWret/results_TCWret_spheroids_log.csv),
+one row per retrieval with the time as string, the scalar results and the
+flattened 4x4 covariance (cov_0 ... cov_15) and averaging kernel matrices
+(avk_0 ... avk_15). convert() stores such a file as a directory of .npy files:
+
+    time.npy            datetime64[s]
+    <column>.npy        float64 (or float32) per scalar column
+    cov.npy, avk.npy    (N, 4, 4)
+    meta.json           column names, source
+
+which are memory-mapped by Results, so only the columns used are read.
+Derived quantities (DOF, marginal errors) are computed vectorized over all
+retrievals.
+
+    python -m evaluation.tcwret convert results_TCWret_spheroids_log.csv
+    res = Results('results_TCWret_spheroids_log.tcwret')
+    dof = res.dof()
+'''
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+SUFFIX = '.tcwret'
+MATRICES = ['cov', 'avk']
+STATE = ['tl', 'ti', 'rl', 'ri']
+CHUNK_SIZE = 100000
+
+def _safe(name):
+    '''
+    Column name -> file name, e.g. rl(um) -> rl(um).npy, slashes are replaced
+    '''
+    return name.replace(os.sep, '_') + '.npy'
+
+def _count_rows(fname):
+    '''
+    Number of data rows: non-empty lines without the header, as parsed by pandas
+    (a missing newline at the end of the file or blank lines do not change it)
+    '''
+    with open(fname, 'rb') as fobj:
+        return max(sum(1 for line in fobj if line.strip()) - 1, 0)
+
+def convert(fname, outdir=None, dtype='f8', chunksize=CHUNK_SIZE):
+    '''
+    Convert a TCWret result CSV to the binary layout, reading it in chunks.
+    Returns the output directory.
+    '''
+    if outdir is None:
+        outdir = os.path.splitext(fname)[0] + SUFFIX
+    os.makedirs(outdir, exist_ok=True)
+    size = _count_rows(fname)
+    header = pd.read_csv(fname, nrows=0).columns
+    size_matrix = {name: len([col for col in header if col.startswith(name + '_')]) for name in MATRICES}
+    scalars = [col for col in header if col != 'time' and not any(col.startswith(name + '_') for name in MATRICES)]
+
+    out = {'time': np.lib.format.open_memmap(os.path.join(outdir, 'time.npy'), 'w+', 'datetime64[s]', (size, ))}
+    for col in scalars:
+        out[col] = np.lib.format.open_memmap(os.path.join(outdir, _safe(col)), 'w+', dtype, (size, ))
+    for name in MATRICES:
+        if size_matrix[name] == 0:
+            continue
+        dim = int(round(np.sqrt(size_matrix[name])))
+        out[name] = np.lib.format.open_memmap(os.path.join(outdir, name + '.npy'), 'w+', dtype, (size, dim, dim))
+
+    start = 0
+    for chunk in pd.read_csv(fname, chunksize=chunksize):
+        stop = start + len(chunk)
+        out['time'][start:stop] = pd.to_datetime(chunk['time']).to_numpy().astype('datetime64[s]')
+        for col in scalars:
+            out[col][start:stop] = chunk[col].to_numpy()
+        for name in MATRICES:
+            if name in out:
+                cols = ['{}_{}'.format(name, ii) for ii in range(size_matrix[name])]
+                out[name][start:stop] = chunk[cols].to_numpy().reshape(len(chunk), *out[name].shape[1:])
+        start = stop
+    for array in out.values():
+        array.flush()
+    if start != size:
+        raise ValueError("{}: read {} rows, counted {}".format(fname, start, size))
+
+    with open(os.path.join(outdir, 'meta.json'), 'w') as fobj:
+        json.dump({'source': os.path.basename(fname), 'size': size, 'columns': scalars, \
+                   'matrices': [name for name in MATRICES if name in out], 'dtype': np.dtype(dtype).str}, fobj, indent=1)
+    return outdir
+
+class Results:
+    '''
+    Memory-mapped access to a converted TCWret result table
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as fobj:
+            self.meta = json.load(fobj)
+        self.columns = self.meta['columns']
+        self._cache = {}
+
+    def __len__(self):
+        return self.meta['size']
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            fname = name + '.npy' if name in ('time', ) + tuple(self.meta['matrices']) else _safe(name)
+            self._cache[name] = np.load(os.path.join(self.path, fname), mmap_mode='r')
+        return self._cache[name]
+
+    @property
+    def time(self):
+        return self['time']
+
+    @property
+    def cov(self):
+        return self['cov']
+
+    @property
+    def avk(self):
+        return self['avk']
+
+    def table(self, columns=None, index=slice(None)):
+        '''
+        DataFrame with time and the requested scalar columns (default: all)
+        '''
+        columns = self.columns if columns is None else columns
+        out = {'time': np.asarray(self.time[index])}
+        for name in columns:
+            out[name] = np.asarray(self[name][index])
+        return pd.DataFrame(out)
+
+    def dof(self):
+        '''
+        Degrees of freedom of signal: trace of the averaging kernel
+        '''
+        return np.trace(self.avk, axis1=1, axis2=2)
+
+    def partial_dof(self):
+        '''
+        Diagonal of the averaging kernel, (N, 4)
+        '''
+        return np.diagonal(self.avk, axis1=1, axis2=2).copy()
+
+    def errors(self):
+        '''
+        Marginal errors, square root of the covariance diagonal, (N, 4) in the
+        units of the state vector (see STATE)
+        '''
+        return np.sqrt(np.diagonal(self.cov, axis1=1, axis2=2))
+
+    def correlation(self):
+        '''
+        Correlation matrices, (N, 4, 4)
+        '''
+        err = self.errors()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.cov / (err[:, :, None] * err[:, None, :])
+
+def load(fname):
+    '''
+    Open a converted table; a CSV is converted first if no up to date conversion exists
+    '''
+    if fname.endswith(SUFFIX):
+        return Results(fname)
+    outdir = os.path.splitext(fname)[0] + SUFFIX
+    meta = os.path.join(outdir, 'meta.json')
+    if not os.path.exists(meta) or os.path.getmtime(meta) < os.path.getmtime(fname):
+        convert(fname, outdir)
+    return Results(outdir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert TCWret result CSV files to the binary layout")
+    parser.add_argument('command', choices=['convert'])
+    parser.add_argument('fnames', nargs='+')
+    parser.add_argument('--float32', action='store_true', help="Store scalars and matrices as float32")
+    args = parser.parse_args()
+    for fname in args.fnames:
+        print("{} -> {}".format(fname, convert(fname, dtype='f4' if args.float32 else 'f8')))
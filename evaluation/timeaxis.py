@@ -0,0 +1,72 @@
+'''
+Decode the time axes of Cloudnet and TCWret files into datetime64[s] arrays
+
+Cloudnet (and the merged cnet_MM_DD.nc) store "hours since <day>", TCWret stores
+"seconds since 2017-05-01". Both are converted in one vectorized call, the epoch
+is taken from the units attribute of the netCDF variable.
+'''
+import re
+import numpy as np
+
+SECONDS = {'second': 1, 'seconds': 1, 'sec': 1, 's': 1, \
+           'minute': 60, 'minutes': 60, 'min': 60, \
+           'hour': 3600, 'hours': 3600, 'h': 3600, \
+           'day': 86400, 'days': 86400, 'd': 86400}
+
+UNITS_TCWRET = "seconds since 2017-05-01"
+
+_units = re.compile(r'^\s*(\w+)\s+since\s+(\d{4}-\d{1,2}-\d{1,2})(?:[ T](\d{1,2}:\d{1,2}(?::\d{1,2}(?:\.\d*)?)?))?')
+
+def parse_units(units):
+    '''
+    Return (seconds per step, epoch as datetime64[s]) of a CF time units string,
+    e.g. "hours since 2017-05-24 00:00:00 +00:00". Time zone offsets are ignored,
+    all files of the campaign are in UTC.
+    '''
+    match = _units.match(units)
+    if match is None or match.group(1).lower() not in SECONDS:
+        raise ValueError("Unknown time units: {}".format(units))
+    step, date, clock = match.groups()
+    year, month, day = [int(ii) for ii in date.split('-')]
+    epoch = np.datetime64("{:04d}-{:02d}-{:02d}".format(year, month, day), 's')
+    if clock is not None:
+        hms = [float(ii) for ii in clock.split(':')]
+        epoch += np.timedelta64(int(round(hms[0]*3600 + hms[1]*60 + (hms[2] if len(hms) > 2 else 0))), 's')
+    return SECONDS[step.lower()], epoch
+
+def decode(values, units, rounding='round'):
+    '''
+    Convert offsets to datetime64[s]. rounding is 'round' (as merge_data.py and the
+    Cloudnet loaders do) or 'trunc' (int(seconds), as for TCWret). Masked or
+    non-finite values become NaT.
+    '''
+    step, epoch = parse_units(units)
+    seconds = np.ma.filled(np.ma.asarray(values, dtype='f8'), np.nan) * step
+    if rounding == 'round':
+        seconds = np.round(seconds)
+    elif rounding == 'trunc':
+        seconds = np.trunc(seconds)
+    else:
+        raise ValueError("rounding must be 'round' or 'trunc'")
+    valid = np.isfinite(seconds)
+    out = np.full(seconds.shape, np.datetime64('NaT'), dtype='datetime64[s]')
+    out[valid] = epoch + seconds[valid].astype('i8').astype('timedelta64[s]')
+    return out
+
+def read_time(variable, default_units=None, rounding='round'):
+    '''
+    Decode a netCDF4 time variable using its units attribute. default_units is
+    used if the variable has no units.
+    '''
+    units = getattr(variable, 'units', default_units)
+    if units is None:
+        raise ValueError("Variable {} has no units".format(variable.name))
+    return decode(variable[:], units, rounding)
+
+def encode(times, units):
+    '''
+    Inverse of decode: datetime64 -> float offsets in the given units, NaT becomes NaN
+    '''
+    step, epoch = parse_units(units)
+    times = np.asarray(times, dtype='datetime64[s]')
+    return np.where(np.isnat(times), np.nan, (times - epoch).astype('i8') / step)[()]
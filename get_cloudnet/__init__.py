@@ -0,0 +1,6 @@
+'''
+Download and merge the Cloudnet data of PS106, run from the top directory as
+
+    python -m get_cloudnet.download_data -o get_cloudnet -j 8
+    python -m get_cloudnet.merge_data -i get_cloudnet -o get_cloudnet -j 4
+'''
@@ -1,60 +1,325 @@
 #!/usr/bin/python3
 '''
-Download Cloudnet data from Pangaea using urllib
+Download Cloudnet data from Pangaea
+
+All files are fetched concurrently by a bounded pool of workers. Each worker
+keeps its own keep-alive connection per host and streams the response to disk
+in chunks. A manifest (manifest.json) records size, checksum and Last-Modified
+of every finished file. Files already downloaded are only requested again with
+If-Modified-Since and skipped if the server answers 304 (not at all with
+--no-revalidate). Interrupted transfers (*.part) are resumed with a Range
+request whose If-Range holds the Last-Modified date the partial file was
+started from (kept in *.part.modified), so a file changed on the server in
+the meantime is fetched anew.
+
+Usage: python -m get_cloudnet.download_data [-o OUTDIR] [-j WORKERS] [--start YYYY-MM-DD] [--stop YYYY-MM-DD] [--mirror URL] [--no-revalidate]
 '''
+import argparse
 import datetime as dt
-import urllib.request
-import urllib.error
+import hashlib
+import http.client
+import json
+import os
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from evaluation import instrument
 
 url_reff_ice    = "https://hs.pangaea.de/model/GriescheH-etal_2020/MIRA_PS106_V2/{:04d}{:02d}{:02d}_polarstern_r-eff-ice.nc"
 url_reff_Frisch = "https://hs.pangaea.de/model/GriescheH-etal_2020/LP_r-eff_PS106_V2/{:04d}{:02d}{:02d}_polarstern_r_eff_Frisch2002.nc"
-url_lwc         = "https://hs.pangaea.de/model/GriescheH-etal_2020/LWC_PS106_V2/{:04d}{:02d}{:02d}_polarstern_lwc-scaled-adiabatic.nc" 
+url_lwc         = "https://hs.pangaea.de/model/GriescheH-etal_2020/LWC_PS106_V2/{:04d}{:02d}{:02d}_polarstern_lwc-scaled-adiabatic.nc"
 url_iwc         = "https://hs.pangaea.de/model/GriescheH-etal_2020/IWC_PS106_V2/{:04d}{:02d}{:02d}_polarstern_iwc-Z-T-method.nc"
 
-date = dt.datetime(2017, 5, 24)
-while date < dt.datetime(2017, 7, 19):
-    
-    ## Download lwc data
-    url = url_lwc.format(date.year, date.month, date.day)
+## Output file name prefix -> URL template
+PRODUCTS = {'lwc': url_lwc, 'iwc': url_iwc, 'reff_Frisch': url_reff_Frisch, 'reff_ice': url_reff_ice}
+
+FNAME = '{}_{:02d}_{:02d}_{:04}.nc'
+MANIFEST = 'manifest.json'
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 60
+
+_local = threading.local()
+_manifest_lock = threading.Lock()
+
+def list_jobs(start=dt.date(2017, 5, 24), stop=dt.date(2017, 7, 19), products=PRODUCTS, mirror=None):
+    '''
+    Return (url, fname) for every product and every day in [start, stop).
+    If mirror is given (e.g. http://localhost:8000), scheme and host of the
+    Pangaea URLs are replaced by it.
+    '''
+    jobs = []
+    date = start
+    while date < stop:
+        for prefix, template in products.items():
+            url = template.format(date.year, date.month, date.day)
+            if mirror is not None:
+                url = mirror.rstrip('/') + urllib.parse.urlsplit(url).path
+            jobs.append((url, FNAME.format(prefix, date.month, date.day, date.year)))
+        date += dt.timedelta(days=1)
+    return jobs
+
+def read_manifest(path):
     try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError:
-        pass
-    else:
-        data = response.read()
-        with open('lwc_{:02d}_{:02d}_{:04}.nc'.format(date.month, date.day, date.year), 'wb') as fobj:
-            fobj.write(data)
-            
-    ## Download iwc data
-    url = url_iwc.format(date.year, date.month, date.day)
+        with open(os.path.join(path, MANIFEST)) as fobj:
+            return json.load(fobj)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(path, manifest):
+    tmp = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp, 'w') as fobj:
+        json.dump(manifest, fobj, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+def sha256(fname):
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as fobj:
+        for block in iter(lambda: fobj.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def is_complete(path, fname, entry):
+    '''
+    A file counts as downloaded if it is listed in the manifest and its size on disk matches.
+    '''
+    if entry is None:
+        return False
     try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError:
-        pass
-    else:
-        data = response.read()
-        with open('iwc_{:02d}_{:02d}_{:04}.nc'.format(date.month, date.day, date.year), 'wb') as fobj:
-            fobj.write(data)
+        return os.path.getsize(os.path.join(path, fname)) == entry['size']
+    except OSError:
+        return False
+
+def _connection(scheme, netloc):
+    '''
+    One persistent connection per worker thread and host
+    '''
+    if not hasattr(_local, 'connections'):
+        _local.connections = {}
+    key = (scheme, netloc)
+    if key not in _local.connections:
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        _local.connections[key] = cls(netloc, timeout=TIMEOUT)
+    return _local.connections[key]
+
+def _drop_connection(scheme, netloc):
+    conn = _local.connections.pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
 
-    ## Download reff Frisch data
-    url = url_reff_Frisch.format(date.year, date.month, date.day)
+def _request(url, headers, retries=2):
+    split = urllib.parse.urlsplit(url)
+    path = split.path + ('?' + split.query if split.query else '')
+    for attempt in range(retries + 1):
+        conn = _connection(split.scheme, split.netloc)
+        try:
+            conn.request('GET', path, headers=headers)
+            return conn.getresponse(), split
+        except (http.client.HTTPException, OSError):
+            ## Server closed the keep-alive connection: reconnect and retry
+            _drop_connection(split.scheme, split.netloc)
+            if attempt == retries:
+                raise
+
+def _total_size(response, url):
+    '''
+    Size and Last-Modified of the file on the server, the size from Content-Range
+    (bytes */size) of a 416 reply, else both from a HEAD request
+    '''
+    content_range = response.getheader('Content-Range', '')
+    if content_range.startswith('bytes */'):
+        return int(content_range[len('bytes */'):]), response.getheader('Last-Modified')
+    split = urllib.parse.urlsplit(url)
+    conn = _connection(split.scheme, split.netloc)
+    conn.request('HEAD', split.path, headers={'Connection': 'keep-alive'})
+    head = conn.getresponse()
+    head.read()
+    length = head.getheader('Content-Length')
+    if head.status != 200 or length is None:
+        return None, None
+    return int(length), head.getheader('Last-Modified')
+
+def _range_start(response):
+    '''
+    First byte of a 206 reply (Content-Range: bytes start-end/size), None if not given
+    '''
+    content_range = response.getheader('Content-Range', '')
     try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError:
-        pass
-    else:
-        data = response.read()
-        with open('reff_Frisch_{:02d}_{:02d}_{:04}.nc'.format(date.month, date.day, date.year), 'wb') as fobj:
-            fobj.write(data)
-            
-    ## Download reff ice data
-    url = url_reff_ice.format(date.year, date.month, date.day)
+        return int(content_range[len('bytes '):].split('-')[0]) if content_range.startswith('bytes ') else None
+    except ValueError:
+        return None
+
+def _read_modified(part):
+    '''
+    Last-Modified date of the file the partial file was started from, None if unknown
+    '''
     try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError:
-        pass
+        with open(part + '.modified') as fobj:
+            return fobj.read().strip() or None
+    except OSError:
+        return None
+
+def _write_modified(part, last_modified):
+    if last_modified is None:
+        _remove(part + '.modified')
     else:
-        data = response.read()
-        with open('reff_ice_{:02d}_{:02d}_{:04}.nc'.format(date.month, date.day, date.year), 'wb') as fobj:
-            fobj.write(data)
-    date += dt.timedelta(days=1)
\ No newline at end of file
+        with open(part + '.modified', 'w') as fobj:
+            fobj.write(last_modified)
+
+def _remove(*fnames):
+    for fname in fnames:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+@instrument.timed('download.fetch')
+def fetch(url, fname, path, entry=None):
+    '''
+    Stream url into path/fname. Continue a previous *.part file if there is one
+    and it was started from the current version of the file on the server.
+    Return the manifest entry or None if the file does not exist on the server.
+    If entry (the manifest entry of a complete file) has a Last-Modified date,
+    the file is only fetched again if it changed since and entry is returned otherwise.
+    '''
+    part = os.path.join(path, fname + '.part')
+    headers = {'Connection': 'keep-alive'}
+    offset = 0
+    if entry is not None:
+        ## Revalidation replaces the whole file, a partial one is not continued
+        headers['If-Modified-Since'] = entry['last_modified']
+    elif os.path.exists(part):
+        modified = _read_modified(part)
+        if modified is None:
+            ## Unknown version, the partial file may belong to an older one
+            _remove(part)
+        else:
+            offset = os.path.getsize(part)
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = modified
+    response, split = _request(url, headers)
+    try:
+        if response.status == 404:
+            response.read()
+            return None
+        if response.status == 304:
+            response.read()
+            return entry
+        if response.status == 206 and _range_start(response) != offset:
+            ## Not the requested range: start over with the whole file
+            _drop_connection(split.scheme, split.netloc)
+            _remove(part, part + '.modified')
+            return fetch(url, fname, path)
+        if response.status == 416:
+            ## Range not satisfiable: the partial file is complete if it has the size of the file on the server
+            response.read()
+            size, last_modified = _total_size(response, url)
+            if size != offset:
+                _remove(part, part + '.modified')
+                return fetch(url, fname, path)
+            ## If-Range matched, so the partial file is of the version it was started from
+            last_modified = last_modified or _read_modified(part)
+        elif response.status in (200, 206):
+            last_modified = response.getheader('Last-Modified')
+            if response.status == 200:
+                _write_modified(part, last_modified)
+            mode = 'ab' if response.status == 206 else 'wb'
+            with open(part, mode) as fobj:
+                while True:
+                    block = response.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    fobj.write(block)
+                    instrument.count('http_bytes', len(block))
+        else:
+            response.read()
+            raise http.client.HTTPException('{}: HTTP {}'.format(url, response.status))
+        if response.getheader('Connection', '').lower() == 'close':
+            _drop_connection(split.scheme, split.netloc)
+    except BaseException:
+        _drop_connection(split.scheme, split.netloc)
+        raise
+    os.replace(part, os.path.join(path, fname))
+    _remove(part + '.modified')
+    return {'url': url, 'size': os.path.getsize(os.path.join(path, fname)), \
+            'sha256': sha256(os.path.join(path, fname)), 'last_modified': last_modified}
+
+@instrument.timed('download')
+def download(jobs, path='.', workers=8, verbose=True, revalidate=True):
+    '''
+    Download all (url, fname) jobs into path using a pool of workers.
+    Complete files are requested with If-Modified-Since if revalidate is set
+    and the manifest has their Last-Modified date, else skipped.
+    Return a dictionary with the lists of downloaded, skipped, missing and failed files.
+    '''
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path)
+    summary = {'downloaded': [], 'skipped': [], 'missing': [], 'failed': []}
+    todo = []
+    for url, fname in jobs:
+        entry = manifest.get(fname)
+        if not is_complete(path, fname, entry):
+            todo.append((url, fname, None))
+        elif revalidate and entry.get('last_modified') is not None:
+            todo.append((url, fname, entry))
+        else:
+            summary['skipped'].append(fname)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch, url, fname, path, entry): (fname, entry) for url, fname, entry in todo}
+        for future in as_completed(futures):
+            fname, old = futures[future]
+            try:
+                entry = future.result()
+            except Exception as err:
+                summary['failed'].append(fname)
+                if verbose:
+                    print("Failed: {} ({})".format(fname, err), file=sys.stderr)
+                continue
+            if entry is None:
+                summary['missing'].append(fname)
+                continue
+            if entry is old:
+                summary['skipped'].append(fname)
+                continue
+            with _manifest_lock:
+                manifest[fname] = entry
+                write_manifest(path, manifest)
+            summary['downloaded'].append(fname)
+            if verbose:
+                print("Downloaded: {} ({} bytes)".format(fname, entry['size']))
+    return summary
+
+def verify(path='.'):
+    '''
+    Return the files whose checksum does not match the manifest
+    '''
+    manifest = read_manifest(path)
+    corrupt = []
+    for fname, entry in manifest.items():
+        fname_ = os.path.join(path, fname)
+        if not os.path.exists(fname_) or sha256(fname_) != entry['sha256']:
+            corrupt.append(fname)
+    return corrupt
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-o', '--outdir', default='.')
+    parser.add_argument('-j', '--workers', type=int, default=8)
+    parser.add_argument('--start', type=dt.date.fromisoformat, default=dt.date(2017, 5, 24))
+    parser.add_argument('--stop', type=dt.date.fromisoformat, default=dt.date(2017, 7, 19))
+    parser.add_argument('--mirror', default=None, help="Replace https://hs.pangaea.de, e.g. by a local test server")
+    parser.add_argument('--verify', action='store_true', help="Check the checksums of all files in the manifest and exit")
+    parser.add_argument('--no-revalidate', dest='revalidate', action='store_false', help="Skip files in the manifest without asking the server whether they changed")
+    parser.add_argument('--profile', default=None, help="Write a timing report (evaluation.instrument) to this file")
+    args = parser.parse_args()
+    instrument.setup(args.profile)
+
+    if args.verify:
+        corrupt = verify(args.outdir)
+        for fname in corrupt:
+            print("Checksum mismatch: {}".format(fname))
+        sys.exit(1 if corrupt else 0)
+
+    summary = download(list_jobs(args.start, args.stop, mirror=args.mirror), args.outdir, args.workers, revalidate=args.revalidate)
+    print("Downloaded {}, skipped {}, missing {}, failed {}".format(*[len(summary[key]) for key in ['downloaded', 'skipped', 'missing', 'failed']]))
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from evaluation import pipeline, synthetic
+
+@pytest.fixture(scope='session')
+def campaign(tmp_path_factory):
+    '''
+    Synthetic raw Cloudnet files, TCWret.nc and the merged days (cnet)
+    '''
+    path = str(tmp_path_factory.mktemp('campaign'))
+    files = synthetic.generate(path, scale=1, ndays=3, levels=30, habits=False)
+    files['cnet'] = os.path.join(path, 'cnet')
+    summary = pipeline._script('merge_data').merge_all(files['raw'], files['cnet'], workers=1, verbose=False)
+    assert not summary['failed']
+    return files
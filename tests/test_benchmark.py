@@ -0,0 +1,30 @@
+'''
+Comparison of benchmark results with a baseline (evaluation.benchmark)
+'''
+import copy
+
+from evaluation import benchmark
+
+def _results(seconds, peak_mb):
+    return {'machine': benchmark.machine(), 'results': {'1': {'merge': {'seconds': seconds, 'peak_mb': peak_mb}}}}
+
+def test_host():
+    current = _results(1.0, 10.0)
+    assert set(benchmark.HOST) <= set(current['machine'])
+    assert benchmark.other_host(current, copy.deepcopy(current)) == []
+    ## Versions are recorded but do not make another host
+    baseline = copy.deepcopy(current)
+    baseline['machine'].update(python='2.7', platform='other')
+    assert benchmark.other_host(current, baseline) == []
+    baseline['machine'].update(cpus=(current['machine']['cpus'] or 1) + 1, cpu='other')
+    assert benchmark.other_host(current, baseline) == ['cpu', 'cpus']
+    ## Baselines written before the host was recorded
+    assert benchmark.other_host(current, {'results': {}}) == [key for key in benchmark.HOST if current['machine'][key] is not None]
+
+def test_compare():
+    baseline = _results(1.0, 10.0)
+    assert benchmark.compare(_results(1.4, 11.0), baseline) == []
+    assert benchmark.compare(_results(1.6, 10.0), baseline) == [('1', 'merge', 'seconds', 1.6, 1.0)]
+    assert benchmark.compare(_results(1.0, 14.0), baseline) == [('1', 'merge', 'peak_mb', 14.0, 10.0)]
+    ## Scales and stages missing in the baseline are not compared
+    assert benchmark.compare(_results(9.0, 99.0), {'results': {'10': {}}}) == []
@@ -0,0 +1,105 @@
+'''
+Single-pass time binning (evaluation.binning) against the delta-minute while-loops of the notebooks
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluation import binning
+
+ORIGIN = np.datetime64('2017-06-01T00:00:00')
+STOP = ORIGIN + np.timedelta64(60, 'm')
+
+def _loop(table, delta, columns, origin=ORIGIN, stop=STOP):
+    '''
+    The while-loop of the notebooks
+    '''
+    time_mean = []
+    means = {column: [] for column in columns}
+    datetime_iter = origin
+    while datetime_iter < stop:
+        idx = np.where((np.array(table['time']) > datetime_iter) & \
+                       (np.array(table['time']) < datetime_iter+np.timedelta64(delta*60, 's')))[0]
+        if idx.size != 0:
+            for column in columns:
+                means[column].append(np.mean(np.array(table[column])[idx]))
+            time_mean.append(datetime_iter)
+        datetime_iter += np.timedelta64(delta*60, 's')
+    out = {'time': np.array(time_mean, dtype='datetime64[s]')}
+    out.update({column: np.array(means[column], dtype='f8') for column in columns})
+    return pd.DataFrame(out)
+
+def _table(rng, minutes):
+    '''
+    Samples at the given minutes after ORIGIN (unsorted), with two random columns
+    '''
+    time = ORIGIN + np.round(np.asarray(minutes)*60).astype('timedelta64[s]')
+    order = rng.permutation(time.size)
+    return pd.DataFrame({'time': time[order], 'x': rng.normal(0.0, 1.0, time.size), 'y': rng.uniform(0.0, 5.0, time.size)})
+
+## Minutes after ORIGIN: before the origin, on the origin and on other bin edges of 7 minutes,
+## nothing in [14, 21), samples in the last partial bin [56, 63) beyond STOP and after it
+EDGES = [-3.0, 0.0, 7.0, 28.0, 56.0, 63.0]
+INSIDE = [0.5, 1.0, 6.5, 7.5, 10.0, 13.9, 21.1, 25.0, 30.0, 30.5, 44.0, 55.9, 56.5, 59.0, 61.0, 62.9, 63.5, 70.0]
+
+@pytest.fixture
+def table():
+    return _table(np.random.default_rng(1), EDGES + INSIDE)
+
+@pytest.mark.parametrize('delta', [7, 2, 5, 60, 61])
+def test_while_loop(table, delta):
+    out = binning.aggregate(table, delta, ['x', 'y'], origin=ORIGIN, stop=STOP)
+    expected = _loop(table, delta, ['x', 'y'])
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(out, expected, check_exact=False, rtol=1e-12)
+
+def test_edges(table):
+    binner = binning.Binner(table, ORIGIN, STOP)
+    number, select = binner.bins(7)
+    minutes = binner.seconds[select] / 60.0
+    ## Samples on edges and outside [ORIGIN, ORIGIN + 9*7 minutes) are dropped
+    assert not np.isin(minutes, EDGES).any()
+    assert minutes.min() > 0.0 and minutes.max() < 63.0
+    assert number.max() == 8 and (number < 9).all()
+    ## No bin for [14, 21), the last partial bin starts at 56 minutes
+    out = binning.aggregate(table, 7, {'n': ('x', 'count')}, origin=ORIGIN, stop=STOP)
+    starts = ((out['time'] - ORIGIN) / pd.Timedelta(minutes=1)).tolist()
+    assert 14.0 not in starts
+    assert starts[-1] == 56.0 and out['n'].iloc[-1] == 4
+
+def test_reducers(table):
+    out = binning.aggregate(table, 7, {'mean': ('x', 'mean'), 'count': ('x', 'count'), 'sum': ('x', 'sum'), \
+                                       'std': ('x', 'std'), 'err_mean': ('y', 'err_mean'), 'min': ('x', 'min'), \
+                                       'max': ('x', 'max')}, origin=ORIGIN, stop=STOP)
+    seconds = ((table['time'] - ORIGIN) / pd.Timedelta(seconds=1)).to_numpy()
+    inside = (seconds > 0) & (seconds % 420 != 0) & (seconds < 9*420)
+    groups = table[inside].assign(bin=seconds[inside] // 420).groupby('bin')
+    np.testing.assert_allclose(out['mean'], groups['x'].mean())
+    np.testing.assert_array_equal(out['count'], groups['x'].count())
+    np.testing.assert_allclose(out['sum'], groups['x'].sum())
+    np.testing.assert_allclose(out['std'], groups['x'].std(ddof=0))
+    np.testing.assert_allclose(out['err_mean'], groups['y'].apply(lambda y: np.sqrt((y**2).sum()) / y.size))
+    np.testing.assert_array_equal(out['min'], groups['x'].min())
+    np.testing.assert_array_equal(out['max'], groups['x'].max())
+    with pytest.raises(ValueError):
+        binning.aggregate(table, 7, {'x': 'median'}, origin=ORIGIN, stop=STOP)
+
+def test_empty(table):
+    out = binning.aggregate(table[table['time'] > STOP + np.timedelta64(1, 'h')], 7, {'x': 'mean', 'n': ('x', 'count')}, \
+                            origin=ORIGIN, stop=STOP)
+    assert len(out) == 0 and list(out.columns) == ['time', 'x', 'n']
+
+def test_sweep(table):
+    out = binning.sweep(table, [2, 7, 10], ['x'], origin=ORIGIN, stop=STOP)
+    assert sorted(out) == [2, 7, 10]
+    for delta, frame in out.items():
+        pd.testing.assert_frame_equal(frame, binning.aggregate(table, delta, ['x'], origin=ORIGIN, stop=STOP))
+
+def test_default_range():
+    '''
+    origin and stop default to the PS106 cruise
+    '''
+    table = pd.DataFrame({'time': np.array([binning.ORIGIN + np.timedelta64(30, 's'), binning.STOP + np.timedelta64(90, 's')]), \
+                          'x': [1.0, 2.0]})
+    out = binning.aggregate(table, 2, ['x'])
+    assert out['time'].tolist() == [pd.Timestamp(binning.ORIGIN)] and out['x'].tolist() == [1.0]
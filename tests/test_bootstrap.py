@@ -0,0 +1,113 @@
+'''
+Bootstrap of the comparison statistics (evaluation.bootstrap)
+'''
+import numpy as np
+import pytest
+import scipy.stats
+
+from evaluation import bootstrap
+
+def _pair(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.gamma(2.0, 10.0, n)
+    return x, x + rng.normal(2.0, 5.0, n)
+
+def test_summary():
+    x, y = _pair()
+    out = bootstrap.summary(x, y)
+    r, p = scipy.stats.pearsonr(x, y)
+    assert out['r'] == pytest.approx(r, rel=1e-12) and out['p'] == pytest.approx(p, rel=1e-9)
+    assert out['bias'] == pytest.approx(np.mean(x - y)) and out['sd'] == pytest.approx(np.std(x - y)) and out['n'] == 200
+    single = bootstrap.summary([1.0], [2.0])
+    assert np.isnan(single['r']) and np.isnan(single['p']) and single['bias'] == -1.0 and single['n'] == 1
+
+def test_statistics():
+    '''
+    Along the last axis, each row as summary
+    '''
+    rng = np.random.default_rng(1)
+    x = rng.normal(0.0, 1.0, (4, 50))
+    y = x + rng.normal(0.0, 0.5, (4, 50))
+    r, bias, sd = bootstrap.statistics(x, y)
+    for ii in range(4):
+        expected = bootstrap.summary(x[ii], y[ii])
+        assert r[ii] == pytest.approx(expected['r'], rel=1e-12)
+        assert bias[ii] == pytest.approx(expected['bias'], rel=1e-12)
+        assert sd[ii] == pytest.approx(expected['sd'], rel=1e-12)
+
+@pytest.mark.parametrize('block', [None, 1])
+def test_indices(block):
+    idx = bootstrap.indices(np.random.default_rng(2), 300, 40, block)
+    assert idx.shape == (300, 40)
+    assert idx.min() == 0 and idx.max() == 39
+    ## Independent draws: repeated samples in most replicates
+    assert np.mean([np.unique(row).size < 40 for row in idx]) > 0.99
+
+@pytest.mark.parametrize('n, block', [(40, 5), (43, 5), (10, 10), (7, 20)])
+def test_block_indices(n, block):
+    '''
+    Moving blocks: runs of consecutive indices starting at n - block or earlier, the last one cut at n
+    '''
+    idx = bootstrap.indices(np.random.default_rng(3), 200, n, block)
+    assert idx.shape == (200, n)
+    block = min(block, n)
+    for row in idx:
+        for start in range(0, n, block):
+            run = row[start:start+block]
+            np.testing.assert_array_equal(run, run[0] + np.arange(run.size))
+            assert 0 <= run[0] <= n - block
+    ## All possible block starts occur
+    assert np.unique(idx[:, ::block]).size == n - block + 1
+
+def test_batches(monkeypatch):
+    '''
+    Batches draw the same replicates as one index matrix
+    '''
+    x, y = _pair(60)
+    one = bootstrap.replicates(x, y, 500, block=4, seed=5, workers=1)
+    idx = bootstrap.indices(np.random.default_rng(5), 500, 60, 4)
+    np.testing.assert_array_equal(one, np.stack(bootstrap.statistics(x[idx], y[idx])))
+    ## 7 replicates per batch, the last batch is smaller
+    monkeypatch.setattr(bootstrap, 'BATCH_SIZE', 7 * 60)
+    np.testing.assert_array_equal(bootstrap.replicates(x, y, 500, block=4, seed=5, workers=1), one)
+
+def test_parallel(monkeypatch):
+    x, y = _pair(50)
+    monkeypatch.setattr(bootstrap, 'PARALLEL_SIZE', 1)
+    out = bootstrap.replicates(x, y, 301, seed=6, workers=2)
+    assert out.shape == (3, 301)
+    ## Each worker draws from its own child seed
+    seeds = np.random.SeedSequence(6).spawn(2)
+    expected = np.concatenate([bootstrap._replicates(x, y, 151, None, seeds[0]), bootstrap._replicates(x, y, 150, None, seeds[1])], axis=1)
+    np.testing.assert_array_equal(out, expected)
+    np.testing.assert_array_equal(bootstrap.replicates(x, y, 301, seed=6, workers=2), out)
+
+def test_split():
+    x, y = np.arange(5.0), np.arange(5.0) * 2
+    pairs = bootstrap.split(x, y, {'All': None, 'x < 2': x < 2})
+    assert list(pairs) == ['All', 'x < 2']
+    np.testing.assert_array_equal(pairs['All'][1], y)
+    np.testing.assert_array_equal(pairs['x < 2'][0], [0.0, 1.0])
+    np.testing.assert_array_equal(pairs['x < 2'][1], [0.0, 2.0])
+
+def test_table():
+    x, y = _pair(300)
+    pairs = bootstrap.split(x, y, {'All': None, 'x < 20': x < 20, 'one': np.arange(300) == 0})
+    out = bootstrap.table(pairs, 2000, block=3, seed=7, workers=1)
+    assert list(out['data']) == ['All', 'x < 20', 'one']
+    assert list(out.columns) == ['data', 'n', 'r', 'r_lo', 'r_hi', 'p', 'bias', 'bias_lo', 'bias_hi', 'sd', 'sd_lo', 'sd_hi']
+    for row, (label, pair) in zip(out.to_dict('records')[:2], pairs.items()):
+        expected = bootstrap.summary(*pair)
+        assert row['n'] == expected['n'] and row['r'] == expected['r'] and row['bias'] == expected['bias']
+        for key in ['r', 'bias', 'sd']:
+            assert row[key + '_lo'] < row[key] < row[key + '_hi']
+    ## A single sample has no interval
+    assert out['n'].iloc[2] == 1 and out.iloc[2][['r_lo', 'r_hi', 'bias_lo', 'sd_hi']].isna().all()
+    ## Reproducible with the seed, wider with a higher confidence
+    again = bootstrap.table(pairs, 2000, block=3, seed=7, workers=1)
+    assert again.equals(out)
+    wide = bootstrap.table(pairs, 2000, block=3, confidence=0.99, seed=7, workers=1)
+    assert (wide['bias_hi'] - wide['bias_lo'] > out['bias_hi'] - out['bias_lo'])[:2].all()
+    ## The interval of the bias covers the standard error of the mean
+    se = np.std(x - y) / np.sqrt(x.size)
+    assert out['bias_hi'].iloc[0] - out['bias_lo'].iloc[0] == pytest.approx(2 * 1.96 * se, rel=0.3)
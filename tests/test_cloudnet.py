@@ -0,0 +1,137 @@
+'''
+Vectorized Cloudnet column integrals (evaluation.cloudnet) against the per-profile loops of the notebooks
+'''
+import os
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from evaluation import cloudnet, sparse
+
+LIQUID = ['lwp(gm-2)', 'lwp_mwr(gm-2)', 'lwp_err_mwr(gm-2)']
+ICE = ['iwp(gm-2)', 'diwp(gm-2)', 'rice(um)', 'drice(um)']
+RLIQ = ['rliq(um)', 'drliq(um)', 'rliq_max(um)', 'drliq_max(um)', 'rliq_bottom(um)', 'drliq_bottom(um)']
+
+def _value(value):
+    return np.nan if np.ma.is_masked(value) else float(value)
+
+def _loop(fname):
+    '''
+    The loops of the notebooks on the masked arrays of one merged file, for
+    every profile, with NaN for masked or not computed values and a validity flag
+    '''
+    with nc.Dataset(fname) as f:
+        var = {name: f.variables[name][:] for name in cloudnet.variables()}
+    dz = np.concatenate((np.diff(var['height']), [0]))
+    out = {key: [] for key in LIQUID + ICE + RLIQ + ['valid_liquid', 'valid_ice', 'valid_rliq']}
+    for time_idx in range(len(var['liquid_water_path_MWR'])):
+        ## liquid_water_path.ipynb
+        lwc_invalid = np.intersect1d(var['liquid_water_content_status'][time_idx], np.array(cloudnet.LWC_INVALID))
+        lwp = np.sum(var['liquid_water_path_per_layer'][time_idx])
+        lwp_mwr = var['liquid_water_path_MWR'][time_idx]
+        out['lwp(gm-2)'].append(_value(lwp))
+        out['lwp_mwr(gm-2)'].append(_value(lwp_mwr))
+        out['lwp_err_mwr(gm-2)'].append(_value(var['liquid_water_path_error_MWR'][time_idx]))
+        out['valid_liquid'].append(lwc_invalid.size == 0 and not np.ma.is_masked(lwp) and not np.ma.is_masked(lwp_mwr))
+
+        ## ice_water_path_and_reff_ice.ipynb
+        iwc_invalid = np.intersect1d(var['ice_water_content_status'][time_idx], np.array(cloudnet.IWC_INVALID))
+        idx_ice = np.where(var['ice_water_path_per_layer'][time_idx] > 0.0)[0]
+        values = [np.sum(var['ice_water_path_per_layer'][time_idx])]
+        if idx_ice.size == 0:
+            values += [np.ma.masked]*3
+        else:
+            iwc_err_abs = var['ice_water_content'][time_idx, idx_ice]*10**var['ice_water_content_error'][time_idx, idx_ice]*1e-2
+            values += [np.sum(iwc_err_abs * dz[idx_ice]), np.mean(var['reff_ice'][time_idx, idx_ice]), \
+                       np.mean(var['reff_ice_error'][time_idx, idx_ice])]
+        for key, value in zip(ICE, values):
+            out[key].append(_value(value))
+        out['valid_ice'].append(iwc_invalid.size == 0 and idx_ice.size > 0 and not any(np.ma.is_masked(value) for value in values))
+
+        ## liquid_water_droplet_effective_radius.ipynb, IndexError for less than three cloudy levels
+        reff_invalid = np.intersect1d(var['reff_Frisch_status'][time_idx], np.array(cloudnet.REFF_INVALID))
+        idx_liq = np.where(var['liquid_water_path_per_layer'][time_idx] > 0.0)[0]
+        rliq, rliq_err = var['reff_Frisch'][time_idx], var['reff_Frisch_error'][time_idx]
+        values = [np.ma.masked]*6
+        if idx_liq.size > 0:
+            values[:4] = [np.mean(rliq[idx_liq]), np.mean(rliq_err[idx_liq]), np.max(rliq[idx_liq]), np.max(rliq_err[idx_liq])]
+        if idx_liq.size >= 3:
+            values[4:] = [np.mean(rliq[idx_liq[np.array([1, 2])]]), np.mean(rliq_err[idx_liq[np.array([1, 2])]])]
+        for key, value in zip(RLIQ, values):
+            out[key].append(_value(value))
+        out['valid_rliq'].append(reff_invalid.size == 0 and idx_liq.size >= 3 and not any(np.ma.is_masked(value) for value in values))
+    return {key: np.array(value) for key, value in out.items()}
+
+def _assert_profiles(out, expected):
+    for key in LIQUID + ICE + RLIQ:
+        computed = ~np.isnan(expected[key])
+        np.testing.assert_allclose(out[key][computed], expected[key][computed], rtol=1e-10, err_msg=key)
+    for key in ['valid_liquid', 'valid_ice', 'valid_rliq']:
+        np.testing.assert_array_equal(out[key], expected[key], err_msg=key)
+
+@pytest.fixture(scope='module')
+def fnames(campaign):
+    return [os.path.join(campaign['cnet'], fname) for fname in cloudnet.list_files(campaign['cnet'])]
+
+def test_integrate_day(fnames):
+    for fname in fnames:
+        expected = _loop(fname)
+        ## Every rejection reason occurs in the synthetic data
+        assert expected['valid_liquid'].any() and not expected['valid_liquid'].all()
+        assert expected['valid_ice'].any() and expected['valid_rliq'].any()
+        _assert_profiles(cloudnet.integrate_day(fname), expected)
+
+def test_without_index(fnames):
+    '''
+    Files without the sparse index give the same result
+    '''
+    with nc.Dataset(fnames[0]) as f:
+        assert cloudnet.is_indexed(f)
+        var = cloudnet.read(f, cloudnet.variables(indexed=False))
+    _assert_profiles(cloudnet.compute(var), _loop(fnames[0]))
+
+def test_few_cloudy_levels(fnames):
+    '''
+    rliq_bottom needs three cloudy levels, profiles with one or two are invalid
+    '''
+    with nc.Dataset(fnames[0]) as f:
+        count = np.diff(f.variables['liquid_offset'][:])
+    out = cloudnet.integrate_day(fnames[0])
+    few = (count > 0) & (count < 3)
+    assert few.any()
+    assert not out['valid_rliq'][few].any()
+    ## The averages themselves are computed
+    assert np.isfinite(out['rliq(um)'][few]).any()
+
+def test_integrate(campaign, fnames):
+    table = cloudnet.integrate(campaign['cnet'])
+    assert len(table) == campaign['profiles']
+    assert table['time'].is_monotonic_increasing
+    np.testing.assert_array_equal(table['valid_rliq'].to_numpy(), np.concatenate([_loop(fname)['valid_rliq'] for fname in fnames]))
+
+def _profiles():
+    '''
+    Four profiles of four levels: all levels missing, clear sky, two and three cloudy levels
+    '''
+    mask = np.zeros((4, 4), dtype=bool)
+    mask[0] = True
+    path = np.ma.masked_array([[1.0, 2.0, 3.0, 4.0], [0.0, 0.0, 0.0, 0.0], [0.0, 5.0, 6.0, 0.0], [7.0, 8.0, 9.0, 0.0]], mask)
+    reff = np.ma.masked_array(np.where(path.data > 0.0, 10.0, 0.0), mask)
+    status = np.zeros((4, 4), dtype='i4')
+    return {'liquid_water_path_per_layer': path, 'liquid_water_content_status': status, \
+            'liquid_water_path_MWR': np.ma.masked_array([10.0, 0.0, 11.0, 24.0]), \
+            'liquid_water_path_error_MWR': np.ma.masked_array([1.0, 1.0, 1.0, 1.0]), \
+            'reff_Frisch': reff, 'reff_Frisch_error': reff * 0.1, 'reff_Frisch_status': status}
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_missing_levels(indexed):
+    var = _profiles()
+    if indexed:
+        var['liquid_offset'], var['liquid_level'] = sparse.index(np.ma.getmaskarray(var['liquid_water_path_per_layer']) | \
+                                                                  (var['liquid_water_path_per_layer'].data > 0.0))
+    out = cloudnet.compute(var, quantities=('liquid', 'rliq'))
+    np.testing.assert_array_equal(out['lwp(gm-2)'], [np.nan, 0.0, 11.0, 24.0])
+    np.testing.assert_array_equal(out['valid_liquid'], [False, True, True, True])
+    np.testing.assert_array_equal(out['rliq(um)'], [np.nan, np.nan, 10.0, 10.0])
+    np.testing.assert_array_equal(out['valid_rliq'], [False, False, False, True])
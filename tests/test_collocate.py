@@ -0,0 +1,92 @@
+'''
+Collocation within a time window (evaluation.collocate) against a brute force search
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluation import collocate
+
+ORIGIN = np.datetime64('2017-06-01T00:00:00')
+
+def _times(seconds):
+    '''
+    ORIGIN + seconds, NaN becomes NaT
+    '''
+    seconds = np.asarray(seconds, dtype='f8')
+    out = ORIGIN + np.where(np.isnan(seconds), 0, seconds).astype('timedelta64[s]')
+    out[np.isnan(seconds)] = np.datetime64('NaT')
+    return out
+
+def _brute_force(time_a, time_b, window):
+    '''
+    All pairs with |dt| <= window, sorted by idx_a, |dt| and time_b
+    '''
+    rows = []
+    for idx_a, time in enumerate(time_a):
+        for idx_b, other in enumerate(time_b):
+            if np.isnat(time) or np.isnat(other):
+                continue
+            delta = int((other - time) / np.timedelta64(1, 's'))
+            if abs(delta) <= window:
+                rows.append((idx_a, abs(delta), delta, idx_b))
+    rows.sort()
+    return pd.DataFrame({'idx_a': [row[0] for row in rows], 'idx_b': [row[3] for row in rows], \
+                         'dt(s)': [row[2] for row in rows]}, dtype='i8')
+
+@pytest.mark.parametrize('window', [0, 30, 59.5, 600])
+def test_brute_force(window):
+    rng = np.random.default_rng(2)
+    time_a = _times(np.concatenate((rng.integers(0, 3600, 40), [120, 180])))
+    ## Unsorted profiles with duplicate times
+    time_b = _times(np.concatenate((rng.integers(-300, 3900, 60), [120, 120, 180])))
+    pairs = collocate.collocate(time_a, time_b, window)
+    expected = _brute_force(time_a, time_b, int(np.ceil(window)))
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(pairs.astype('i8'), expected)
+
+def test_order():
+    '''
+    Sorted by |dt|, the earlier profile first for equal |dt|
+    '''
+    pairs = collocate.collocate(_times([100, 0]), _times([160, 40, 110, 90, 100]), 60)
+    assert pairs['idx_a'].tolist() == [0, 0, 0, 0, 0, 1]
+    assert pairs['dt(s)'].tolist() == [0, -10, 10, -60, 60, 40]
+    assert pairs['idx_b'].tolist() == [4, 3, 2, 1, 0, 1]
+    nearest = collocate.collocate(_times([100, 0]), _times([160, 40, 110, 90, 100]), 60, nearest=True)
+    assert nearest['idx_b'].tolist() == [4, 1]
+
+def test_missing_times():
+    '''
+    Samples and profiles without a time have no partner, the others are unaffected
+    '''
+    time_a = _times([np.nan, 60, np.nan, 3000])
+    time_b = _times([50, np.nan, 70, 2990, np.nan])
+    pairs = collocate.collocate(time_a, time_b, 30)
+    pd.testing.assert_frame_equal(pairs.astype('i8'), _brute_force(time_a, time_b, 30))
+    assert pairs['idx_a'].tolist() == [1, 1, 3] and pairs['idx_b'].tolist() == [0, 2, 3]
+    ## Nothing but NaT
+    assert len(collocate.collocate(_times([np.nan]), time_b, 30)) == 0
+    assert len(collocate.collocate(time_a, _times([np.nan, np.nan]), 30)) == 0
+
+def test_distance():
+    assert collocate.distance(0.0, 0.0, 0.0, 0.0) == 0.0
+    assert collocate.distance(0.0, 0.0, 0.0, 1.0) == pytest.approx(2*np.pi*collocate.EARTH_RADIUS/360.0)
+    ## Ship track against a station: only the samples within 100 km are paired
+    time_a = _times([0, 60, 120])
+    pairs = collocate.collocate(time_a, _times([0, 60, 120]), 10, lat_a=[79.0, 80.0, 81.0], lon_a=[10.0, 10.0, 10.0], \
+                                lat_b=79.0, lon_b=10.0, max_distance=100.0)
+    assert pairs['idx_a'].tolist() == [0] and pairs['distance(km)'].tolist() == [0.0]
+    with pytest.raises(ValueError):
+        collocate.collocate(time_a, time_a, 10, max_distance=100.0)
+
+def test_match():
+    table_a = pd.DataFrame({'time': _times([0, 100, 1000, np.nan]), 'x': [1.0, 2.0, 3.0, 4.0]})
+    table_b = pd.DataFrame({'time': _times([-20, 10, 110, 130, 5000]), 'x': [1.0, 3.0, 5.0, 6.0, 7.0]})
+    matched = collocate.match(table_a, table_b, 30, ['x'], ['x'])
+    assert list(matched.columns) == ['time', 'x', 'x_cnet', 'dp']
+    assert matched['x'].tolist() == [1.0, 2.0]
+    assert matched['x_cnet'].tolist() == [2.0, 5.5]
+    assert matched['dp'].tolist() == [2, 2]
+    averaged = collocate.average(collocate.collocate(table_a['time'], table_b['time'], 30), table_b, ['x'], len(table_a))
+    assert np.isnan(averaged['x'][2]) and averaged['dp'].tolist() == [2, 2, 0, 0]
@@ -0,0 +1,173 @@
+'''
+download_data.py against a local HTTP mirror (evaluation.benchmark.Mirror)
+'''
+import datetime as dt
+import http.client
+import email.utils
+import json
+import os
+import time as timer
+import urllib.parse
+
+import pytest
+
+from evaluation import benchmark, pipeline
+
+download_data = pipeline._script('download_data')
+
+DATE = dt.date(2017, 6, 1)
+
+def _content(prefix):
+    return (prefix * 5000).encode()
+
+@pytest.fixture
+def mirror(tmp_path):
+    '''
+    Mirror serving one day of every product, and its jobs
+    '''
+    root = tmp_path / 'mirror'
+    jobs = download_data.list_jobs(DATE, DATE + dt.timedelta(days=1))
+    for url, fname in jobs:
+        source = root / urllib.parse.urlsplit(url).path.lstrip('/')
+        source.parent.mkdir(parents=True, exist_ok=True)
+        source.write_bytes(_content(fname.split('_')[0]))
+        ## Last-Modified in the past, so that a later change is seen by If-Modified-Since
+        os.utime(source, (timer.time() - 100, timer.time() - 100))
+    with benchmark.Mirror(str(root)) as server:
+        server.jobs = download_data.list_jobs(DATE, DATE + dt.timedelta(days=1), mirror=server.url)
+        server.root = root
+        yield server
+
+def _source(server, url):
+    return server.root / urllib.parse.urlsplit(url).path.lstrip('/')
+
+def _last_modified(server, url):
+    return email.utils.formatdate(os.path.getmtime(_source(server, url)), usegmt=True)
+
+def _part(out, fname, data, modified):
+    '''
+    Partial file as left by an interrupted download of the version modified
+    '''
+    out.mkdir(exist_ok=True)
+    (out / (fname + '.part')).write_bytes(data)
+    if modified is not None:
+        (out / (fname + '.part.modified')).write_text(modified)
+
+def _manifest(out):
+    return json.loads((out / download_data.MANIFEST).read_text())
+
+def test_download_and_skip(mirror, tmp_path):
+    out = tmp_path / 'out'
+    summary = download_data.download(mirror.jobs, str(out), 2, verbose=False)
+    assert len(summary['downloaded']) == len(mirror.jobs)
+    for url, fname in mirror.jobs:
+        assert (out / fname).read_bytes() == _source(mirror, url).read_bytes()
+    assert download_data.verify(str(out)) == []
+    ## Second run: the server answers 304 for every file
+    summary = download_data.download(mirror.jobs, str(out), 2, verbose=False)
+    assert summary['downloaded'] == [] and len(summary['skipped']) == len(mirror.jobs)
+
+def test_changed_file_is_fetched_again(mirror, tmp_path):
+    out = tmp_path / 'out'
+    download_data.download(mirror.jobs, str(out), 2, verbose=False)
+    url, fname = mirror.jobs[0]
+    _source(mirror, url).write_bytes(b'new version')
+    summary = download_data.download(mirror.jobs, str(out), 2, verbose=False)
+    assert summary['downloaded'] == [fname]
+    assert (out / fname).read_bytes() == b'new version'
+    assert download_data.verify(str(out)) == []
+
+def test_no_revalidate_skips_without_server(mirror, tmp_path):
+    out = tmp_path / 'out'
+    download_data.download(mirror.jobs, str(out), 2, verbose=False)
+    jobs = download_data.list_jobs(DATE, DATE + dt.timedelta(days=1), mirror='http://127.0.0.1:9')
+    summary = download_data.download(jobs, str(out), 2, verbose=False, revalidate=False)
+    assert len(summary['skipped']) == len(jobs)
+
+def test_resume(mirror, tmp_path):
+    out = tmp_path / 'out'
+    url, fname = mirror.jobs[0]
+    content = _source(mirror, url).read_bytes()
+    ## Marked prefix: only the rest of the file may be requested
+    _part(out, fname, b'x' * 1000, _last_modified(mirror, url))
+    summary = download_data.download([(url, fname)], str(out), 1, verbose=False)
+    assert summary['downloaded'] == [fname]
+    assert (out / fname).read_bytes() == b'x' * 1000 + content[1000:]
+    assert not (out / (fname + '.part')).exists() and not (out / (fname + '.part.modified')).exists()
+    assert _manifest(out)[fname]['last_modified'] == _last_modified(mirror, url)
+
+def test_interrupted_download_keeps_version(mirror, tmp_path, monkeypatch):
+    '''
+    The Last-Modified date of a download is stored next to the partial file
+    '''
+    out = tmp_path / 'out'
+    url, fname = mirror.jobs[0]
+    def read(self, size=None):
+        raise OSError("connection lost")
+    monkeypatch.setattr(http.client.HTTPResponse, 'read', read)
+    summary = download_data.download([(url, fname)], str(out), 1, verbose=False)
+    assert summary['failed'] == [fname]
+    assert (out / (fname + '.part.modified')).read_text() == _last_modified(mirror, url)
+
+@pytest.mark.parametrize('modified', ['Mon, 01 May 2017 00:00:00 GMT', None])
+def test_changed_part_file_is_replaced(mirror, tmp_path, modified):
+    '''
+    A partial file of another (or an unknown) version is not continued
+    '''
+    out = tmp_path / 'out'
+    url, fname = mirror.jobs[0]
+    content = _source(mirror, url).read_bytes()
+    _part(out, fname, b'x' * 1000, modified)
+    summary = download_data.download([(url, fname)], str(out), 1, verbose=False)
+    assert summary['downloaded'] == [fname]
+    assert (out / fname).read_bytes() == content
+    assert _manifest(out)[fname]['last_modified'] == _last_modified(mirror, url)
+
+def test_complete_part_file(mirror, tmp_path):
+    out = tmp_path / 'out'
+    url, fname = mirror.jobs[0]
+    content = _source(mirror, url).read_bytes()
+    _part(out, fname, content, _last_modified(mirror, url))
+    summary = download_data.download([(url, fname)], str(out), 1, verbose=False)
+    assert summary['downloaded'] == [fname]
+    assert (out / fname).read_bytes() == content
+    ## Completed by the 416 reply, revalidated like any other file afterwards
+    assert _manifest(out)[fname]['last_modified'] == _last_modified(mirror, url)
+    summary = download_data.download([(url, fname)], str(out), 1, verbose=False)
+    assert summary['skipped'] == [fname]
+
+def test_oversized_part_file_is_replaced(mirror, tmp_path):
+    out = tmp_path / 'out'
+    url, fname = mirror.jobs[0]
+    content = _source(mirror, url).read_bytes()
+    _part(out, fname, content + b'garbage', _last_modified(mirror, url))
+    summary = download_data.download([(url, fname)], str(out), 1, verbose=False)
+    assert summary['downloaded'] == [fname]
+    assert (out / fname).read_bytes() == content
+
+class _WrongRange(benchmark._Handler):
+    '''
+    Answers every range request from the start of the file
+    '''
+    def send_head(self):
+        if 'Range' in self.headers:
+            del self.headers['Range']
+            self.headers['Range'] = 'bytes=0-'
+        return super().send_head()
+
+def test_wrong_range(mirror, tmp_path, monkeypatch):
+    out = tmp_path / 'out'
+    url, fname = mirror.jobs[0]
+    content = _source(mirror, url).read_bytes()
+    _part(out, fname, b'x' * 1000, _last_modified(mirror, url))
+    monkeypatch.setattr(benchmark, '_Handler', _WrongRange)
+    with benchmark.Mirror(str(mirror.root)) as server:
+        url = server.url + urllib.parse.urlsplit(url).path
+        summary = download_data.download([(url, fname)], str(out), 1, verbose=False)
+    assert summary['downloaded'] == [fname]
+    assert (out / fname).read_bytes() == content
+
+def test_missing_file(mirror, tmp_path):
+    jobs = download_data.list_jobs(DATE + dt.timedelta(days=1), DATE + dt.timedelta(days=2), mirror=mirror.url)
+    summary = download_data.download(jobs, str(tmp_path / 'out'), 2, verbose=False)
+    assert len(summary['missing']) == len(jobs)
@@ -0,0 +1,139 @@
+'''
+Error propagation (evaluation.errors)
+'''
+import netCDF4
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluation import errors, shapes, sparse
+
+def _fi_error(x, cov):
+    '''
+    Analytic linear error of fi = ti / (tl + ti)
+    '''
+    tcw = x[:, errors.TL] + x[:, errors.TI]
+    jac = np.zeros_like(x)
+    jac[:, errors.TL] = -x[:, errors.TI] / tcw**2
+    jac[:, errors.TI] = x[:, errors.TL] / tcw**2
+    return np.sqrt(np.einsum('nk,nkl,nl->n', jac, cov, jac))
+
+def test_stored_covariance(campaign):
+    state = errors.read(campaign['tcwret'])
+    assert state['cov'] is not None and state['avk'] is not None
+    assert errors.state_covariance(state) is state['cov']
+    np.testing.assert_allclose(np.sqrt(np.diagonal(state['cov'], axis1=1, axis2=2)), state['error'], rtol=1e-6)
+    ## The synthetic kernels are consistent with the stored covariance, so the fallback reconstructs it
+    np.testing.assert_allclose(errors.covariance(state['error'], state['avk']), state['cov'], rtol=1e-6, atol=1e-9)
+    fi, dfi = errors.linear(errors.ice_fraction, state['x'], state['cov'])
+    valid = np.isfinite(fi)
+    np.testing.assert_allclose(dfi[valid], _fi_error(state['x'], state['cov'])[valid], rtol=1e-4)
+
+def test_fallbacks():
+    error = np.array([[1.0, 2.0, 0.5, 3.0]])
+    np.testing.assert_array_equal(errors.covariance(error), np.diag(error[0]**2)[None])
+    ## An inconsistent kernel still gives a positive semi-definite covariance with the stored variances
+    avk = np.full((1, 4, 4), 0.4) + 0.5*np.eye(4)
+    cov = errors.covariance(error, avk)
+    np.testing.assert_allclose(np.diagonal(cov, axis1=1, axis2=2), error**2)
+    assert np.linalg.eigvalsh(cov).min() > -1e-9
+
+def test_result_table(tmp_path):
+    rng = np.random.default_rng(2)
+    n = 50
+    x = np.column_stack([rng.uniform(0.5, 3, n), rng.uniform(0.5, 3, n), rng.uniform(5, 10, n), rng.uniform(20, 40, n)])
+    root = rng.normal(0.0, 0.1, (n, 4, 4))
+    cov = np.matmul(root, np.swapaxes(root, 1, 2)) + 0.01*np.eye(4)
+    table = {'time': pd.date_range('2017-06-01', periods=n, freq='10min').strftime('%Y-%m-%d %H:%M:%S')}
+    table.update({name: x[:, ii] for ii, name in enumerate(errors.RESULT_COLUMNS)})
+    table['lwp(gm-2)'] = 0.6 * x[:, errors.TL] * x[:, errors.RL]
+    table.update({'cov_{}'.format(ii): cov.reshape(n, 16)[:, ii] for ii in range(16)})
+    fname = tmp_path / 'results.csv'
+    pd.DataFrame(table).to_csv(str(fname), index=False)
+    state = errors.read(str(fname))
+    np.testing.assert_allclose(state['cov'], cov)
+    np.testing.assert_allclose(state['factors']['lwp(gm-2)'], 0.6)
+    out = errors.propagate(state, ['fi(1)', 'lwp(gm-2)'])
+    np.testing.assert_allclose(out['dfi(1)'], _fi_error(x, cov), rtol=1e-4)
+    jac = np.column_stack([0.6*x[:, errors.RL], np.zeros(n), 0.6*x[:, errors.TL], np.zeros(n)])
+    np.testing.assert_allclose(out['dlwp(gm-2)'], np.sqrt(np.einsum('nk,nkl,nl->n', jac, cov, jac)), rtol=1e-4)
+
+def test_monte_carlo(campaign):
+    state = errors.read(campaign['tcwret'], 0, 60)
+    cov = state['cov'] * 1e-4
+    _, linear = errors.linear(errors.ice_water_path, state['x'], cov, state['factors']['iwp(gm-2)'])
+    _, sd = errors.monte_carlo(errors.ice_water_path, state['x'], cov, state['factors']['iwp(gm-2)'], draws=4000, chunk_size=16)
+    np.testing.assert_allclose(sd, linear, rtol=0.1)
+    ## The draws do not depend on the number of workers
+    _, parallel = errors.monte_carlo(errors.ice_water_path, state['x'], cov, state['factors']['iwp(gm-2)'], draws=4000, \
+                                     chunk_size=16, workers=2)
+    np.testing.assert_array_equal(parallel, sd)
+
+def test_cloudnet_errors():
+    offset = np.array([0, 2, 2, 5])
+    content = np.array([1e-5, 2e-5, 3e-5, 1e-5, 4e-5])
+    error = np.array([0.5, 1.0, 0.2, 0.1, 0.3])
+    mask = np.array([False, False, False, True, False])
+    dz = 30.0
+    pixel = content * 10**error * 1e-2 * dz
+    path = errors.path_error(content, error, dz, offset, mask)
+    np.testing.assert_allclose(path, [pixel[0] + pixel[1], np.nan, pixel[2] + pixel[4]])
+    path = errors.path_error(content, error, dz, offset, mask, correlated=False)
+    np.testing.assert_allclose(path, [np.hypot(pixel[0], pixel[1]), np.nan, np.hypot(pixel[2], pixel[4])])
+    np.testing.assert_allclose(errors.mean_error(error, offset, mask), sparse.segment_mean(error, offset, mask))
+    np.testing.assert_allclose(errors.mean_error(error, offset, mask, correlated=False), \
+                               [np.hypot(0.5, 1.0)/2, np.nan, np.hypot(0.2, 0.3)/2])
+
+def test_shapes_use_errors(campaign, tmp_path):
+    table = shapes.read_tcwret(campaign['tcwret'])
+    state = errors.read(campaign['tcwret'])
+    fi, dfi = errors.linear(errors.ice_fraction, state['x'], state['cov'])
+    with netCDF4.Dataset(campaign['tcwret']) as f:
+        seconds = f.variables['time_of_measurement'][:]
+    rows = np.searchsorted(seconds, table['time'])
+    np.testing.assert_allclose(table['fi(1)'], fi[rows])
+    np.testing.assert_allclose(table['dfi(1)'], dfi[rows])
+
+def _fi_worst_case(x, error):
+    '''
+    dfi of the notebook before the errors module: |dti/tcw| + |dtcw*ti/tcw**2| with dtcw = dtl + dti
+    '''
+    tcw = x[:, errors.TL] + x[:, errors.TI]
+    dtcw = error[:, errors.TL] + error[:, errors.TI]
+    return np.abs(error[:, errors.TI]/tcw) + np.abs(dtcw*x[:, errors.TI]/tcw**2)
+
+def test_shapes_fi_error_changed(campaign):
+    '''
+    dfi is the linear propagation of the covariance, below the worst case sum of the notebook
+    '''
+    ## tl = ti = 1, dtl = dti = 0.1, independent: sqrt(2)*0.1/4 instead of 0.1/2 + 0.2/4
+    x = np.array([[1.0, 1.0, 10.0, 20.0]])
+    error = np.array([[0.1, 0.1, 1.0, 1.0]])
+    _, dfi = errors.linear(errors.ice_fraction, x, errors.covariance(error))
+    assert dfi[0] == pytest.approx(np.sqrt(2)*0.1/4, rel=1e-6)
+    assert _fi_worst_case(x, error)[0] == pytest.approx(0.1)
+    ## Campaign: smaller for every sample, whatever the correlation of tl and ti
+    table = shapes.read_tcwret(campaign['tcwret'])
+    with netCDF4.Dataset(campaign['tcwret']) as f:
+        seconds = f.variables['time_of_measurement'][:]
+        x, error, _ = errors.read_state(f)
+    rows = np.searchsorted(seconds, table['time'])
+    assert len(rows) > 0
+    assert (table['dfi(1)'].values < _fi_worst_case(x[rows], error[rows])).all()
+
+def test_shapes_variables(campaign, tmp_path):
+    '''
+    read_tcwret needs neither the liquid water path nor the averaging kernels if a covariance is stored
+    '''
+    fname = str(tmp_path / 'habit.nc')
+    with netCDF4.Dataset(campaign['tcwret']) as src, netCDF4.Dataset(fname, 'w') as dst:
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, len(dim))
+        for name, var in src.variables.items():
+            if name.startswith('liquid_water_path') or name == errors.AVERAGING_KERNEL:
+                continue
+            dst.createVariable(name, var.dtype, var.dimensions)[:] = var[:]
+    table = shapes.read_tcwret(fname)
+    pd.testing.assert_frame_equal(table, shapes.read_tcwret(campaign['tcwret']))
+    assert len(table) > 0
+    assert ((table['fi(1)'] > 0.0) & (table['fi(1)'] < 1.0)).all()
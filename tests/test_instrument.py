@@ -0,0 +1,58 @@
+'''
+Stages and netCDF byte counters of evaluation.instrument
+'''
+import os
+import subprocess
+import sys
+
+import netCDF4
+
+from evaluation import instrument
+
+def test_dataset_bytes(campaign, tmp_path):
+    original = netCDF4.Dataset
+    with instrument.isolated(True) as recorder:
+        assert netCDF4.Dataset is original
+        with instrument.stage('read'):
+            with instrument.dataset(campaign['tcwret']) as f:
+                assert isinstance(f, netCDF4.Dataset)
+                assert len(f.variables['time_of_measurement']) == campaign['samples']
+            ## Files opened without the wrapper are not counted
+            with netCDF4.Dataset(campaign['tcwret']) as f:
+                pass
+            instrument.dataset(campaign['tcwret']).close()
+        with instrument.stage('write'):
+            with instrument.dataset(str(tmp_path / 'out.nc'), 'w') as f:
+                f.createDimension('time', 10)
+        exported = recorder.export()
+    assert not instrument.enabled()
+    assert exported['stages']['read']['counters']['netcdf_read_bytes'] == 2*os.path.getsize(campaign['tcwret'])
+    assert exported['stages']['write']['counters']['netcdf_write_bytes'] == os.path.getsize(str(tmp_path / 'out.nc'))
+    ## Switched off: a plain dataset, nothing recorded
+    with instrument.dataset(campaign['tcwret']) as f:
+        assert type(f) is original
+
+def test_import_does_not_enable(tmp_path):
+    '''
+    Importing with EVALUATION_PROFILE set neither switches the recorder on nor changes netCDF4
+    '''
+    code = "import netCDF4; original = netCDF4.Dataset; from evaluation import cloudnet, instrument; " \
+           "print(instrument.enabled(), netCDF4.Dataset is original)"
+    env = dict(os.environ, EVALUATION_PROFILE=str(tmp_path / 'run.json'))
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.split() == ['False', 'True']
+    assert not (tmp_path / 'run.json').exists()
+
+def test_setup(tmp_path, monkeypatch):
+    monkeypatch.delenv(instrument.ENV, raising=False)
+    assert instrument.setup() is None and not instrument.enabled()
+    monkeypatch.setenv(instrument.ENV, str(tmp_path / 'run.json'))
+    try:
+        assert instrument.setup() is not None and instrument.enabled()
+        with instrument.stage('setup'):
+            instrument.count('items', 3)
+    finally:
+        report = instrument.disable()
+    assert report['stages']['setup']['counters'] == {'items': 3}
+    assert not instrument.enabled()
@@ -0,0 +1,20 @@
+'''
+merge_data.py on synthetic raw Cloudnet files (evaluation.synthetic)
+'''
+import os
+
+from evaluation import pipeline, synthetic
+
+merge_data = pipeline._script('merge_data')
+
+def test_merge_all_creates_outdir(tmp_path):
+    files = synthetic.generate(str(tmp_path), scale=0.1, ndays=2, levels=20, habits=False)
+    outdir = tmp_path / 'merged' / 'cnet'
+    summary = merge_data.merge_all(files['raw'], str(outdir), workers=1, verbose=False)
+    assert summary['failed'] == []
+    assert len(summary['merged']) == 2
+    for year, month, day in summary['merged']:
+        assert os.path.exists(os.path.join(str(outdir), merge_data.output_name(month, day)))
+    ## Up to date now
+    summary = merge_data.merge_all(files['raw'], str(outdir), workers=1, verbose=False)
+    assert summary['merged'] == [] and len(summary['skipped']) == 2
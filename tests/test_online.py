@@ -0,0 +1,62 @@
+'''
+Per-day statistics (evaluation.online) on synthetic data
+'''
+import numpy as np
+import pytest
+
+from evaluation import online, pipeline, stream
+
+def _partials(stats, day):
+    return {label: partial.to_dict() for label, partial in stats.days[day].items()}
+
+def test_update_by_day(campaign):
+    full = online.Statistics('lwp', y_max=[50.0])
+    changed = online.update(full, campaign['tcwret'], campaign['cnet'])
+    assert changed == [str(np.datetime64(date, 'D')) for date in campaign['dates']]
+    stats = online.Statistics('lwp', y_max=[50.0])
+    for day in reversed(campaign['dates']):
+        assert online.update(stats, campaign['tcwret'], campaign['cnet'], [day], chunk_size=100) == [str(np.datetime64(day, 'D'))]
+    for day in changed:
+        assert _partials(stats, day)['All']['moments'] == pytest.approx(_partials(full, day)['All']['moments'])
+        assert _partials(stats, day)['All']['hist_x'] == _partials(full, day)['All']['hist_x']
+    for row, other in zip(stats.table(), full.table()):
+        assert row['n'] == other['n'] and row['sd'] == pytest.approx(other['sd'], nan_ok=True)
+
+def test_update_reads_only_its_days(campaign, monkeypatch):
+    read = []
+    table = pipeline.tcwret_table
+    def counting(f, start=None, stop=None):
+        out = table(f, start, stop)
+        read.append(out['time'].to_numpy())
+        return out
+    monkeypatch.setattr(pipeline, 'tcwret_table', counting)
+    day = np.datetime64(campaign['dates'][0], 'D')
+    online.update(online.Statistics('lwp'), campaign['tcwret'], campaign['cnet'], [day])
+    times = np.concatenate(read)
+    all_times = pipeline.load_tcwret(campaign['tcwret'])['time'].to_numpy()
+    ## The day and its neighbours only
+    inside = (all_times >= day - 1) & (all_times < day + 2)
+    assert times.size == inside.sum() < all_times.size
+    np.testing.assert_array_equal(times, all_times[inside])
+
+def test_read_tcwret_ranges(campaign):
+    all_times = pipeline.load_tcwret(campaign['tcwret'])['time'].to_numpy()
+    day = np.datetime64(campaign['dates'][1], 'D')
+    ranges = [(day + np.timedelta64(12, 'h'), day + 1), (day, day + np.timedelta64(13, 'h')), (day + 2, day + 3)]
+    times = np.concatenate([chunk['time'].to_numpy() for chunk in stream.read_tcwret(campaign['tcwret'], 10, ranges)])
+    np.testing.assert_array_equal(times, all_times[(all_times >= day) & (all_times < day + 1)])
+
+def test_open_statistics(tmp_path):
+    fname = str(tmp_path / 'lwp.json')
+    stats = online.open_statistics(fname, 'lwp', y_max=[50.0], delta=5, invalid=[5, 6])
+    assert (stats.name, stats.delta, stats.invalid) == ('lwp', 5, [5, 6])
+    stats.save(fname)
+    ## An existing file keeps its settings
+    again = online.open_statistics(fname, 'lwp', delta=2)
+    assert again.to_dict() == stats.to_dict()
+    assert online.open_statistics(fname, 'lwp', invalid=(5, 6)).invalid == [5, 6]
+    ## Another comparison or other status codes
+    with pytest.raises(ValueError):
+        online.open_statistics(fname, 'iwp')
+    with pytest.raises(ValueError):
+        online.open_statistics(fname, 'lwp', invalid=[4, 5, 6])
@@ -0,0 +1,157 @@
+'''
+Cached stages of evaluation.pipeline on synthetic data
+'''
+import glob
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats
+
+from evaluation import pipeline
+from evaluation.cache import Cache
+
+def _args(campaign, cache, *options):
+    return pipeline.parse_args(['lwp', '--tcwret', campaign['tcwret'], '--cloudnet', campaign['cnet'], \
+                                '--cache', str(cache), '-q'] + list(options))
+
+def _run(campaign, cache, *options):
+    '''
+    Results and stage -> status of one run
+    '''
+    log = []
+    evaluate = pipeline.Pipeline.evaluate
+    def spy(self, stage):
+        value = evaluate(self, stage)
+        log[:] = self.log
+        return value
+    pipeline.Pipeline.evaluate = spy
+    try:
+        results = pipeline.main(_args(campaign, cache, *options))
+    finally:
+        pipeline.Pipeline.evaluate = evaluate
+    return results['lwp'], {(entry['stage'], entry['key']): entry['status'] for entry in log}
+
+def _statuses(log, status):
+    return sorted(stage for (stage, _), value in log.items() if value == status)
+
+def test_cache_hit(campaign, tmp_path):
+    rows, log = _run(campaign, tmp_path)
+    assert set(log.values()) == {'computed'}
+    assert rows[0]['data'] == 'All' and rows[0]['n'] > 10
+    cached, log = _run(campaign, tmp_path)
+    assert cached == rows
+    assert list(log.values()) == ['cached'] and _statuses(log, 'cached') == ['stats']
+
+def test_parameter_changes(campaign, tmp_path):
+    _run(campaign, tmp_path)
+    ## Only the statistics depend on the PWV threshold
+    _, log = _run(campaign, tmp_path, '--pwv-max', '0.5')
+    assert _statuses(log, 'computed') == ['stats']
+    assert _statuses(log, 'cached') == ['collocate']
+    ## The bin width changes both aggregates and everything after them
+    _, log = _run(campaign, tmp_path, '--delta', '5')
+    assert _statuses(log, 'computed') == ['aggregate', 'aggregate', 'collocate', 'stats']
+    assert _statuses(log, 'cached') == ['cloudnet', 'screen']
+    ## Screening of TCWret only
+    _, log = _run(campaign, tmp_path, '--tau-max', '4')
+    assert _statuses(log, 'computed') == ['aggregate', 'collocate', 'screen', 'stats']
+    assert _statuses(log, 'cached') == ['aggregate', 'tcwret']
+
+def test_input_fingerprint(campaign, tmp_path):
+    cnet = tmp_path / 'cnet'
+    shutil.copytree(campaign['cnet'], str(cnet))
+    campaign = dict(campaign, cnet=str(cnet))
+    _run(campaign, tmp_path / 'cache')
+    fname = sorted(glob.glob(str(cnet / 'cnet_*.nc')))[0]
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    _, log = _run(campaign, tmp_path / 'cache')
+    assert _statuses(log, 'computed') == ['aggregate', 'cloudnet', 'collocate', 'stats']
+    assert _statuses(log, 'cached') == ['aggregate']
+
+def test_eviction(tmp_path):
+    cache = Cache(str(tmp_path), 2500)
+    for key in 'abc':
+        cache.put(key, b'x' * 1000)
+        os.utime(cache._fname(key), (0, 0))
+    ## Limit 2500 bytes: the oldest entry was evicted when the third was stored
+    assert 'a' not in cache and 'b' in cache and 'c' in cache
+    os.utime(cache._fname('c'), (100, 100))
+    assert cache.get('b') is not None
+    cache.put('d', b'x' * 1000)
+    assert 'c' not in cache and 'b' in cache and 'd' in cache
+
+def test_cache_size_option(campaign, tmp_path):
+    _run(campaign, tmp_path / 'small', '--cache-size', '10K')
+    small = Cache(str(tmp_path / 'small'))
+    assert small.size() <= 10 << 10
+    ## Only the small results of the last stages are left, the tables read are computed again
+    rows, _ = _run(campaign, tmp_path / 'unlimited', '--delta', '5')
+    recomputed, log = _run(campaign, tmp_path / 'small', '--cache-size', '10K', '--delta', '5')
+    assert {'tcwret', 'screen', 'cloudnet'} <= set(_statuses(log, 'computed'))
+    assert recomputed == rows
+
+@pytest.mark.parametrize('chunk_size', ['50', '777', '100000'])
+def test_stream_equals_memory(campaign, tmp_path, chunk_size):
+    rows, _ = _run(campaign, tmp_path, '--y-max', '50')
+    streamed = pipeline.main(_args(campaign, tmp_path, '--y-max', '50', '--stream', '--chunk-size', chunk_size))['lwp']
+    assert [row['data'] for row in streamed] == [row['data'] for row in rows]
+    for row, other in zip(rows, streamed):
+        assert row['n'] == other['n']
+        for key in ['r', 'bias', 'sd']:
+            assert other[key] == pytest.approx(row[key], rel=1e-9, abs=1e-9, nan_ok=True)
+
+def _matched(campaign, name):
+    comparison = pipeline.COMPARISONS[name]
+    columns_a, columns_b = pipeline.columns(name)
+    tcwret = pipeline.screen(pipeline.load_tcwret(campaign['tcwret']), **comparison['screening'])
+    profiles = pipeline.load_cloudnet(campaign['cnet'], comparison['quantity'])
+    return pipeline.collocate(pipeline.aggregate(tcwret, 2, columns_a), pipeline.aggregate(profiles, 2, columns_b), \
+                              columns_a, columns_b)
+
+@pytest.mark.parametrize('name', list(pipeline.COMPARISONS))
+def test_notebook_selection(campaign, name):
+    '''
+    The selection of the notebooks: PWV <= 1.0 for LWP, PWV < 1.0 for IWP, rice and
+    rliq, and rice only from the bins with IWP > 0 in TCWret and in Cloudnet
+    '''
+    comparison = pipeline.COMPARISONS[name]
+    matched = _matched(campaign, name)
+    xax = matched[comparison['x']].to_numpy()
+    yax = matched[comparison['y'] + '_cnet'].to_numpy()
+    cax = matched['pwv(cm)'].to_numpy()
+    if name == 'rice':
+        idx = (matched['iwp(gm-2)'].to_numpy() > 0.0) & (matched['iwp(gm-2)_cnet'].to_numpy() > 0.0)
+        assert idx.any()
+    else:
+        idx = np.ones(xax.size, dtype=bool)
+    idx_pwv = idx & ((cax <= 1.0) if name == 'lwp' else (cax < 1.0))
+    rows = pipeline.statistics(matched, comparison['x'], comparison['y'] + '_cnet', pwv_max=[1.0], label=comparison['y'], \
+                               pwv=comparison['pwv'], positive=comparison['positive'])
+    assert [row['data'] for row in rows] == ['All', 'PWV {} 1.0'.format('<=' if name == 'lwp' else '<')]
+    for row, select in zip(rows, [idx, idx_pwv]):
+        assert row['n'] == select.sum() > 2
+        pearsonr, pval = scipy.stats.pearsonr(xax[select], yax[select])
+        diff = xax[select] - yax[select]
+        assert row['r'] == pytest.approx(pearsonr, rel=1e-9)
+        assert row['bias'] == pytest.approx(np.mean(diff), rel=1e-9)
+        assert row['sd'] == pytest.approx(np.std(diff), rel=1e-9)
+
+def test_subsets_operator():
+    '''
+    PWV on the threshold is in the subset for '<=' only, positive applies to every subset
+    '''
+    matched = pd.DataFrame({'pwv(cm)': [0.5, 1.0, 1.5, 0.5], 'y': [1.0, 2.0, 3.0, 4.0], \
+                            'iwp': [1.0, 1.0, 1.0, 0.0], 'iwp_cnet': [1.0, 1.0, 1.0, 1.0]})
+    masks = pipeline.subsets(matched, 'y', [1.0], [2.0])
+    assert masks['All'] is None
+    np.testing.assert_array_equal(masks['PWV <= 1.0'], [True, True, False, True])
+    np.testing.assert_array_equal(masks['y <= 2.0 PWV <= 1.0'], [True, True, False, False])
+    masks = pipeline.subsets(matched, 'y', [1.0], [2.0], pwv='<', positive=['iwp'])
+    assert list(masks) == ['All', 'PWV < 1.0', 'y <= 2.0', 'y <= 2.0 PWV < 1.0']
+    np.testing.assert_array_equal(masks['All'], [True, True, True, False])
+    np.testing.assert_array_equal(masks['PWV < 1.0'], [True, False, False, False])
+    np.testing.assert_array_equal(masks['y <= 2.0'], [True, True, False, False])
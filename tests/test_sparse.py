@@ -0,0 +1,115 @@
+'''
+Sparse index of the cloudy pixels (evaluation.sparse) and the index variables written by merge_data.py
+'''
+import os
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from evaluation import cloudnet, sparse
+
+def _dense(offset, level, nlevels):
+    '''
+    Boolean (time, level) array of the indexed pixels
+    '''
+    out = np.zeros((offset.size - 1, nlevels), dtype=bool)
+    out[sparse.rows(offset), level] = True
+    return out
+
+@pytest.fixture(scope='module')
+def day(campaign):
+    fname = os.path.join(campaign['cnet'], cloudnet.list_files(campaign['cnet'])[0])
+    with nc.Dataset(fname) as f:
+        return {name: f.variables[name][:] for name in f.variables}
+
+@pytest.mark.parametrize('phase', ['liquid', 'ice'])
+def test_merged_index(day, phase):
+    '''
+    The index rebuilds the cloudy pixels and their values of the merged day
+    '''
+    path = day[phase + '_water_path_per_layer']
+    offset = np.asarray(day[phase + '_offset'], dtype='i8')
+    level = np.asarray(day[phase + '_level'], dtype='i8')
+    cloudy = np.ma.getmaskarray(path) | (np.ma.getdata(path) > 0.0)
+    assert offset[0] == 0 and offset[-1] == level.size == cloudy.sum()
+    np.testing.assert_array_equal(_dense(offset, level, path.shape[1]), cloudy)
+    ## Ascending levels within each profile
+    assert (np.diff(level)[np.diff(sparse.rows(offset)) == 0] > 0).all()
+    ## Dense values from the gathered ones, clear sky is 0
+    values, mask = sparse.gather(path, offset, level)
+    dense = np.zeros(path.shape)
+    dense[sparse.rows(offset), level] = np.where(mask, np.nan, values)
+    expected = np.ma.filled(path.astype('f8'), np.nan)
+    np.testing.assert_array_equal(dense, expected)
+    ## Profiles without any cloudy pixel exist and have an empty segment
+    clear = ~cloudy.any(axis=1)
+    assert clear.any()
+    assert (np.diff(offset)[clear] == 0).all()
+
+def test_summary(day):
+    height = np.asarray(day['height'])
+    offset, level = np.asarray(day['liquid_offset'], dtype='i8'), np.asarray(day['liquid_level'], dtype='i8')
+    base, top, layers = sparse.summary(offset, level, height)
+    np.testing.assert_array_equal(base, np.ma.filled(day['liquid_cloud_base'], np.nan))
+    np.testing.assert_array_equal(top, np.ma.filled(day['liquid_cloud_top'], np.nan))
+    np.testing.assert_array_equal(layers, day['liquid_layers'])
+    cloudy = _dense(offset, level, height.size)
+    for time_idx in range(cloudy.shape[0]):
+        idx = np.flatnonzero(cloudy[time_idx])
+        if idx.size == 0:
+            assert np.isnan(base[time_idx]) and np.isnan(top[time_idx]) and layers[time_idx] == 0
+        else:
+            assert base[time_idx] == height[idx[0]] and top[time_idx] == height[idx[-1]]
+            assert layers[time_idx] == 1 + np.count_nonzero(np.diff(idx) > 1)
+
+def test_status_flags(day):
+    for name in ['liquid_water_content_status', 'ice_water_content_status', 'reff_Frisch_status', 'reff_ice_status']:
+        flags = sparse.status_flags(day[name])
+        np.testing.assert_array_equal(flags, day[name + '_flags'])
+        for invalid in [[2], [4, 5, 6], [2, 5, 6], [0], [15]]:
+            expected = np.isin(np.ma.filled(day[name], 0), invalid).any(axis=-1)
+            np.testing.assert_array_equal(sparse.flags_invalid(flags, invalid), expected)
+    with pytest.raises(ValueError):
+        sparse.status_flags(np.array([[0, 16]]))
+
+def test_segments():
+    '''
+    Reductions with empty profiles in between and masked pixels
+    '''
+    cloudy = np.array([[False, True, True, False], [False, False, False, False], [True, True, True, True], [False, False, False, False]])
+    offset, level = sparse.index(cloudy)
+    np.testing.assert_array_equal(offset, [0, 2, 2, 6, 6])
+    np.testing.assert_array_equal(level, [1, 2, 0, 1, 2, 3])
+    np.testing.assert_array_equal(sparse.rows(offset), [0, 0, 2, 2, 2, 2])
+    np.testing.assert_array_equal(sparse.position(offset), [0, 1, 0, 1, 2, 3])
+    data = np.array([1.0, 3.0, 2.0, 4.0, 6.0, 8.0])
+    mask = np.array([False, False, False, True, False, False])
+    np.testing.assert_array_equal(sparse.segment_sum(data, offset), [4.0, 0.0, 20.0, 0.0])
+    np.testing.assert_array_equal(sparse.segment_sum(data, offset, mask), [4.0, 0.0, 16.0, 0.0])
+    np.testing.assert_array_equal(sparse.segment_count(offset, mask), [2, 0, 3, 0])
+    np.testing.assert_array_equal(sparse.segment_mean(data, offset, mask), [2.0, np.nan, 16.0/3.0, np.nan])
+    np.testing.assert_array_equal(sparse.segment_max(data, offset, mask), [3.0, np.nan, 8.0, np.nan])
+
+def test_no_cloudy_pixel():
+    '''
+    Chunks without any cloudy pixel give float sums, NaN means and maxima
+    '''
+    offset, level = sparse.index(np.zeros((3, 5), dtype=bool))
+    np.testing.assert_array_equal(offset, [0, 0, 0, 0])
+    assert level.size == 0
+    data, mask = sparse.gather(np.ma.masked_array(np.zeros((3, 5)), np.zeros((3, 5), dtype=bool)), offset, level)
+    total = sparse.segment_sum(data, offset, mask)
+    assert total.dtype == np.float64
+    np.testing.assert_array_equal(total, [0.0, 0.0, 0.0])
+    assert np.isnan(sparse.segment_mean(data, offset, mask)).all()
+    assert np.isnan(sparse.segment_max(data, offset, mask)).all()
+    np.testing.assert_array_equal(sparse.segment_count(offset, mask), [0, 0, 0])
+    ## Through the integrator: clear sky gives LWP 0 and no valid rliq
+    var = {'liquid_water_path_per_layer': np.ma.zeros((3, 5)), 'liquid_water_content_status': np.zeros((3, 5), dtype='i4'), \
+           'liquid_water_path_MWR': np.ma.ones(3), 'liquid_water_path_error_MWR': np.ma.ones(3), \
+           'reff_Frisch': np.ma.zeros((3, 5)), 'reff_Frisch_error': np.ma.zeros((3, 5)), 'reff_Frisch_status': np.zeros((3, 5), dtype='i4'), \
+           'liquid_offset': offset, 'liquid_level': level}
+    out = cloudnet.compute(var, quantities=('liquid', 'rliq'))
+    np.testing.assert_array_equal(out['lwp(gm-2)'], [0.0, 0.0, 0.0])
+    assert not out['valid_rliq'].any()
@@ -0,0 +1,112 @@
+'''
+Campaign store (evaluation.store) built from the merged days of the synthetic campaign
+'''
+import os
+import shutil
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from evaluation import store, timeaxis
+
+VARIABLES = ['liquid_water_path_MWR', 'liquid_water_path_per_layer', 'reff_ice_status']
+
+def _days(campaign):
+    return store.list_days(campaign['cnet'])
+
+def _concatenate(fnames, variables):
+    '''
+    time and variables of the merged files one after the other
+    '''
+    out = {name: [] for name in ['time'] + variables}
+    for fname in fnames:
+        with nc.Dataset(fname) as f:
+            out['time'].append(timeaxis.read_time(f.variables['datetime']))
+            for name in variables:
+                out[name].append(f.variables[name][:])
+    return {name: np.ma.concatenate(value) if name != 'time' else np.concatenate(value) for name, value in out.items()}
+
+def _copy(days, path):
+    os.makedirs(str(path), exist_ok=True)
+    for _, fname in days:
+        shutil.copy(fname, str(path))
+
+@pytest.fixture(scope='module')
+def campaign_store(campaign, tmp_path_factory):
+    fname = str(tmp_path_factory.mktemp('store') / 'campaign.nc')
+    assert store.build(campaign['cnet'], fname, verbose=False) == len(_days(campaign))
+    return fname
+
+def test_list_days(campaign, tmp_path):
+    days = _days(campaign)
+    assert len(days) == len(campaign['dates'])
+    assert [date for date, _ in days] == sorted(campaign['dates'])
+    ## Names with a year and other files
+    for name in ['cnet_2018_06_02.nc', 'cnet_06_01.nc', 'lwc_06_01_2017.nc', 'cnet_6_1.nc']:
+        (tmp_path / name).write_bytes(b'')
+    assert [(date.isoformat(), os.path.basename(fname)) for date, fname in store.list_days(str(tmp_path))] == \
+        [('2017-06-01', 'cnet_06_01.nc'), ('2018-06-02', 'cnet_2018_06_02.nc')]
+
+def test_incremental_build(campaign, campaign_store, tmp_path):
+    '''
+    Appending day by day gives the same store as building it at once
+    '''
+    days = _days(campaign)
+    path = tmp_path / 'cnet'
+    fname = str(tmp_path / 'campaign.nc')
+    _copy(days[:1], path)
+    assert store.build(str(path), fname, verbose=False) == 1
+    _copy(days[1:], path)
+    assert store.build(str(path), fname, verbose=False) == len(days) - 1
+    ## Nothing new
+    assert store.build(str(path), fname, verbose=False) == 0
+    with store.Store(fname) as incremental, store.Store(campaign_store) as complete:
+        np.testing.assert_array_equal(incremental.time, complete.time)
+        for name in VARIABLES:
+            np.testing.assert_array_equal(incremental.read([name])[name], complete.read([name])[name])
+        ## First profile of each day
+        sizes = [len(_concatenate([fname_day], [])['time']) for _, fname_day in days]
+        np.testing.assert_array_equal(incremental.group.variables['day_start'][:], np.cumsum([0] + sizes[:-1]))
+        days_since = [(np.datetime64(date, 'D') - np.datetime64('1970-01-01', 'D')).astype('i8') for date, _ in days]
+        np.testing.assert_array_equal(incremental.group.variables['day'][:], days_since)
+
+def test_older_day(campaign, tmp_path):
+    days = _days(campaign)
+    path = tmp_path / 'cnet'
+    fname = str(tmp_path / 'campaign.nc')
+    _copy(days[1:], path)
+    store.build(str(path), fname, verbose=False)
+    _copy(days[:1], path)
+    with pytest.raises(ValueError):
+        store.build(str(path), fname, verbose=False)
+
+def test_cruises(campaign, campaign_store, tmp_path):
+    fname = str(tmp_path / 'campaign.nc')
+    shutil.copy(campaign_store, fname)
+    store.build(campaign['cnet'], fname, cruise='PS107', verbose=False)
+    assert store.cruises(fname) == ['PS106', 'PS107']
+
+def test_read(campaign, campaign_store):
+    expected = _concatenate([fname for _, fname in _days(campaign)], VARIABLES)
+    with store.Store(campaign_store) as data:
+        assert data.time.dtype == np.dtype('datetime64[s]')
+        assert set(VARIABLES) <= set(data.variables) and 'time' not in data.variables
+        ## Everything
+        out = data.read(VARIABLES)
+        np.testing.assert_array_equal(out['time'], expected['time'])
+        for name in VARIABLES:
+            np.testing.assert_array_equal(np.ma.getmaskarray(out[name]), np.ma.getmaskarray(expected[name]))
+            np.testing.assert_array_equal(np.ma.filled(out[name], 0), np.ma.filled(expected[name], 0))
+        ## [start, stop) on profile times and in between
+        time = expected['time']
+        for i0, i1 in [(0, 10), (5, 6), (100, time.size), (17, 17)]:
+            start, stop = time[i0], time[i1] if i1 < time.size else None
+            out = data.read(VARIABLES, start, stop)
+            np.testing.assert_array_equal(out['time'], time[i0:i1])
+            for name in VARIABLES:
+                np.testing.assert_array_equal(np.ma.filled(out[name], 0), np.ma.filled(expected[name][i0:i1], 0))
+        between = time[20] + (time[21] - time[20]) // 2
+        assert data.index(between, time[30]) == slice(21, 30)
+        assert data.index(time[0] - np.timedelta64(1, 'D'), time[0]) == slice(0, 0)
+        assert data.index(str(time[-1] + np.timedelta64(1, 's'))) == slice(time.size, time.size)
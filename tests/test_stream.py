@@ -0,0 +1,95 @@
+'''
+Streaming comparison (evaluation.stream) against the in-memory path
+'''
+import datetime as dt
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluation import binning, cloudnet, pipeline, stream, synthetic
+
+SHIFT = np.timedelta64(730, 'D')
+## Thresholds of the Cloudnet quantity for the subsets
+Y_MAX = {'lwp': 50.0, 'iwp': 30.0, 'rice': 40.0, 'rliq': 10.0}
+## Relative tolerance of the statistics: the running moments sum in another order than the in-memory statistics
+RTOL = 1e-9
+
+@pytest.fixture(scope='module')
+def later(tmp_path_factory):
+    '''
+    The campaign of conftest.campaign two years later
+    '''
+    path = str(tmp_path_factory.mktemp('later'))
+    files = synthetic.generate(path, scale=1, ndays=3, levels=30, habits=False, start=dt.date(2019, 5, 25))
+    files['cnet'] = os.path.join(path, 'cnet')
+    summary = pipeline._script('merge_data').merge_all(files['raw'], files['cnet'], workers=1, verbose=False)
+    assert not summary['failed']
+    return files
+
+def _assert_rows(rows, expected):
+    assert [row['data'] for row in rows] == [row['data'] for row in expected]
+    for row, other in zip(rows, expected):
+        assert row['n'] == other['n']
+        for key in ['r', 'p', 'bias', 'sd']:
+            assert row[key] == pytest.approx(other[key], rel=1e-9, abs=1e-12, nan_ok=True)
+
+def _in_memory(files, name, delta=2):
+    comparison = pipeline.COMPARISONS[name]
+    columns_a, columns_b = pipeline.columns(name)
+    tcwret = pipeline.screen(pipeline.load_tcwret(files['tcwret']), **comparison['screening'])
+    profiles = pipeline.load_cloudnet(files['cnet'], comparison['quantity'])
+    return pipeline.collocate(pipeline.aggregate(tcwret, delta, columns_a), pipeline.aggregate(profiles, delta, columns_b), \
+                              columns_a, columns_b)
+
+@pytest.mark.parametrize('name', ['lwp', 'iwp', 'rliq'])
+@pytest.mark.parametrize('chunk_size', [7, 777, 50000])
+def test_matched_bins(campaign, name, chunk_size):
+    expected = _in_memory(campaign, name)
+    assert len(expected) > 10
+    streamed = pd.concat(list(stream.matched_bins(campaign['tcwret'], campaign['cnet'], name, chunk_size=chunk_size)), \
+                         ignore_index=True)
+    pd.testing.assert_frame_equal(streamed[expected.columns], expected, check_exact=True)
+
+@pytest.mark.parametrize('name', list(pipeline.COMPARISONS))
+@pytest.mark.parametrize('chunk_size', [13, 100000])
+def test_compare_equals_pipeline(campaign, name, chunk_size):
+    '''
+    Same subsets and counts as the in-memory statistics, r, bias and SD up to RTOL
+    '''
+    comparison = pipeline.COMPARISONS[name]
+    expected = pipeline.statistics(_in_memory(campaign, name), comparison['x'], comparison['y'] + '_cnet', \
+                                   pwv_max=[1.0, 0.5], y_max=[Y_MAX[name]], label=comparison['y'], pwv=comparison['pwv'], \
+                                   positive=comparison['positive'])
+    rows = stream.compare(campaign['tcwret'], campaign['cnet'], name, pwv_max=[1.0, 0.5], y_max=[Y_MAX[name]], chunk_size=chunk_size)
+    assert [row['data'] for row in rows] == [row['data'] for row in expected]
+    assert expected[0]['n'] > 10
+    for row, other in zip(rows, expected):
+        assert row['n'] == other['n']
+        for key in ['r', 'p', 'bias', 'sd']:
+            assert row[key] == pytest.approx(other.get(key, np.nan), rel=RTOL, abs=1e-12, nan_ok=True)
+
+def test_other_campaign(campaign, later):
+    reference = stream.compare(campaign['tcwret'], campaign['cnet'], 'lwp', pwv_max=[1.0])
+    ## Outside of the default range (PS106) nothing is binned
+    assert stream.compare(later['tcwret'], later['cnet'], 'lwp')[0]['n'] == 0
+    rows = stream.compare(later['tcwret'], later['cnet'], 'lwp', pwv_max=[1.0], \
+                          origin=binning.ORIGIN + SHIFT, stop=binning.STOP + SHIFT)
+    _assert_rows(rows, reference)
+    args = pipeline.parse_args(['lwp', '--tcwret', later['tcwret'], '--cloudnet', later['cnet'], '--no-cache', '-q', \
+                                '--origin', str(binning.ORIGIN + SHIFT), '--stop', str(binning.STOP + SHIFT)])
+    _assert_rows(pipeline.main(args)['lwp'], reference)
+
+def test_several_years(campaign, later, tmp_path):
+    cnet = tmp_path / 'cnet'
+    shutil.copytree(campaign['cnet'], str(cnet))
+    for fname in os.listdir(later['cnet']):
+        assert not (cnet / fname).exists()
+        shutil.copy(os.path.join(later['cnet'], fname), str(cnet))
+    ## cnet_MM_DD.nc of 2017 and cnet_2019_MM_DD.nc do not collide and are read in time order
+    assert cloudnet.list_files(str(cnet)) == sorted(os.listdir(campaign['cnet'])) + sorted(os.listdir(later['cnet']))
+    reference = stream.compare(later['tcwret'], later['cnet'], 'lwp', origin=binning.ORIGIN + SHIFT, stop=binning.STOP + SHIFT)
+    rows = stream.compare(later['tcwret'], str(cnet), 'lwp', origin=binning.ORIGIN, stop=binning.STOP + SHIFT, chunk_size=100)
+    _assert_rows(rows, reference)
@@ -0,0 +1,52 @@
+'''
+Threshold sensitivity sweep (evaluation.sweep) against the statistics of single subsets
+'''
+import numpy as np
+import pytest
+
+from evaluation import bootstrap, pipeline, sweep
+
+def _cell(tcwret, profiles, name, pwv_max, **screening):
+    '''
+    x and y of the matched bins of one grid cell, computed stage by stage as in evaluation.pipeline
+    '''
+    comparison = pipeline.COMPARISONS[name]
+    columns_a = [comparison['x'], 'pwv(cm)']
+    columns_b = [comparison['y']]
+    matched = pipeline.collocate(pipeline.aggregate(pipeline.screen(tcwret, **screening), 2, columns_a), \
+                                 pipeline.aggregate(profiles, 2, columns_b), columns_a, columns_b)
+    select = matched['pwv(cm)'].to_numpy() <= pwv_max
+    return matched[comparison['x']].to_numpy()[select], matched[comparison['y'] + '_cnet'].to_numpy()[select]
+
+def test_cell(campaign):
+    tcwret = pipeline.load_tcwret(campaign['tcwret'])
+    profiles = pipeline.load_cloudnet(campaign['cnet'], 'liquid')
+    grid = {'tau_max': [4.0, 6.0], 'red_chi_2_max': [1.0, 2.0], 'pwv_max': [1.0, np.inf]}
+    result = sweep.sweep(tcwret, profiles, 'lwp(gm-2)', 'lwp_mwr(gm-2)', grid, workers=1)
+    assert len(result) == 8
+    for tau_max, red_chi_2_max, pwv_max in [(6.0, 1.0, 1.0), (4.0, 2.0, np.inf)]:
+        row = result[(result['tau_max'] == tau_max) & (result['red_chi_2_max'] == red_chi_2_max) & (result['pwv_max'] == pwv_max)].iloc[0]
+        x, y = _cell(tcwret, profiles, 'lwp', pwv_max, tau_max=tau_max, red_chi_2_max=red_chi_2_max)
+        assert x.size > 10 and row['n'] == x.size
+        r, bias, sd = bootstrap.statistics(x, y)
+        assert row['r'] == pytest.approx(r, rel=1e-9)
+        assert row['bias'] == pytest.approx(bias, rel=1e-9)
+        assert row['sd'] == pytest.approx(sd, rel=1e-9)
+        assert row['p'] == pytest.approx(bootstrap.summary(x, y)['p'], rel=1e-6)
+
+def test_large_values():
+    '''
+    Values far from 0 with a small spread, E[x**2] - E[x]**2 would cancel
+    '''
+    rng = np.random.default_rng(0)
+    x = 1e9 + rng.normal(0.0, 1.0, (3, 50))
+    y = x + rng.normal(0.5, 0.5, (3, 50))
+    w = rng.random((3, 50)) < 0.8
+    r, p, bias, sd, n = sweep._statistics(w, x, y)
+    for ii in range(3):
+        expected = bootstrap.statistics(x[ii][w[ii]], y[ii][w[ii]])
+        assert n[ii] == w[ii].sum()
+        assert r[ii] == pytest.approx(expected[0], rel=1e-6)
+        assert bias[ii] == pytest.approx(expected[1], rel=1e-6)
+        assert sd[ii] == pytest.approx(expected[2], rel=1e-6)
+    assert np.isfinite(p).all() and (sd > 0.0).all()
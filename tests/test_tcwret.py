@@ -0,0 +1,31 @@
+'''
+Conversion of TCWret result CSV files (evaluation.tcwret)
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluation import tcwret
+
+def _table(n=5):
+    rng = np.random.default_rng(1)
+    out = {'time': pd.date_range('2017-06-01', periods=n, freq='10min').strftime('%Y-%m-%d %H:%M:%S'), \
+           'lwp(gm-2)': rng.uniform(0, 100, n), 'dlwp(gm-2)': rng.uniform(0, 10, n)}
+    cov = np.einsum('nij,nkj->nik', *(2*[rng.normal(size=(n, 4, 4))]))
+    for ii in range(16):
+        out['cov_{}'.format(ii)] = cov.reshape(n, 16)[:, ii]
+        out['avk_{}'.format(ii)] = rng.uniform(0, 1, n)
+    return pd.DataFrame(out), cov
+
+@pytest.mark.parametrize('ending', ['\n', '', '\n\n'])
+def test_convert_line_endings(tmp_path, ending):
+    table, cov = _table()
+    text = table.to_csv(index=False).rstrip('\n') + ending
+    fname = tmp_path / 'results.csv'
+    fname.write_text(text)
+    res = tcwret.Results(tcwret.convert(str(fname), chunksize=2))
+    assert len(res) == len(table)
+    np.testing.assert_allclose(res['lwp(gm-2)'], table['lwp(gm-2)'])
+    np.testing.assert_allclose(res.cov, cov)
+    np.testing.assert_allclose(res.errors(), np.sqrt(np.diagonal(cov, axis1=1, axis2=2)))
+    assert res.time[-1] == np.datetime64(table['time'].iloc[-1])
@@ -0,0 +1,83 @@
+'''
+Vectorized time axes (evaluation.timeaxis) against the per-value conversions of merge_data.py and the notebooks
+'''
+import datetime as dt
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from evaluation import timeaxis
+
+HOURS = np.array([0.0, 0.00013, 0.5, 1.0/3600*0.5, 1.0/3600*1.5, 1.0/3600*2.5, 12.999999, 23.99986, 24.5])
+SECONDS = np.array([0.0, 0.4, 0.5, 0.6, 1.5, 59.999, 86399.7, 3.2e6 + 0.9])
+
+def test_parse_units():
+    assert timeaxis.parse_units("hours since 2017-05-24 00:00:00 +00:00") == (3600, np.datetime64('2017-05-24T00:00:00'))
+    assert timeaxis.parse_units(timeaxis.UNITS_TCWRET) == (1, np.datetime64('2017-05-01T00:00:00'))
+    assert timeaxis.parse_units("days since 2017-6-1T12:30") == (86400, np.datetime64('2017-06-01T12:30:00'))
+    assert timeaxis.parse_units("Minutes since 1970-01-01 00:00:01.6") == (60, np.datetime64('1970-01-01T00:00:02'))
+    for units in ["fortnights since 2017-01-01", "hours", "hours after 2017-01-01"]:
+        with pytest.raises(ValueError):
+            timeaxis.parse_units(units)
+
+def test_round():
+    '''
+    Cloudnet hours as merge_data.py: day + timedelta(seconds=int(np.round(hours*3600)))
+    '''
+    day = dt.datetime(2017, 5, 24)
+    expected = [np.datetime64(day + dt.timedelta(seconds=int(np.round(hour*3600))), 's') for hour in HOURS]
+    out = timeaxis.decode(HOURS, "hours since 2017-05-24 00:00:00 +00:00")
+    assert out.dtype == np.dtype('datetime64[s]')
+    np.testing.assert_array_equal(out, expected)
+
+def test_trunc():
+    '''
+    TCWret seconds as the notebooks: start + timedelta(seconds=int(seconds))
+    '''
+    start = dt.datetime(2017, 5, 1)
+    expected = [np.datetime64(start + dt.timedelta(seconds=int(second)), 's') for second in SECONDS]
+    np.testing.assert_array_equal(timeaxis.decode(SECONDS, timeaxis.UNITS_TCWRET, rounding='trunc'), expected)
+    ## Round and trunc differ above half a second, np.round rounds halves to even
+    rounded = timeaxis.decode(SECONDS, timeaxis.UNITS_TCWRET)
+    np.testing.assert_array_equal(rounded != timeaxis.decode(SECONDS, timeaxis.UNITS_TCWRET, rounding='trunc'), \
+                                  [False, False, False, True, True, True, True, True])
+    assert rounded[2] == np.datetime64('2017-05-01T00:00:00') and rounded[4] == np.datetime64('2017-05-01T00:00:02')
+    with pytest.raises(ValueError):
+        timeaxis.decode(SECONDS, timeaxis.UNITS_TCWRET, rounding='floor')
+
+def test_missing_values():
+    values = np.ma.masked_array([1.0, 2.0, np.nan, np.inf, 5.0], [False, True, False, False, False])
+    out = timeaxis.decode(values, "hours since 2017-06-01")
+    np.testing.assert_array_equal(np.isnat(out), [False, True, True, True, False])
+    assert out[4] == np.datetime64('2017-06-01T05:00:00')
+    ## Two dimensional input keeps its shape
+    assert timeaxis.decode(np.zeros((2, 3)), "hours since 2017-06-01").shape == (2, 3)
+
+@pytest.mark.parametrize('units', ["seconds since 2017-05-01", "hours since 2017-06-01 00:00:00", "days since 1970-01-01"])
+def test_encode(units):
+    times = np.array(['2017-06-01T00:00:00', '2017-06-01T13:07:59', 'NaT', '2017-07-18T23:59:59'], dtype='datetime64[s]')
+    offsets = timeaxis.encode(times, units)
+    assert np.isnan(offsets[2]) and np.isfinite(offsets[[0, 1, 3]]).all()
+    np.testing.assert_array_equal(timeaxis.decode(offsets, units), times)
+    ## Scalars stay scalars
+    assert np.ndim(timeaxis.encode(times[1], units)) == 0
+    assert timeaxis.decode(timeaxis.encode(times[1], units), units) == times[1]
+
+def test_read_time(tmp_path):
+    fname = str(tmp_path / 'time.nc')
+    with nc.Dataset(fname, 'w') as f:
+        f.createDimension('time', HOURS.size)
+        time = f.createVariable('time', 'f8', ('time', ), fill_value=-999.0)
+        time.units = "hours since 2017-05-24 00:00:00 +00:00"
+        time[:] = np.ma.masked_array(HOURS, np.arange(HOURS.size) == 3)
+        bare = f.createVariable('bare', 'f8', ('time', ))
+        bare[:] = HOURS
+    with nc.Dataset(fname) as f:
+        out = timeaxis.read_time(f.variables['time'])
+        assert np.isnat(out[3]) and not np.isnat(np.delete(out, 3)).any()
+        np.testing.assert_array_equal(np.delete(out, 3), np.delete(timeaxis.decode(HOURS, f.variables['time'].units), 3))
+        np.testing.assert_array_equal(timeaxis.read_time(f.variables['bare'], "hours since 2017-05-24"), \
+                                      timeaxis.decode(HOURS, "hours since 2017-05-24"))
+        with pytest.raises(ValueError):
+            timeaxis.read_time(f.variables['bare'])